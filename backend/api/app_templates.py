@@ -0,0 +1,113 @@
+"""
+Registry of the app templates in `app_templates.v2`.
+
+Every template file is parsed and compiled once. The parsed metadata and the compiled django template are kept
+in memory and reused until the file on disk changes (detected by mtime, inode and size).
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import django.template
+import yaml
+from django.conf import settings
+
+from api.logs import LogParser
+
+TEMPLATE_SUFFIX = ".yml"
+
+
+class AppTemplate(NamedTuple):
+    """A parsed app template.
+
+    Args:
+        name (str): Name of the template, which is the file name without suffix. Ex.: mc_forge
+        title (str): Human readable name of the template. Ex.: Minecraft Forge
+        description (str): Description of the template
+        options (list): The template specific options, each a dict with key, value and description
+        config (dict): The whole parsed (not rendered) template file
+        compiled (django.template.Template): The compiled template, ready to be rendered
+        log_parser (LogParser): Classifies the log lines of the servers, compiled from the `log_format` section
+    """
+
+    name: str
+    title: str
+    description: str
+    options: List[Dict[str, Any]]
+    config: Dict[str, Any]
+    compiled: django.template.Template
+    log_parser: LogParser
+
+    @property
+    def command_prefix(self) -> str:
+        return self.config.get("command_prefix")
+
+
+class TemplateRegistry:
+    """Parses app templates on first use and caches them by file identity."""
+
+    def __init__(self, directory: str):
+        self.directory = str(directory)
+        self._cache: Dict[str, Tuple[Tuple[int, int, int], AppTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> AppTemplate:
+        """Returns the template with the given name.
+
+        Args:
+            name (str): Name of the template. Ex.: mc_forge
+
+        Returns:
+            AppTemplate: the parsed template
+
+        Raises:
+            FileNotFoundError: there is no template with this name
+        """
+
+        if not name or os.sep in name or name.startswith("."):
+            raise FileNotFoundError(f"template {name} does not exist")
+
+        path = os.path.join(self.directory, name + TEMPLATE_SUFFIX)
+        stat = os.stat(path)
+        identity = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+        cached = self._cache.get(name)
+        if cached and cached[0] == identity:
+            return cached[1]
+
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached and cached[0] == identity:
+                return cached[1]
+            template = self._load(name, path)
+            self._cache[name] = (identity, template)
+            return template
+
+    def all(self) -> List[AppTemplate]:
+        """Returns all available templates, sorted by name."""
+
+        names = sorted(entry.name[:-len(TEMPLATE_SUFFIX)] for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith(TEMPLATE_SUFFIX))
+        for name in list(self._cache):
+            if name not in names:
+                self._cache.pop(name, None)
+        return [self.get(name) for name in names]
+
+    @staticmethod
+    def _load(name: str, path: str) -> AppTemplate:
+        with open(path, "r") as file:
+            template_string = file.read()
+        config = yaml.safe_load(template_string)
+        return AppTemplate(
+            name=name,
+            title=config["name"],
+            description=config["description"],
+            options=config.get("options") or [],
+            config=config,
+            compiled=django.template.Template(template_string),
+            log_parser=LogParser.from_config(config.get("log_format"))
+        )
+
+
+template_registry = TemplateRegistry(settings.APP_TEMPLATES_DIR)
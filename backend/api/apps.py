@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PanelConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        if settings.PROMETHEUS_SERVER_METRICS_ENABLED:
+            from prometheus_client import REGISTRY
+
+            from api.collector import get_collector
+            from api.exporter import ServerMetricsExporter
+
+            REGISTRY.register(ServerMetricsExporter(get_collector))
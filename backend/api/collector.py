@@ -0,0 +1,329 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from api.metrics import metrics_history
+
+logger = logging.getLogger(__name__)
+
+
+class StatsReading(NamedTuple):
+    """A single usage reading of a server.
+
+    Args:
+        cpu_usage (float): cpu usage as returned by `Server.stats`
+        memory_usage (float): memory usage in bytes
+        sampled_at (float): unix timestamp of the moment the reading was taken
+        running (bool): whether the main container was running
+        cpu_seconds (float): cpu time used by the main container since it started
+        restart_count (int): number of times docker restarted the main container
+        network_rx_bytes (float): bytes received by the main container
+        network_tx_bytes (float): bytes sent by the main container
+        block_read_bytes (float): bytes read from block devices by the main container
+        block_write_bytes (float): bytes written to block devices by the main container
+        network_rx_rate (float): bytes per second received since the previous reading
+        network_tx_rate (float): bytes per second sent since the previous reading
+        block_read_rate (float): bytes per second read since the previous reading
+        block_write_rate (float): bytes per second written since the previous reading
+    """
+
+    cpu_usage: float
+    memory_usage: float
+    sampled_at: float
+    running: bool = False
+    cpu_seconds: float = 0.0
+    restart_count: int = 0
+    network_rx_bytes: float = 0.0
+    network_tx_bytes: float = 0.0
+    block_read_bytes: float = 0.0
+    block_write_bytes: float = 0.0
+    network_rx_rate: float = 0.0
+    network_tx_rate: float = 0.0
+    block_read_rate: float = 0.0
+    block_write_rate: float = 0.0
+
+    @property
+    def age(self) -> float:
+        """Seconds elapsed since the reading was taken."""
+
+        return time.time() - self.sampled_at
+
+
+def parse_container_stats(stats: Dict[str, Any], restart_count: int = 0) -> StatsReading:
+    """Turns the response of `container.stats(stream=False)` into a reading.
+
+    Args:
+        stats (dict): the stats returned by docker
+        restart_count (int): the `RestartCount` of the container
+
+    Returns:
+        StatsReading: the reading of a running container
+    """
+
+    cpu_stats = stats["cpu_stats"]
+    precpu_stats = stats["precpu_stats"]
+    cpu_delta = cpu_stats["cpu_usage"]["total_usage"] - precpu_stats["cpu_usage"]["total_usage"]
+    system_cpu_delta = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get("system_cpu_usage", 0)
+    cpu_usage = (cpu_delta / system_cpu_delta) * cpu_stats["online_cpus"] if system_cpu_delta > 0 else 0.0
+
+    networks = (stats.get("networks") or {}).values()
+    block_io = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    return StatsReading(
+        cpu_usage=cpu_usage,
+        memory_usage=stats["memory_stats"]["usage"],
+        sampled_at=time.time(),
+        running=True,
+        cpu_seconds=cpu_stats["cpu_usage"]["total_usage"] / 1e9,
+        restart_count=restart_count,
+        network_rx_bytes=sum(network["rx_bytes"] for network in networks),
+        network_tx_bytes=sum(network["tx_bytes"] for network in networks),
+        block_read_bytes=sum(entry["value"] for entry in block_io if entry["op"].lower() == "read"),
+        block_write_bytes=sum(entry["value"] for entry in block_io if entry["op"].lower() == "write"),
+    )
+
+
+def with_rates(previous: Optional[StatsReading], current: StatsReading) -> StatsReading:
+    """Adds the network and block io rates since the previous reading of the same container to a reading.
+
+    Counters that went down (the container was restarted) count as a rate of 0.
+    """
+
+    if previous is None or not previous.running or not current.running:
+        return current
+    elapsed = current.sampled_at - previous.sampled_at
+    if elapsed <= 0:
+        return current
+
+    def rate(field: str) -> float:
+        return max(0.0, getattr(current, field) - getattr(previous, field)) / elapsed
+
+    return current._replace(network_rx_rate=rate("network_rx_bytes"), network_tx_rate=rate("network_tx_bytes"),
+                            block_read_rate=rate("block_read_bytes"), block_write_rate=rate("block_write_bytes"))
+
+
+def reading_key(server_id: str, service: str = "main") -> str:
+    """Returns the key the reading of a service of a server is stored under, the main service uses the server id."""
+
+    return server_id if service == "main" else f"{server_id}/{service}"
+
+
+class StatsCollector:
+    """Samples the stats of all servers in the background.
+
+    A daemon thread walks over every `Server` each `interval` seconds and samples its stats on a small
+    thread pool, so the slow `container.stats` calls of different servers overlap.
+    In "stream" mode it only keeps a stats stream open per running server instead, see `api.stats_streams`.
+    The containers of the `sidecars` services (ex.: "sftp") are sampled next to the main container in both modes.
+    The latest reading of every server is kept in memory and can be read without touching docker.
+    """
+
+    def __init__(self, interval: float, workers: int, mode: str = "poll", sink=None, sidecars: Sequence[str] = ()):
+        self.interval = interval
+        self.workers = workers
+        self.mode = mode
+        self.sidecars = tuple(sidecars)
+        # receives every reading and removal as well, see `api.shared_state.SharedStateWriter`
+        self.sink = sink
+        self.streams = None
+        if mode == "stream":
+            from api.stats_streams import StatsStreamPool
+
+            self.streams = StatsStreamPool(self._store)
+        elif mode != "poll":
+            raise ValueError(f"unknown stats mode {mode!r}, use 'poll' or 'stream'")
+        self._readings: Dict[str, StatsReading] = {}
+        self._servers: List[Any] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Starts the collector thread if it is not running yet."""
+
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self.run, name="stats-collector", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the collector thread after the current round."""
+
+        self._stop_event.set()
+
+    def get(self, server_id: str, service: str = "main") -> Optional[StatsReading]:
+        """Returns the latest reading of a server.
+
+        Args:
+            server_id (str): ID of the server
+            service (str): The service whose container the reading is of, ex.: "sftp"
+
+        Returns:
+            StatsReading: The latest reading or `None` if the server was not sampled yet
+        """
+
+        return self._readings.get(reading_key(server_id, service))
+
+    def snapshot(self) -> List[Tuple[Any, Optional[StatsReading]]]:
+        """Returns the servers of the last round with their latest readings, without touching docker or the db.
+
+        Returns:
+            list: `(api.models.Server, StatsReading or None)` tuples
+        """
+
+        servers = self._servers
+        return [(server, self._readings.get(server.server_id)) for server in servers]
+
+    def forget(self, server_id: str):
+        """Drops the reading of a server, e.g. after it was deleted."""
+
+        for service in ("main", *self.sidecars):
+            key = reading_key(server_id, service)
+            with self._lock:
+                self._readings.pop(key, None)
+            if self.sink is not None:
+                self.sink.remove(key)
+
+    def sample_server(self, server) -> StatsReading:
+        """Samples the stats of a single server and stores the reading.
+
+        Args:
+            server (api.models.Server): The server to sample
+
+        Returns:
+            StatsReading: The new reading
+        """
+
+        reading = server.usage
+        self._store(server.server_id, reading)
+        self._sample_sidecars(server)
+        return reading
+
+    def _sample_sidecars(self, server):
+        for service in self.sidecars:
+            self._store(reading_key(server.server_id, service), server.service_usage(service), record_history=False)
+
+    def sample_all(self):
+        """Samples the stats of all servers once."""
+
+        from api.models import Server
+
+        servers = list(Server.objects.all())
+        known_ids = {server.server_id for server in servers}
+        self._servers = servers
+        if self.streams is not None:
+            self._sync_streams(servers)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stats-sampler") as pool:
+                for server, result in zip(servers, pool.map(self._sample_safely, servers)):
+                    if isinstance(result, Exception):
+                        logger.warning("could not sample stats of %s: %s", server.name, result)
+
+        # the sink may hold readings of a previous collector process as well
+        keys = set(self._readings) | set(self.sink.keys() if self.sink is not None else ())
+        with self._lock:
+            for key in keys:
+                server_id = key.split("/", 1)[0]
+                if server_id not in known_ids:
+                    self._readings.pop(key, None)
+                    metrics_history.forget(server_id)
+                    if self.sink is not None:
+                        self.sink.remove(key)
+        metrics_history.flush_if_due()
+
+    def _sync_streams(self, servers):
+        """Keeps a stats stream open for every running server, stopped servers get an idle reading."""
+
+        from api.loaders import load_container_statuses
+
+        statuses = load_container_statuses(servers)
+        running = [server for server, status in zip(servers, statuses) if status == "running"]
+        self.streams.sync(running)
+        now = time.time()
+        for server, status in zip(servers, statuses):
+            if status != "running":
+                self._store(server.server_id, StatsReading(0, 0, now))
+        if self.sidecars:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stats-sampler") as pool:
+                for server, result in zip(servers, pool.map(self._sample_sidecars_safely, servers)):
+                    if isinstance(result, Exception):
+                        logger.warning("could not sample stats of the sidecars of %s: %s", server.name, result)
+
+    def _store(self, key: str, reading: StatsReading, record_history: bool = True):
+        with self._lock:
+            reading = with_rates(self._readings.get(key), reading)
+            self._readings[key] = reading
+        if self.sink is not None:
+            self.sink.write(key, reading)
+        if record_history:
+            metrics_history.record(key, reading.sampled_at, reading.cpu_usage, reading.memory_usage)
+
+    def _sample_safely(self, server):
+        try:
+            return self.sample_server(server)
+        except Exception as e:  # a single broken container must not stop the collector
+            return e
+        finally:
+            close_old_connections()
+
+    def _sample_sidecars_safely(self, server):
+        try:
+            return self._sample_sidecars(server)
+        except Exception as e:
+            return e
+
+    def run(self):
+        """Runs the collector loop in the calling thread until `stop` is called."""
+
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            close_old_connections()
+            try:
+                self.sample_all()
+            except Exception:
+                logger.exception("stats collector round failed")
+            finally:
+                close_old_connections()
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_collector():
+    """Returns the process wide stats collector.
+
+    The collector is created on first use. Its thread is started as well unless
+    `STATS_COLLECTOR_ENABLED` is turned off, e.g. in management commands or tests.
+    If `SHARED_STATE_PATH` is set, the readings come from the `manage.py run_collector` process instead
+    and a `api.shared_state.SharedStateReader` is returned, which offers `get`, `snapshot` and `forget` as well.
+
+    Returns:
+        StatsCollector: the shared collector instance
+    """
+
+    global _collector
+    if _collector is None:
+        with _collector_lock:
+            if _collector is None:
+                if settings.SHARED_STATE_PATH:
+                    from api.shared_state import SharedStateReader
+
+                    _collector = SharedStateReader(settings.SHARED_STATE_PATH)
+                    return _collector
+                _collector = StatsCollector(settings.STATS_COLLECTOR_INTERVAL, settings.STATS_COLLECTOR_WORKERS,
+                                            settings.STATS_COLLECTOR_MODE, sidecars=settings.STATS_SIDECAR_SERVICES)
+                if settings.STATS_COLLECTOR_ENABLED:
+                    _collector.start()
+                    if settings.LOG_INDEX_ENABLED:  # the log index is fed by the same process as the readings
+                        from api.log_index import log_indexer
+
+                        log_indexer.start()
+    return _collector
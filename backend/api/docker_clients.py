@@ -0,0 +1,137 @@
+"""
+Process wide registry of docker clients.
+
+Every docker host gets exactly one client that is shared by all threads of the process.
+Its HTTP connections are kept alive and pooled, so requests don't open a new connection to the daemon each time.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import docker
+from django.conf import settings
+from prometheus_client import Counter, Gauge
+
+pool_hits = Counter("containerpanel_docker_client_pool_hits_total",
+                    "Docker client lookups served by an existing client", ["host"])
+pool_misses = Counter("containerpanel_docker_client_pool_misses_total",
+                      "Docker client lookups that had to create a new client", ["host"])
+requests_in_flight = Gauge("containerpanel_docker_requests_in_flight",
+                           "Docker API requests currently waiting for a response", ["host"])
+
+
+class InstrumentedAPIClient(docker.APIClient):
+    """A docker `APIClient` that keeps track of the requests currently in flight."""
+
+    def __init__(self, host: str, *args, **kwargs):
+        self.host = host
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    @contextmanager
+    def _track_request(self):
+        with self._in_flight_lock:
+            self.in_flight += 1
+        requests_in_flight.labels(self.host).inc()
+        try:
+            yield
+        finally:
+            requests_in_flight.labels(self.host).dec()
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    def request(self, *args, **kwargs):
+        with self._track_request():
+            return super().request(*args, **kwargs)
+
+
+class PooledDockerClient(docker.DockerClient):
+    """A `DockerClient` backed by an `InstrumentedAPIClient`."""
+
+    def __init__(self, host: str, **kwargs):
+        self.api = InstrumentedAPIClient(host, **kwargs)
+
+
+class DockerClientRegistry:
+    """Hands out one shared docker client per host.
+
+    Hosts are the values of `Server.host`. A host is connected to the url configured for it in
+    `settings.DOCKER_HOSTS`, every other host uses the local daemon configured by the environment.
+    """
+
+    def __init__(self, urls: Dict[str, str], timeout: int, pool_size: int, version: Optional[str] = None):
+        self.urls = urls
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._clients: Dict[str, PooledDockerClient] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: Optional[str] = None) -> PooledDockerClient:
+        """Returns the client for a host, creating it on first use.
+
+        Args:
+            host (str): The docker host, defaults to `settings.SERVER_DEFAULT_HOST`
+
+        Returns:
+            PooledDockerClient: the shared client for this host
+        """
+
+        host = host or settings.SERVER_DEFAULT_HOST
+        client = self._clients.get(host)
+        if client is not None:
+            self.hits += 1
+            pool_hits.labels(host).inc()
+            return client
+
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                client = self._create_client(host)
+                self._clients[host] = client
+                self.misses += 1
+                pool_misses.labels(host).inc()
+            else:
+                self.hits += 1
+                pool_hits.labels(host).inc()
+        return client
+
+    def _create_client(self, host: str) -> PooledDockerClient:
+        if host in self.urls:
+            kwargs = {"base_url": self.urls[host]}
+        else:
+            kwargs = docker.utils.kwargs_from_env()
+        return PooledDockerClient(host, version=self.version, timeout=self.timeout, max_pool_size=self.pool_size,
+                                  **kwargs)
+
+    def close(self):
+        """Closes the connections of all clients and empties the registry."""
+
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    @property
+    def stats(self) -> Dict[str, object]:
+        """Returns the hit/miss counters and the requests in flight per host."""
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "in_flight": {host: client.api.in_flight for host, client in self._clients.items()}
+        }
+
+
+registry = DockerClientRegistry(settings.DOCKER_HOSTS, settings.DOCKER_CLIENT_TIMEOUT,
+                                settings.DOCKER_CLIENT_POOL_SIZE, settings.DOCKER_API_VERSION)
+
+
+def get_docker_client(host: Optional[str] = None) -> PooledDockerClient:
+    """Returns the shared docker client for a host, see `DockerClientRegistry.get`."""
+
+    return registry.get(host)
@@ -0,0 +1,330 @@
+"""
+In-memory index of the main containers of all servers, kept current by the docker events stream.
+
+Without it, every `Server.load_container` inspects the container and every `Server.running` re-reads its status.
+A watcher thread per docker host lists the main containers once, then applies container events
+(start, stop, die, oom, health_status, ...) as they arrive. After the stream breaks it reconnects and resyncs.
+While a host is not synced, lookups report it as unknown and callers fall back to the docker api.
+
+With `SHARED_STATE_PATH` set, only the collector process (`manage.py run_collector`) watches docker. It writes the
+index into a file next to the shared state whenever it changes, and at least every `PUBLISH_INTERVAL` seconds.
+Web workers read that file instead, and treat hosts as unknown if the collector stopped writing it.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from api.docker_clients import get_docker_client
+
+logger = logging.getLogger(__name__)
+
+MAIN_SERVICE_FILTER = {"label": "com.docker.compose.service=main"}
+PROJECT_LABEL = "com.docker.compose.project"
+
+# status of the container after an event, events that are missing here do not change it
+STATUS_BY_ACTION = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "stop": "exited",
+    "die": "exited",
+}
+# actions after which the container is running again
+START_ACTIONS = ("start", "restart", "unpause")
+# seconds between two writes of the shared index without changes, it is stale after `STALE_AFTER` seconds
+PUBLISH_INTERVAL = 5.0
+STALE_AFTER = 3 * PUBLISH_INTERVAL
+# seconds a worker reuses the shared index before it checks the file for a newer one
+SHARED_CHECK_INTERVAL = 0.1
+
+
+class ContainerState(NamedTuple):
+    """The last known state of a main container.
+
+    Args:
+        id (str): ID of the container
+        name (str): Name of the container, ex.: "myserver_main_1"
+        status (str): ex.: "running" or "exited"
+        health (str): "starting", "healthy", "unhealthy" or `None` if the container has no health check
+        oom_killed (bool): whether the container was killed for running out of memory since it was last started
+        has_healthcheck (bool): whether the container has a health check, `None` if it is not known yet
+    """
+
+    id: str
+    name: str
+    status: str
+    health: Optional[str] = None
+    oom_killed: bool = False
+    has_healthcheck: Optional[bool] = None
+
+    def to_attrs(self) -> Dict:
+        """Builds the subset of the inspect response that `docker.models.containers.Container` needs."""
+
+        state = {"Status": self.status, "OOMKilled": self.oom_killed}
+        if self.health:
+            state["Health"] = {"Status": self.health}
+        return {"Id": self.id, "Name": "/" + self.name, "State": state}
+
+
+def parse_health(status_text: str) -> Optional[str]:
+    """Reads the health from the human readable status of `docker ps`, ex.: "Up 5 minutes (healthy)"."""
+
+    if "(health: starting)" in status_text:
+        return "starting"
+    if "(unhealthy)" in status_text:
+        return "unhealthy"
+    if "(healthy)" in status_text:
+        return "healthy"
+    return None
+
+
+def has_healthcheck(attrs: Dict) -> bool:
+    """Reads from an inspect response whether the container has a health check."""
+
+    test = ((attrs.get("Config") or {}).get("Healthcheck") or {}).get("Test") or []
+    return bool(test) and test != ["NONE"]
+
+
+class SharedIndexFile:
+    """The synced hosts of the index of the collector process, written to a file that the workers read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._hosts: Dict[str, Dict[str, ContainerState]] = {}
+        self._written_at = 0.0
+        self._mtime: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def write(self, hosts: Dict[str, Dict[str, ContainerState]]):
+        data = {"written_at": time.time(),
+                "hosts": {host: {project: list(state) for project, state in containers.items()}
+                          for host, containers in hosts.items()}}
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(data, file)
+        os.replace(temporary, self.path)
+
+    def read(self) -> Dict[str, Dict[str, ContainerState]]:
+        """Returns the containers of the synced hosts, none if the collector stopped writing the file."""
+
+        if time.monotonic() - self._checked_at >= SHARED_CHECK_INTERVAL:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                    if mtime != self._mtime:
+                        with open(self.path) as file:
+                            data = json.load(file)
+                        self._hosts = {host: {project: ContainerState(*state) for project, state in containers.items()}
+                                       for host, containers in data["hosts"].items()}
+                        self._written_at = data["written_at"]
+                        self._mtime = mtime
+                except (OSError, ValueError, KeyError, TypeError):  # not written yet
+                    self._hosts = {}
+        if time.time() - self._written_at > STALE_AFTER:
+            return {}
+        return self._hosts
+
+
+class ContainerIndex:
+    """Maps compose project names to the state of their main container, per docker host.
+
+    With a `shared_path`, the index only watches docker once `publish` is called and reads the file otherwise.
+    """
+
+    def __init__(self, enabled: bool, reconnect_interval: float, shared_path: str = ""):
+        self.enabled = enabled
+        self.reconnect_interval = reconnect_interval
+        self.shared = SharedIndexFile(shared_path) if shared_path else None
+        self.publishing = False
+        self._containers: Dict[str, Dict[str, ContainerState]] = {}
+        self._synced = set()
+        self._watchers: Dict[str, threading.Thread] = {}
+        self._changed = threading.Event()
+        self._lock = threading.Lock()
+
+    def publish(self):
+        """Makes this process watch docker and write the index into the shared file, see `manage.py run_collector`."""
+
+        if self.shared is None or self.publishing:
+            return
+        self.publishing = True
+        threading.Thread(target=self._publish, name="docker-events-publisher", daemon=True).start()
+
+    @property
+    def reads_shared(self) -> bool:
+        return self.shared is not None and not self.publishing
+
+    def lookup(self, host: str, project: str) -> Tuple[bool, Optional[ContainerState]]:
+        """Looks up the main container of a compose project.
+
+        Starts watching the host on first use.
+
+        Args:
+            host (str): The docker host of the server
+            project (str): The compose project name, which is the server name
+
+        Returns:
+            bool: whether the index knows the host, if not the docker api has to be asked
+            ContainerState: the state of the container or `None` if it does not exist
+        """
+
+        if self.reads_shared:
+            containers = self.shared.read().get(host)
+            return (False, None) if containers is None else (True, containers.get(project))
+        self.watch(host)
+        with self._lock:
+            if host not in self._synced:
+                return False, None
+            return True, self._containers[host].get(project)
+
+    def states(self, host: str) -> Optional[Dict[str, ContainerState]]:
+        """Returns the states of all main containers of a host by project name or `None` if it is not synced."""
+
+        if self.reads_shared:
+            containers = self.shared.read().get(host)
+            return None if containers is None else dict(containers)
+        self.watch(host)
+        with self._lock:
+            if host not in self._synced:
+                return None
+            return dict(self._containers[host])
+
+    def watch(self, host: str):
+        """Starts the watcher thread of a host unless it is running or the index is disabled."""
+
+        if not self.enabled or host in self._watchers or self.reads_shared:
+            return
+        with self._lock:
+            if host in self._watchers:
+                return
+            thread = threading.Thread(target=self._watch, args=(host,), name=f"docker-events-{host}", daemon=True)
+            self._watchers[host] = thread
+        thread.start()
+
+    def resync(self, host: str, client):
+        """Replaces the containers of a host with a fresh listing and marks it as synced."""
+
+        containers = {}
+        for container in client.containers.list(all=True, sparse=True, filters=MAIN_SERVICE_FILTER):
+            attrs = container.attrs
+            project = (attrs.get("Labels") or {}).get(PROJECT_LABEL)
+            if project:
+                names = attrs.get("Names") or [""]
+                health = parse_health(attrs.get("Status", ""))
+                # only running containers show their health, for the others it is looked up when they start
+                known_healthcheck = True if health else (False if attrs["State"] == "running" else None)
+                containers[project] = ContainerState(attrs["Id"], names[0].lstrip("/"), attrs["State"], health,
+                                                     has_healthcheck=known_healthcheck)
+        with self._lock:
+            self._containers[host] = containers
+            self._synced.add(host)
+        self._changed.set()
+
+    def apply_event(self, host: str, event: Dict, inspect: Optional[Callable[[str], Dict]] = None):
+        """Updates the index with a container event of the docker events stream.
+
+        Args:
+            host (str): The docker host the event came from
+            event (dict): The decoded event
+            inspect (callable): Returns the inspect response of a container by id. It is called once per container
+                when it starts and it is not known yet whether it has a health check.
+        """
+
+        if event.get("Type") != "container":
+            return
+        action = event.get("Action", "")
+        actor = event.get("Actor", {})
+        attributes = actor.get("Attributes", {})
+        project = attributes.get(PROJECT_LABEL)
+        if not project:
+            return
+
+        healthcheck = None
+        if action in START_ACTIONS and inspect is not None:
+            with self._lock:
+                current = self._containers.get(host, {}).get(project)
+                unknown = current is None or current.id != actor.get("ID") or current.has_healthcheck is None
+            if unknown:
+                try:
+                    healthcheck = has_healthcheck(inspect(actor.get("ID")))
+                except Exception as e:
+                    logger.warning("could not inspect container %s: %s", actor.get("ID"), e)
+
+        with self._lock:
+            containers = self._containers.setdefault(host, {})
+            if action == "destroy":
+                current = containers.get(project)
+                if current and current.id == actor.get("ID"):
+                    del containers[project]
+                    self._changed.set()
+                return
+
+            current = containers.get(project)
+            if current is None or current.id != actor.get("ID"):
+                current = ContainerState(actor.get("ID"), attributes.get("name", ""), "created")
+            if healthcheck is not None:
+                current = current._replace(has_healthcheck=healthcheck)
+            if action.startswith("health_status"):
+                current = current._replace(health=action.split(":", 1)[1].strip(), has_healthcheck=True)
+            elif action == "oom":
+                current = current._replace(oom_killed=True)
+            elif action in STATUS_BY_ACTION:
+                status = STATUS_BY_ACTION[action]
+                if status == "running" and current.status != "running":
+                    starting = current.has_healthcheck or current.health is not None
+                    current = current._replace(oom_killed=False, health="starting" if starting else None)
+                current = current._replace(status=status)
+            else:
+                return
+            containers[project] = current
+        self._changed.set()
+
+    def forget_host(self, host: str):
+        """Marks a host as not synced, lookups fall back to the docker api until it is synced again."""
+
+        with self._lock:
+            self._synced.discard(host)
+        self._changed.set()
+
+    def _publish(self):
+        while True:
+            self._changed.wait(PUBLISH_INTERVAL)
+            self._changed.clear()
+            with self._lock:
+                hosts = {host: dict(self._containers.get(host, {})) for host in self._synced}
+            try:
+                self.shared.write(hosts)
+            except OSError as e:
+                logger.warning("could not write the shared container index: %s", e)
+
+    def _watch(self, host: str):
+        while True:
+            try:
+                client = get_docker_client(host)
+                since = int(time.time())
+                # events since the start of the listing are replayed, so nothing between the two is lost
+                events = client.events(decode=True, since=since, filters={"type": "container", **MAIN_SERVICE_FILTER})
+                try:
+                    self.resync(host, client)
+                    for event in events:
+                        self.apply_event(host, event, inspect=client.api.inspect_container)
+                finally:
+                    events.close()
+            except Exception as e:
+                logger.warning("docker events stream of %s failed: %s", host, e)
+            self.forget_host(host)
+            time.sleep(self.reconnect_interval)
+
+
+container_index = ContainerIndex(settings.DOCKER_EVENTS_ENABLED, settings.DOCKER_EVENTS_RECONNECT_INTERVAL,
+                                 f"{settings.SHARED_STATE_PATH}.containers" if settings.SHARED_STATE_PATH else "")
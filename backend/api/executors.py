@@ -0,0 +1,82 @@
+"""
+Bounded thread pools for blocking work done on behalf of the ASGI event loop.
+
+Under ASGI, Django runs every sync view on a single thread shared by all requests, so one slow docker call
+would stall every other request. The graphql view runs on `graphql_executor` instead (see `offload_view`), and
+blocking docker calls that fan out over many servers (log refreshes, subscription producers) run on
+`docker_executor`. The event loop only awaits their results, serves websockets in the meantime,
+and the pools bound the number of threads no matter how many requests are waiting.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Any, Callable, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class BlockingExecutor:
+    """Runs blocking callables on a lazily created, bounded thread pool."""
+
+    def __init__(self, workers: int, name: str):
+        self.workers = workers
+        self.name = name
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Awaits a blocking call on the pool.
+
+        Stale database connections are closed around the call, like `channels.db.database_sync_to_async` does,
+        because the pool threads are not managed by a request.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), partial(self._call, fn, *args, **kwargs))
+
+    def map(self, fn: Callable, items: Iterable) -> List:
+        """Calls `fn` for every item on the pool and waits for all results, in order."""
+
+        return list(self._get_executor().map(partial(self._call, fn), items))
+
+    @staticmethod
+    def _call(fn: Callable, *args, **kwargs) -> Any:
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+
+def offload_view(view: Callable, executor: "BlockingExecutor" = None) -> Callable:
+    """Turns a sync view into an async one that runs on a bounded pool instead of Django's shared sync thread.
+
+    Args:
+        view (callable): The sync view, ex.: `GraphQLView.as_view()`
+        executor (BlockingExecutor): The pool to run it on, `graphql_executor` by default
+
+    Returns:
+        callable: the async view
+    """
+
+    executor = executor or graphql_executor
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await executor.run(view, request, *args, **kwargs)
+
+    return async_view
+
+
+graphql_executor = BlockingExecutor(settings.GRAPHQL_WORKERS, "graphql")
+docker_executor = BlockingExecutor(settings.DOCKER_IO_WORKERS, "docker-io")
@@ -0,0 +1,70 @@
+"""
+Per-server container metrics for the prometheus exporter of django_prometheus.
+
+The metrics are built from the readings of the background stats collector on every scrape,
+so scraping never calls the docker api or queries the database.
+Readings of stopped servers carry no counter values, so their counters are left out instead of dropping to 0,
+which prometheus would treat as a counter reset.
+"""
+
+from typing import Callable, Iterator
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+
+from api.collector import StatsCollector
+
+LABELS = ["server_id", "name", "template", "host"]
+MEGABYTE = 1024 * 1024
+
+
+class ServerMetricsExporter:
+    """Custom prometheus collector exporting the latest reading of every server."""
+
+    def __init__(self, get_collector: Callable[[], StatsCollector]):
+        self.get_collector = get_collector
+
+    def describe(self):
+        # prevents the registry from calling `collect` (and starting the stats collector) on registration
+        return []
+
+    def collect(self) -> Iterator[Metric]:
+        running = GaugeMetricFamily("containerpanel_server_running", "Whether the main container is running",
+                                    labels=LABELS)
+        cpu_seconds = CounterMetricFamily("containerpanel_server_cpu_seconds",
+                                          "Cpu time used by the main container since it started", labels=LABELS)
+        memory_usage = GaugeMetricFamily("containerpanel_server_memory_usage_bytes",
+                                         "Memory used by the main container", labels=LABELS)
+        memory_limit = GaugeMetricFamily("containerpanel_server_memory_limit_bytes",
+                                         "The max_memory_usage of the server", labels=LABELS)
+        restarts = CounterMetricFamily("containerpanel_server_restarts",
+                                       "Number of times docker restarted the main container", labels=LABELS)
+        network_rx = CounterMetricFamily("containerpanel_server_network_receive_bytes",
+                                         "Bytes received by the main container", labels=LABELS)
+        network_tx = CounterMetricFamily("containerpanel_server_network_transmit_bytes",
+                                         "Bytes sent by the main container", labels=LABELS)
+        block_read = CounterMetricFamily("containerpanel_server_block_read_bytes",
+                                         "Bytes read from block devices by the main container", labels=LABELS)
+        block_write = CounterMetricFamily("containerpanel_server_block_write_bytes",
+                                          "Bytes written to block devices by the main container", labels=LABELS)
+        sample_age = GaugeMetricFamily("containerpanel_server_sample_age_seconds",
+                                       "Age of the reading the other metrics come from", labels=LABELS)
+
+        for server, reading in self.get_collector().snapshot():
+            labels = [server.server_id, server.name, server.template, server.host]
+            memory_limit.add_metric(labels, server.max_memory_usage * MEGABYTE)
+            if reading is None:
+                continue
+            running.add_metric(labels, 1 if reading.running else 0)
+            memory_usage.add_metric(labels, reading.memory_usage)
+            sample_age.add_metric(labels, reading.age)
+            if not reading.running:
+                continue
+            cpu_seconds.add_metric(labels, reading.cpu_seconds)
+            restarts.add_metric(labels, reading.restart_count)
+            network_rx.add_metric(labels, reading.network_rx_bytes)
+            network_tx.add_metric(labels, reading.network_tx_bytes)
+            block_read.add_metric(labels, reading.block_read_bytes)
+            block_write.add_metric(labels, reading.block_write_bytes)
+
+        yield from (running, cpu_seconds, memory_usage, memory_limit, restarts, network_rx, network_tx,
+                    block_read, block_write, sample_age)
@@ -0,0 +1,289 @@
+"""
+Per-request batching of the data needed by `ServerType` fields.
+
+Each loader collects the servers a graphql request touches and fetches the data for all of them at once,
+so the cost of `allServers` does not grow by one database query or docker call per server and field.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from api.collector import StatsReading, get_collector
+from api.docker_clients import get_docker_client
+from api.events import PROJECT_LABEL, container_index, parse_health
+from api.executors import docker_executor
+from api.models import Server
+
+SERVICE_LABEL = "com.docker.compose.service"
+COMPOSE_PROJECT_FILTER = {"label": PROJECT_LABEL}
+
+
+class PublishedPort(NamedTuple):
+    """A port of a compose service that is published on the docker host."""
+
+    service: str
+    private_port: int
+    public_port: int
+    protocol: str
+
+
+class ContainerSnapshot(NamedTuple):
+    """The containers of a compose project as seen by a single `containers.list` call.
+
+    Args:
+        status (str): status of the main container or `None` if the project has no main container
+        health (str): health of the main container, see `api.events.parse_health`
+        ports (list): the published ports of all services of the project
+    """
+
+    status: Optional[str]
+    health: Optional[str]
+    ports: List[PublishedPort]
+
+
+def list_compose_projects(host: str) -> Dict[str, ContainerSnapshot]:
+    """Lists the containers of all compose projects on a docker host with one api call.
+
+    The listing is sparse, so docker is not asked to inspect every single container.
+
+    Args:
+        host (str): The docker host
+
+    Returns:
+        dict: compose project name to its snapshot
+    """
+
+    main: Dict[str, Dict] = {}
+    ports: Dict[str, List[PublishedPort]] = {}
+    for container in get_docker_client(host).containers.list(all=True, sparse=True, filters=COMPOSE_PROJECT_FILTER):
+        attrs = container.attrs
+        labels = attrs.get("Labels") or {}
+        project = labels[PROJECT_LABEL]
+        service = labels.get(SERVICE_LABEL, "")
+        if service == "main":
+            main[project] = attrs
+        project_ports = ports.setdefault(project, [])
+        for port in attrs.get("Ports") or []:
+            if not port.get("PublicPort"):
+                continue
+            published = PublishedPort(service, port["PrivatePort"], port["PublicPort"], port["Type"])
+            if published not in project_ports:  # docker lists a port once per ip version
+                project_ports.append(published)
+
+    return {project: ContainerSnapshot(main[project]["State"] if project in main else None,
+                                       parse_health(main[project].get("Status", "")) if project in main else None,
+                                       project_ports)
+            for project, project_ports in ports.items()}
+
+
+def load_container_snapshots(servers: List[Server]) -> List[Optional[ContainerSnapshot]]:
+    """Returns the container snapshot of each server, using a single docker call per host.
+
+    Args:
+        servers (list): The servers to get the snapshots for
+
+    Returns:
+        list: The snapshot for each server or `None` if it has no containers
+    """
+
+    projects = {host: list_compose_projects(host) for host in {server.host for server in servers}}
+    return [projects[server.host].get(str(server.name)) for server in servers]
+
+
+def load_container_statuses(servers: List[Server]) -> List[Optional[str]]:
+    """Returns the status of the main container of each server, using at most one docker call per host.
+
+    Hosts that are synced by the `container_index` are served from it without calling docker.
+
+    Args:
+        servers (list): The servers to get the status for
+
+    Returns:
+        list: The container status (ex.: "running") for each server or `None` if its container does not exist
+    """
+
+    statuses: Dict[str, Optional[str]] = {}
+    unsynced = []
+    for server in servers:
+        known, state = container_index.lookup(server.host, str(server.name))
+        if known:
+            statuses[server.server_id] = state.status if state else None
+        else:
+            unsynced.append(server)
+    for server, snapshot in zip(unsynced, load_container_snapshots(unsynced)):
+        statuses[server.server_id] = snapshot.status if snapshot else None
+    return [statuses[server.server_id] for server in servers]
+
+
+class AllowedUsersLoader(DataLoader):
+    """Loads the allowed users of many servers with a single query."""
+
+    def __init__(self):
+        super().__init__(get_cache_key=lambda server: server.server_id)
+
+    def batch_load_fn(self, servers: List[Server]):
+        server_ids = [server.server_id for server in servers]
+        users_by_server: Dict[str, List[User]] = {server_id: [] for server_id in server_ids}
+        through = Server.allowed_users.through.objects.filter(server_id__in=server_ids).select_related("user")
+        for relation in through:
+            users_by_server[relation.server_id].append(relation.user)
+        return Promise.resolve([users_by_server[server_id] for server_id in server_ids])
+
+
+class ContainerSnapshotLoader(DataLoader):
+    """Loads the container snapshots of many servers with a single docker call per host.
+
+    Published ports are not part of the `container_index`, so this always asks docker;
+    fields that only need the status use `ContainerStatusLoader` instead.
+    """
+
+    def __init__(self):
+        super().__init__(get_cache_key=lambda server: server.server_id)
+
+    def batch_load_fn(self, servers: List[Server]):
+        return Promise.resolve(load_container_snapshots(servers))
+
+
+class ContainerStatusLoader(DataLoader):
+    """Loads the main container status of many servers, from the `container_index` where its host is synced.
+
+    Servers on hosts the index does not know yet go through the snapshot loader,
+    so a request that also selects `publishedPorts` still lists each host only once.
+    """
+
+    def __init__(self, snapshots: ContainerSnapshotLoader):
+        super().__init__(get_cache_key=lambda server: server.server_id)
+        self.snapshots = snapshots
+
+    def batch_load_fn(self, servers: List[Server]):
+        statuses: Dict[str, Optional[str]] = {}
+        unsynced = []
+        for server in servers:
+            known, state = container_index.lookup(server.host, str(server.name))
+            if known:
+                statuses[server.server_id] = state.status if state else None
+            else:
+                unsynced.append(server)
+
+        def merge(snapshots: List[Optional[ContainerSnapshot]]) -> List[Optional[str]]:
+            for server, snapshot in zip(unsynced, snapshots):
+                statuses[server.server_id] = snapshot.status if snapshot else None
+            return [statuses[server.server_id] for server in servers]
+
+        return self.snapshots.load_many(unsynced).then(merge)
+
+
+class LogsLoader(DataLoader):
+    """Loads the logs of many servers concurrently.
+
+    Keys are tuples of the server, the `after` cursor, the line limit and the minimum level.
+    """
+
+    def __init__(self):
+        super().__init__(get_cache_key=lambda key: (key[0].server_id, key[1], key[2], key[3]))
+
+    def batch_load_fn(self, keys: List[Tuple[Server, Optional[str], int, Optional[str]]]):
+        logs = docker_executor.map(lambda key: key[0].get_logs(key[2], after=key[1], level=key[3]), keys)
+        return Promise.resolve(logs)
+
+
+class LazyServerState:
+    """The state of a server whose fields are only computed when a resolver reads them.
+
+    `running` only needs the container status, which comes from the `container_index` once it is synced.
+    Usage fields read the latest reading of the stats collector, so docker is never asked for stats.
+    """
+
+    def __init__(self, server: Server, loaders: "Loaders"):
+        self.server = server
+        self.loaders = loaders
+
+    @property
+    def running(self) -> Promise:
+        return self.loaders.container_status.load(self.server).then(lambda status: status == "running")
+
+    @property
+    def cpu_usage(self) -> Promise:
+        return self.running.then(lambda running: self._reading().cpu_usage if running and self._reading() else 0)
+
+    @property
+    def memory_usage(self) -> Promise:
+        return self.running.then(lambda running: self._reading().memory_usage if running and self._reading() else 0)
+
+    @property
+    def network_rx_rate(self) -> Promise:
+        return self._rate("network_rx_rate")
+
+    @property
+    def network_tx_rate(self) -> Promise:
+        return self._rate("network_tx_rate")
+
+    @property
+    def block_read_rate(self) -> Promise:
+        return self._rate("block_read_rate")
+
+    @property
+    def block_write_rate(self) -> Promise:
+        return self._rate("block_write_rate")
+
+    @property
+    def services(self) -> List[Dict]:
+        collector = get_collector()
+        services = []
+        for service in ("main", *settings.STATS_SIDECAR_SERVICES):
+            reading = collector.get(self.server.server_id, service)
+            if reading is not None:
+                services.append({"service": service, **reading._asdict()})
+        return services
+
+    @property
+    def sampled_at(self) -> Optional[float]:
+        reading = self._reading()
+        return reading.sampled_at if reading else None
+
+    @property
+    def sample_age(self) -> Optional[float]:
+        reading = self._reading()
+        return reading.age if reading else None
+
+    def _rate(self, field: str) -> Promise:
+        return self.running.then(lambda running: getattr(self._reading(), field) if running and self._reading() else 0)
+
+    def _reading(self) -> Optional[StatsReading]:
+        return get_collector().get(self.server.server_id)
+
+
+class Loaders:
+    """Holds one instance of every loader for the duration of a request."""
+
+    def __init__(self):
+        self.allowed_users = AllowedUsersLoader()
+        self.container_snapshot = ContainerSnapshotLoader()
+        self.container_status = ContainerStatusLoader(self.container_snapshot)
+        self.logs = LogsLoader()
+
+
+def get_loaders(info) -> Loaders:
+    """Returns the loaders of the current request.
+
+    The loaders are stored on the request (`info.context`) so that all resolvers of one request share them.
+    If there is no context to store them on, a fresh set is returned.
+
+    Args:
+        info (graphql.ResolveInfo): The resolve info passed to the resolver
+
+    Returns:
+        Loaders: the loaders for this request
+    """
+
+    context = info.context
+    loaders: Optional[Loaders] = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        if context is not None:
+            context.loaders = loaders
+    return loaders
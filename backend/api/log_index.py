@@ -0,0 +1,632 @@
+"""
+On-disk archive and full-text index of the container logs of every server.
+
+A background thread fetches the log lines written since the last indexed one from docker and appends them to
+per-server segment files, one per `segment_seconds` of log time. When a segment is complete it is sealed into a
+single file holding the lines gzip compressed in independent blocks, a sparse timestamp index of the blocks and an
+inverted index mapping every token to the lines containing it. All indexes are packed arrays that reads binary search
+in the memory mapped file, so nothing is parsed or cached per segment and only the blocks a read needs are
+decompressed. Only segments overlapping the requested time range are opened and only plain segments are scanned.
+Ingestion resumes from the newest archived line after a restart. Sealed segments are deleted once they are older
+than the retention period or the archive of a server outgrows its size limit.
+
+Files of a server in `LOG_INDEX_DIR/<server_id>/`:
+    <segment start>.log     the current segment, or lines that arrived after the segment was sealed,
+                            of the form "<timestamp in ns>\\t<content>\\n"
+    <segment start>.seg     a sealed segment, see `write_sealed_segment` for its layout
+
+A sealed segment is only ever replaced by renaming a complete new file over it, which merges the lines of the
+old file and of the plain segment next to it. Readers in other processes keep reading the file they opened,
+and skip the lines of a plain segment that the sealed file they opened already holds.
+"""
+
+import bisect
+import fcntl
+import gzip
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from api.logs import LogLine, parse_docker_timestamp
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+NANOSECONDS = 1_000_000_000
+BLOCK_SIZE = 64 * 1024
+# held by the one process that writes the archive, see `LogIndexer.run`
+WRITER_LOCK_NAME = ".writer.lock"
+
+SEGMENT_MAGIC = b"CPLOGSG1"
+# magic, line count, block count, token count and the offsets of the timestamps, line offsets, blocks,
+# token offsets, tokens, postings offsets and postings sections
+SEGMENT_HEADER = struct.Struct("<8sQQQQQQQQQQ")
+# first timestamp, uncompressed offset, compressed offset and compressed length of a block
+BLOCK = struct.Struct("<qQQQ")
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits a text into lowercase words, ex.: "Player Steve joined" -> ["player", "steve", "joined"]."""
+
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def write_sealed_segment(path: str, lines: Iterable[Tuple[int, str]]):
+    """Writes the lines of a segment into a sealed segment file.
+
+    Layout, all integers little endian:
+        header          `SEGMENT_HEADER`
+        data            the lines in the form of a plain segment, gzip compressed in blocks of about `BLOCK_SIZE`
+        timestamps      int64 timestamp of every line
+        line offsets    uint64 uncompressed offset of every line
+        blocks          `BLOCK` of every block
+        token offsets   uint64 offset of every token in the tokens section, and the end of the last one
+        tokens          the utf-8 encoded tokens, sorted bytewise
+        posting offsets uint64 index of the first posting of every token, and the end of the last one
+        postings        uint32 numbers of the lines containing the tokens, ascending per token
+
+    Args:
+        path (str): The file to write
+        lines (iterable): `(timestamp in ns, content)` tuples, oldest first
+    """
+
+    timestamps, offsets, blocks = [], [], []
+    postings: Dict[bytes, List[int]] = {}
+    with open(path, "wb") as file:
+        file.write(bytes(SEGMENT_HEADER.size))
+        offset = 0
+        block_lines: List[bytes] = []
+        block_size = 0
+        for number, (timestamp, content) in enumerate(lines):
+            raw = f"{timestamp}\t{content}\n".encode("utf-8", errors="replace")
+            if not block_lines:
+                blocks.append([timestamp, offset, file.tell(), 0])
+            offsets.append(offset)
+            timestamps.append(timestamp)
+            for token in set(tokenize(content)):
+                postings.setdefault(token.encode(), []).append(number)
+            offset += len(raw)
+            block_lines.append(raw)
+            block_size += len(raw)
+            if block_size >= BLOCK_SIZE:
+                blocks[-1][3] = file.write(gzip.compress(b"".join(block_lines)))
+                block_lines, block_size = [], 0
+        if block_lines:
+            blocks[-1][3] = file.write(gzip.compress(b"".join(block_lines)))
+
+        tokens = sorted(postings)
+        token_offsets, posting_offsets = [0], [0]
+        for token in tokens:
+            token_offsets.append(token_offsets[-1] + len(token))
+            posting_offsets.append(posting_offsets[-1] + len(postings[token]))
+
+        sections = []
+        for data in (struct.pack(f"<{len(timestamps)}q", *timestamps),
+                     struct.pack(f"<{len(offsets)}Q", *offsets),
+                     b"".join(BLOCK.pack(*block) for block in blocks),
+                     struct.pack(f"<{len(token_offsets)}Q", *token_offsets),
+                     b"".join(tokens),
+                     struct.pack(f"<{len(posting_offsets)}Q", *posting_offsets),
+                     b"".join(struct.pack(f"<{len(postings[token])}I", *postings[token]) for token in tokens)):
+            sections.append(file.tell())
+            file.write(data)
+        file.seek(0)
+        file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(timestamps), len(blocks), len(tokens), *sections))
+
+
+class PackedArray:
+    """A read-only sequence of fixed-size little endian integers in a memory mapped file."""
+
+    def __init__(self, data: mmap.mmap, offset: int, code: str, length: int):
+        self._data = data
+        self._offset = offset
+        self._item = struct.Struct("<" + code)
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> int:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._item.unpack_from(self._data, self._offset + index * self._item.size)[0]
+
+
+class SealedSegment:
+    """Reads a sealed segment file, decompressing only the blocks that contain the lines that are read.
+
+    Raises:
+        FileNotFoundError: the segment was deleted by the retention
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, lines, blocks, tokens, timestamps_at, offsets_at, blocks_at, token_offsets_at, self._tokens_at, \
+            posting_offsets_at, self._postings_at = SEGMENT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SEGMENT_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a sealed log segment")
+        self.timestamps = PackedArray(self._mmap, timestamps_at, "q", lines)
+        self._offsets = PackedArray(self._mmap, offsets_at, "Q", lines)
+        self._blocks = [BLOCK.unpack_from(self._mmap, blocks_at + block * BLOCK.size) for block in range(blocks)]
+        self._block_timestamps = [block[0] for block in self._blocks]
+        self._block_offsets = [block[1] for block in self._blocks]
+        self._token_offsets = PackedArray(self._mmap, token_offsets_at, "Q", tokens + 1)
+        self._posting_offsets = PackedArray(self._mmap, posting_offsets_at, "Q", tokens + 1)
+        self._token_count = tokens
+        self._decompressed: Dict[int, bytes] = {}
+
+    def __enter__(self) -> "SealedSegment":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+
+    @property
+    def last_timestamp(self) -> int:
+        """The timestamp of the newest line, -1 if the segment is empty."""
+
+        return self.timestamps[-1] if len(self.timestamps) else -1
+
+    def line(self, number: int) -> Tuple[int, str]:
+        """Returns timestamp and content of a line by its number."""
+
+        offset = self._offsets[number]
+        block = bisect.bisect_right(self._block_offsets, offset) - 1
+        data = self._block(block)
+        relative = offset - self._block_offsets[block]
+        return parse_archived_line(data[relative:data.index(b"\n", relative) + 1])
+
+    def lines_between(self, start_ns: int, end_ns: int) -> Iterator[Tuple[int, str]]:
+        """Yields the lines written between two timestamps, oldest first."""
+
+        first_block = max(0, bisect.bisect_right(self._block_timestamps, start_ns) - 1)
+        for block in range(first_block, len(self._blocks)):
+            if self._block_timestamps[block] > end_ns:
+                return
+            for raw in self._block(block).splitlines(keepends=True):
+                timestamp, content = parse_archived_line(raw)
+                if timestamp > end_ns:
+                    return
+                if timestamp >= start_ns:
+                    yield timestamp, content
+            self._decompressed.pop(block, None)  # sequential reads keep a single block in memory
+
+    def postings(self, token: str) -> Tuple[int, ...]:
+        """Returns the numbers of the lines containing a token, ascending."""
+
+        key = token.encode()
+        low, high = 0, self._token_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._token(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._token_count or self._token(low) != key:
+            return ()
+        first, end = self._posting_offsets[low], self._posting_offsets[low + 1]
+        return struct.unpack_from(f"<{end - first}I", self._mmap, self._postings_at + first * 4)
+
+    def search(self, tokens: Set[str], start_ns: int, end_ns: int, limit: int) -> List[Tuple[int, str]]:
+        """Returns the lines containing all tokens, newest first."""
+
+        postings = [self.postings(token) for token in tokens]
+        if not all(postings):
+            return []
+        matches = set(min(postings, key=len)).intersection(*postings)
+
+        found = []
+        for number in sorted(matches, reverse=True):
+            if not start_ns <= self.timestamps[number] <= end_ns:
+                continue
+            found.append(self.line(number))
+            if len(found) >= limit:
+                break
+        return found
+
+    def _token(self, index: int) -> bytes:
+        start, end = self._token_offsets[index], self._token_offsets[index + 1]
+        return self._mmap[self._tokens_at + start:self._tokens_at + end]
+
+    def _block(self, block: int) -> bytes:
+        data = self._decompressed.get(block)
+        if data is None:
+            _, _, compressed_offset, compressed_length = self._blocks[block]
+            data = gzip.decompress(self._mmap[compressed_offset:compressed_offset + compressed_length])
+            self._decompressed[block] = data
+        return data
+
+
+def parse_archived_line(raw: bytes) -> Tuple[int, str]:
+    timestamp, _, content = raw.decode("utf-8", errors="replace").rstrip("\n").partition("\t")
+    return int(timestamp), content
+
+
+class ServerLogIndex:
+    """The log segments of one server."""
+
+    def __init__(self, directory: str, segment_seconds: int):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self._last_ns: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def segment_start(self, nanoseconds: int) -> int:
+        seconds = nanoseconds // NANOSECONDS
+        return seconds - seconds % self.segment_seconds
+
+    def segments(self) -> List[int]:
+        """Returns the start of every segment, oldest first."""
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted({int(name.split(".", 1)[0]) for name in names if name.endswith((".log", ".seg"))})
+
+    def is_sealed(self, start: int) -> bool:
+        return os.path.exists(self._path(start, "seg"))
+
+    def has_plain_lines(self, start: int) -> bool:
+        """Checks if a segment has lines that are not sealed yet."""
+
+        return os.path.exists(self._path(start, "log"))
+
+    @property
+    def last_ns(self) -> Optional[int]:
+        """The timestamp of the newest indexed line or `None` if nothing was indexed yet."""
+
+        if self._last_ns is None:
+            segments = self.segments()
+            if segments:
+                plain, sealed = self._open(segments[-1])
+                last_ns = -1
+                if sealed is not None:
+                    with sealed:
+                        last_ns = sealed.last_timestamp
+                if plain is not None:
+                    with plain:
+                        last_line = plain.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+                    if last_line:
+                        last_ns = max(last_ns, int(last_line.split(b"\t", 1)[0]))
+                self._last_ns = last_ns if last_ns >= 0 else None
+        return self._last_ns
+
+    def append(self, lines: Iterable[Tuple[int, str]]):
+        """Appends lines to their segments, sealing segments that are complete.
+
+        Lines of a segment that was sealed already are appended to a plain segment next to it,
+        which is merged into the sealed one when it is sealed again.
+
+        Args:
+            lines (iterable): `(timestamp in ns, content)` tuples, oldest first. Lines not newer than
+                the newest indexed one are skipped.
+        """
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            last_ns = self.last_ns
+            current_start, file = None, None
+            try:
+                for nanoseconds, content in lines:
+                    if last_ns is not None and nanoseconds <= last_ns:
+                        continue
+                    start = self.segment_start(nanoseconds)
+                    if start != current_start:
+                        if file is not None:
+                            file.close()
+                        if current_start is not None:
+                            self.seal(current_start)
+                        elif last_ns is not None and start != self.segment_start(last_ns) \
+                                and self.has_plain_lines(self.segment_start(last_ns)):
+                            self.seal(self.segment_start(last_ns))
+                        current_start = start
+                        file = open(self._path(start, "log"), "a", encoding="utf-8")
+                    file.write(f"{nanoseconds}\t{content.replace(chr(10), ' ').replace(chr(13), '')}\n")
+                    last_ns = nanoseconds
+            finally:
+                if file is not None:
+                    file.close()
+            self._last_ns = last_ns
+
+    def seal(self, start: int):
+        """Seals the plain lines of a segment, merged with the lines it had sealed before.
+
+        The new sealed file is complete before it replaces the old one and before the plain lines are removed.
+        """
+
+        temporary = self._path(start, "seg.tmp")
+        write_sealed_segment(temporary, self._segment_lines(start, 0, float("inf")))
+        os.replace(temporary, self._path(start, "seg"))
+        os.remove(self._path(start, "log"))
+
+    def seal_complete(self, now: float):
+        """Seals all segments that ended before `now` and have plain lines, ex.: after a restart."""
+
+        with self._lock:
+            current = self.segment_start(int(now * NANOSECONDS))
+            for start in self.segments():
+                if start < current and self.has_plain_lines(start):
+                    self.seal(start)
+
+    def enforce_retention(self, now: float, max_age: float, max_bytes: int):
+        """Deletes sealed segments that ended more than `max_age` seconds ago, then the oldest sealed segments
+        until the archive is at most `max_bytes` large. The current segment is never deleted."""
+
+        with self._lock:
+            sizes = {}
+            for start in self.segments():
+                paths = [self._path(start, extension) for extension in ("log", "seg")]
+                sizes[start] = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+            total = sum(sizes.values())
+            for start, size in sizes.items():
+                if not self.is_sealed(start) or self.has_plain_lines(start):
+                    continue
+                if start + self.segment_seconds < now - max_age or total > max_bytes:
+                    # readers that opened the file keep reading it
+                    os.remove(self._path(start, "seg"))
+                    total -= size
+
+    def read_range(self, start_ns: int, end_ns: int) -> Iterator[LogLine]:
+        """Yields the archived lines written between two timestamps, oldest first.
+
+        Only one decompressed block is held in memory at a time, so any range can be read in constant memory.
+        """
+
+        for start in self.segments():
+            if start * NANOSECONDS > end_ns or (start + self.segment_seconds) * NANOSECONDS <= start_ns:
+                continue
+            yield from (LogLine(str(timestamp), timestamp // NANOSECONDS, content, "log")
+                        for timestamp, content in self._segment_lines(start, start_ns, end_ns))
+
+    def search(self, query: str, start_ns: int, end_ns: int, limit: int) -> List[LogLine]:
+        """Finds the lines containing all words of the query.
+
+        Args:
+            query (str): The words to search for, case insensitive
+            start_ns (int): Only lines written at or after this timestamp are returned
+            end_ns (int): Only lines written at or before this timestamp are returned
+            limit (int): Maximum number of lines to return
+
+        Returns:
+            list: the matching lines, newest first
+        """
+
+        tokens = set(tokenize(query))
+        if not tokens or limit <= 0:
+            return []
+
+        results: List[LogLine] = []
+        for start in reversed(self.segments()):
+            if start * NANOSECONDS > end_ns or (start + self.segment_seconds) * NANOSECONDS <= start_ns:
+                continue
+            found = self._search_segment(start, tokens, start_ns, end_ns, limit - len(results))
+            results.extend(LogLine(str(timestamp), timestamp // NANOSECONDS, content, "log")
+                           for timestamp, content in found)
+            if len(results) >= limit:
+                break
+        return results
+
+    def _segment_lines(self, start: int, start_ns: int, end_ns: float) -> Iterator[Tuple[int, str]]:
+        """Yields the sealed and then the plain lines of a segment between two timestamps, oldest first."""
+
+        plain, sealed = self._open(start)
+        try:
+            last_sealed = -1
+            if sealed is not None:
+                with sealed:
+                    yield from sealed.lines_between(start_ns, end_ns)
+                    last_sealed = sealed.last_timestamp
+            if plain is not None:
+                for raw in plain:
+                    if not raw.endswith(b"\n"):  # the line is still being written by the indexer
+                        return
+                    timestamp, content = parse_archived_line(raw)
+                    if timestamp > end_ns:
+                        return
+                    if timestamp >= start_ns and timestamp > last_sealed:
+                        yield timestamp, content
+        finally:
+            if plain is not None:
+                plain.close()
+
+    def _search_segment(self, start: int, tokens: Set[str], start_ns: int, end_ns: int,
+                        limit: int) -> List[Tuple[int, str]]:
+        """Returns the lines of a segment containing all tokens, newest first."""
+
+        plain, sealed = self._open(start)
+        found = []
+        try:
+            last_sealed = sealed.last_timestamp if sealed is not None else -1
+            if plain is not None:
+                # the last line may still be written by the indexer
+                lines = plain.read().decode("utf-8", errors="replace").split("\n")[:-1]
+                for raw in reversed(lines):
+                    timestamp, _, content = raw.partition("\t")
+                    timestamp = int(timestamp)
+                    if timestamp <= last_sealed:
+                        break
+                    if start_ns <= timestamp <= end_ns and tokens.issubset(tokenize(content)):
+                        found.append((timestamp, content))
+                        if len(found) >= limit:
+                            return found
+            if sealed is not None:
+                found.extend(sealed.search(tokens, start_ns, end_ns, limit - len(found)))
+            return found
+        finally:
+            if plain is not None:
+                plain.close()
+            if sealed is not None:
+                sealed.close()
+
+    def _open(self, start: int) -> Tuple[Optional[BinaryIO], Optional[SealedSegment]]:
+        """Opens the plain and the sealed file of a segment, either may be missing.
+
+        The plain file is opened first: if the segment is sealed in between, the sealed file holds its lines as well.
+        """
+
+        try:
+            plain = open(self._path(start, "log"), "rb")
+        except FileNotFoundError:
+            plain = None
+        try:
+            sealed = SealedSegment(self._path(start, "seg"))
+        except FileNotFoundError:
+            sealed = None
+        return plain, sealed
+
+    def _path(self, start: int, extension: str) -> str:
+        return os.path.join(self.directory, f"{start}.{extension}")
+
+
+class LogIndexer:
+    """Ingests the logs of all servers into their `ServerLogIndex` in the background.
+
+    Every process that runs a collector starts an indexer, but only the one holding the writer lock on
+    the archive directory ingests. The others retry every round and take over if that process exits.
+    """
+
+    def __init__(self, directory: str, segment_seconds: int, interval: float,
+                 retention_seconds: float = float("inf"), max_bytes: float = float("inf")):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.interval = interval
+        self.retention_seconds = retention_seconds
+        self.max_bytes = max_bytes
+        self._indexes: Dict[str, ServerLogIndex] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._writer_lock = None
+
+    def get(self, server_id: str) -> ServerLogIndex:
+        """Returns the index of a server."""
+
+        with self._lock:
+            index = self._indexes.get(server_id)
+            if index is None:
+                index = self._indexes[server_id] = ServerLogIndex(os.path.join(self.directory, server_id),
+                                                                   self.segment_seconds)
+            return index
+
+    def start(self):
+        """Starts the ingestion thread if it is not running yet."""
+
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self.run, name="log-indexer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def ingest(self, server):
+        """Indexes the lines a server wrote since its newest indexed line."""
+
+        index = self.get(server.server_id)
+        server.load_container()
+        if not server.container_available:
+            return
+        last_ns = index.last_ns
+        if last_ns:
+            # `since` has a resolution of whole seconds on older daemons, lines we already have are skipped by `append`
+            since = last_ns // NANOSECONDS
+        else:  # the first backfill skips lines the retention would delete right away
+            since = max(0, int(time.time() - self.retention_seconds)) if self.retention_seconds != float("inf") else 0
+        chunks = server.container.logs(since=since, timestamps=True, stream=True, follow=False)
+        index.append(iter_log_lines(chunks))
+
+    def ingest_all(self):
+        """Indexes the new lines of all servers once."""
+
+        from api.models import Server
+
+        for server in Server.objects.all():
+            try:
+                self.ingest(server)
+            except Exception as e:  # a single broken container must not stop the indexer
+                logger.warning("could not index logs of %s: %s", server.name, e)
+        now = time.time()
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            index.seal_complete(now)
+            index.enforce_retention(now, self.retention_seconds, self.max_bytes)
+
+    def run(self):
+        """Runs the ingestion loop in the calling thread until `stop` is called."""
+
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                if self._acquire_writer_lock():
+                    self.ingest_all()
+            except Exception:
+                logger.exception("log indexer round failed")
+            finally:
+                close_old_connections()
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def _acquire_writer_lock(self) -> bool:
+        """Takes the writer lock of the archive unless another process holds it."""
+
+        if self._writer_lock is not None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, WRITER_LOCK_NAME), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._writer_lock = lock_file  # kept open, closing the file releases the lock
+        return True
+
+
+def iter_log_lines(chunks: Iterable[bytes]) -> Iterator[Tuple[int, str]]:
+    """Splits the streamed output of `container.logs(timestamps=True)` into `(timestamp in ns, content)` tuples.
+
+    Only the current partial line is buffered, so the whole log history never has to fit into memory.
+    """
+
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        for raw in complete:
+            line = parse_log_line(raw)
+            if line is not None:
+                yield line
+    if pending:
+        line = parse_log_line(pending)
+        if line is not None:
+            yield line
+
+
+def parse_log_line(raw: bytes) -> Optional[Tuple[int, str]]:
+    raw_timestamp, _, content = raw.decode(errors="replace").partition(" ")
+    try:
+        return parse_docker_timestamp(raw_timestamp), content
+    except ValueError:
+        return None
+
+
+log_indexer = LogIndexer(settings.LOG_INDEX_DIR, settings.LOG_INDEX_SEGMENT_SECONDS, settings.LOG_INDEX_INTERVAL,
+                         settings.LOG_ARCHIVE_RETENTION_DAYS * 24 * 3600, settings.LOG_ARCHIVE_MAX_MB * 1024 * 1024)
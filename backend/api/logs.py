@@ -0,0 +1,308 @@
+"""
+In-memory buffers of parsed container log lines.
+
+Every server gets a bounded ring buffer of its latest log lines. A refresh only asks docker for the lines
+written since the newest buffered one, so each line is fetched and parsed once no matter how often it is read.
+Lines are addressed by a cursor, the nanosecond timestamp docker assigned to them.
+Each line is classified by the `LogParser` of the servers app template when it enters the buffer, so the
+parsed fields are stored with it and filtering by level costs no parsing.
+If the template sets a `collapse_window`, a line repeating one of the latest entries is folded into that entry,
+unless unmatched lines such as stack frames lie between them, which counts the repeats and keeps its place and cursor. Its `last_cursor` becomes the cursor of the newest repeat,
+so reading `after` a cursor returns it again, and clients replace the entry they already have by its cursor.
+"""
+
+import calendar
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from django.conf import settings
+
+
+class LogLine(NamedTuple):
+    """A parsed line of the container logs.
+
+    Args:
+        cursor (str): Position of the line, pass it as `after` to get the lines following it
+        timestamp (int): unix timestamp of the line
+        content (str): The text of the line
+        source (str): What the line is about, the name of the matching event of the template (ex.: "join")
+            or "log"
+        level (str): One of `LOG_LEVELS` or `None` if the template does not know the format of the line
+        thread (str): The thread that wrote the line, if the format has one
+        logger (str): The logger that wrote the line, if the format has one
+        player (str): The player an event is about, ex.: the one that joined
+        message (str): The content without the prefix matched by the template pattern, repeats are detected by it
+        repeat_count (int): How often the line was written in a row, see `LogParser.collapse_window`
+        last_timestamp (int): unix timestamp of the last repeat, `timestamp` is the one of the first
+        last_cursor (str): Cursor of the last repeat, `cursor` is the one of the first
+    """
+
+    cursor: str
+    timestamp: int
+    content: str
+    source: str
+    level: Optional[str] = None
+    thread: Optional[str] = None
+    logger: Optional[str] = None
+    player: Optional[str] = None
+    message: Optional[str] = None
+    repeat_count: int = 1
+    last_timestamp: Optional[int] = None
+    last_cursor: Optional[str] = None
+
+    @property
+    def newest_cursor(self) -> str:
+        """Cursor of the newest line in this entry, entries are read `after` a cursor by it."""
+
+        return self.last_cursor or self.cursor
+
+    @property
+    def repeat_key(self) -> Tuple:
+        """Lines with the same key are repeats of each other."""
+
+        return self.level, self.thread, self.logger, self.message
+
+    def repeated(self, line: "LogLine") -> "LogLine":
+        """Returns this entry with `line` folded into it."""
+
+        return self._replace(repeat_count=self.repeat_count + line.repeat_count,
+                             last_timestamp=line.last_timestamp or line.timestamp, last_cursor=line.newest_cursor)
+
+
+def newest_cursor(lines: List[LogLine]) -> Optional[str]:
+    """Returns the newest cursor of some lines, pass it as `after` to get what changed since, or `None`."""
+
+    return max((line.newest_cursor for line in lines), key=int, default=None)
+
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARN", "ERROR")
+# level names the games use, mapped to one of `LOG_LEVELS`
+LEVEL_ALIASES = {
+    "TRACE": "DEBUG",
+    "VERBOSE": "DEBUG",
+    "FINE": "DEBUG",
+    "ACTION": "INFO",
+    "WARNING": "WARN",
+    "SEVERE": "ERROR",
+    "FATAL": "ERROR",
+}
+
+
+def is_at_least(level: Optional[str], minimum: str) -> bool:
+    """Checks if a level is `minimum` or more severe, lines without a level never are."""
+
+    return level is not None and LOG_LEVELS.index(level) >= LOG_LEVELS.index(minimum)
+
+
+class LogParser:
+    """Classifies log lines with the patterns of an app template.
+
+    Declared in the `log_format` section of a template:
+        pattern: matched against every line, its named groups `level`, `thread`, `logger` and `message` are used
+        events: source name to a pattern matched against the message, the first match becomes the source of
+            the line and its `player` group is used
+        levels: additional level names mapped to one of `LOG_LEVELS`
+        collapse_window: a line repeating one of this many latest entries is folded into it, 0 disables folding
+    """
+
+    def __init__(self, pattern: Optional[str] = None, events: Optional[Dict[str, str]] = None,
+                 levels: Optional[Dict[str, str]] = None, collapse_window: int = 0):
+        self.collapse_window = collapse_window
+        self.pattern = re.compile(pattern) if pattern else None
+        self.events: List[Tuple[str, Pattern]] = [(source, re.compile(event))
+                                                  for source, event in (events or {}).items()]
+        self.levels = {**LEVEL_ALIASES, **{name.upper(): level.upper() for name, level in (levels or {}).items()}}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> "LogParser":
+        """Creates the parser of a `log_format` template section, which may be missing."""
+
+        config = config or {}
+        return cls(config.get("pattern"), config.get("events"), config.get("levels"),
+                   int(config.get("collapse_window") or 0))
+
+    def parse(self, cursor: str, timestamp: int, content: str) -> LogLine:
+        level = thread = logger = player = None
+        message = content
+        source = "log"
+        if self.pattern is not None:
+            match = self.pattern.match(content)
+            if match:
+                groups = match.groupdict()
+                level = self.normalize_level(groups.get("level"))
+                thread = groups.get("thread")
+                logger = groups.get("logger")
+                if groups.get("message") is not None:
+                    message = groups["message"]
+        for event_source, event in self.events:
+            match = event.search(message)
+            if match:
+                source = event_source
+                player = match.groupdict().get("player")
+                break
+        return LogLine(cursor, timestamp, content, source, level, thread, logger, player, message)
+
+    def normalize_level(self, level: Optional[str]) -> Optional[str]:
+        if not level:
+            return None
+        level = level.upper()
+        level = self.levels.get(level, level)
+        return level if level in LOG_LEVELS else None
+
+
+PLAIN_LOG_PARSER = LogParser()
+
+
+def parse_docker_timestamp(raw: str) -> int:
+    """Parses a docker log timestamp like `2021-09-01T11:30:00.123456789Z`.
+
+    Args:
+        raw (str): The timestamp as written by docker
+
+    Returns:
+        int: nanoseconds since the epoch
+
+    Raises:
+        ValueError: the timestamp is malformed
+    """
+
+    if not raw.endswith("Z"):
+        raise ValueError(f"unsupported timestamp {raw}")
+    seconds, _, fraction = raw[:-1].partition(".")
+    parsed = datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S")
+    nanoseconds = int(fraction.ljust(9, "0")[:9]) if fraction else 0
+    return calendar.timegm(parsed.timetuple()) * 1_000_000_000 + nanoseconds
+
+
+def format_docker_timestamp(nanoseconds: int) -> str:
+    """Formats nanoseconds since the epoch like docker does, the inverse of `parse_docker_timestamp`."""
+
+    seconds, fraction = divmod(nanoseconds, 1_000_000_000)
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{fraction:09d}Z"
+
+
+class LogBuffer:
+    """Ring buffer holding the latest log lines of one server."""
+
+    def __init__(self, size: int, refresh_interval: float):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self._lines: Deque[LogLine] = deque(maxlen=size)
+        self._last_ns: Optional[int] = None
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, container, parser: LogParser = PLAIN_LOG_PARSER):
+        """Fetches the lines written since the last refresh from docker.
+
+        Refreshes are skipped if the last one is less than `refresh_interval` seconds ago.
+
+        Args:
+            container (docker.models.containers.Container): The container to read the logs of
+            parser (LogParser): Classifies the new lines, see `api.app_templates.AppTemplate.log_parser`
+        """
+
+        with self._lock:
+            if time.monotonic() - self._last_refresh < self.refresh_interval:
+                return
+            if self._last_ns is None:
+                raw = container.logs(tail=self.size, timestamps=True)
+            else:
+                # `since` has a resolution of whole seconds on older daemons, lines we already have are skipped below
+                raw = container.logs(since=self._last_ns // 1_000_000_000, timestamps=True)
+            self._last_refresh = time.monotonic()
+            self._append(raw.decode(errors="replace"), parser)
+
+    def _append(self, raw: str, parser: LogParser):
+        for line in raw.split("\n"):
+            raw_timestamp, _, content = line.partition(" ")
+            try:
+                nanoseconds = parse_docker_timestamp(raw_timestamp)
+            except ValueError:
+                continue
+            if self._last_ns is not None and nanoseconds <= self._last_ns:
+                continue
+            self._last_ns = nanoseconds
+            self._add(parser.parse(str(nanoseconds), nanoseconds // 1_000_000_000, content), parser.collapse_window)
+
+    def _add(self, line: LogLine, collapse_window: int):
+        """Appends a line or folds it in place into one of the latest `collapse_window` entries it repeats.
+
+        Lines the pattern did not match (`level` is `None`, ex.: stack frames) belong to the line before them,
+        so they are only folded into an identical previous entry, and no line is folded across them.
+        """
+
+        key = line.repeat_key
+        window = min(collapse_window, len(self._lines), 1 if line.level is None else collapse_window)
+        for distance in range(1, window + 1):
+            entry = self._lines[-distance]
+            if entry.repeat_key == key:
+                self._lines[-distance] = entry.repeated(line)
+                return
+            if entry.level is None:
+                break
+        self._lines.append(line)
+
+    def read(self, after: Optional[str] = None, limit: int = 50, level: Optional[str] = None) -> List[LogLine]:
+        """Returns buffered lines.
+
+        Args:
+            after (str): Newest cursor the client has, see `LogLine.newest_cursor`. Only new lines and entries
+                with new repeats are returned, the oldest `limit` of them. If not given, the latest `limit` lines
+                are returned.
+            limit (int): Maximum number of lines to return
+            level (str): Only lines of this level or a more severe one are returned, see `LOG_LEVELS`
+
+        Returns:
+            list: the log lines in buffer order, entries with new repeats keep their place and cursor
+        """
+
+        with self._lock:
+            lines = [line for line in self._lines if is_at_least(line.level, level)] if level else list(self._lines)
+            if after is None:
+                return lines[-limit:] if limit > 0 else []
+            try:
+                after_ns = int(after)
+            except ValueError:
+                raise ValueError("invalid log cursor")
+            # entries with new repeats sit before newer lines, so the whole buffer is searched
+            newer = [line for line in lines if int(line.newest_cursor) > after_ns]
+            if len(newer) > limit:
+                if limit <= 0:
+                    return []
+                # keep the oldest by their newest cursor, so nothing older than the returned ones is left behind
+                newest_ns = sorted(int(line.newest_cursor) for line in newer)[limit - 1]
+                newer = [line for line in newer if int(line.newest_cursor) <= newest_ns]
+            return newer
+
+
+class LogStore:
+    """Holds the log buffers of all servers."""
+
+    def __init__(self, size: int, refresh_interval: float):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self._buffers: Dict[str, LogBuffer] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_id: str) -> LogBuffer:
+        """Returns the buffer of a server, creating it on first use."""
+
+        buffer = self._buffers.get(server_id)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(server_id, LogBuffer(self.size, self.refresh_interval))
+        return buffer
+
+    def forget(self, server_id: str):
+        """Drops the buffer of a server, e.g. after it was deleted."""
+
+        with self._lock:
+            self._buffers.pop(server_id, None)
+
+
+log_store = LogStore(settings.LOG_BUFFER_LINES, settings.LOG_REFRESH_INTERVAL)
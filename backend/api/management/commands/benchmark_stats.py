@@ -0,0 +1,42 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.models import Server
+from api.stats_backends import CgroupBackend, DockerApiBackend
+
+
+class Command(BaseCommand):
+    help = "Compares the latency of the docker api and the cgroup stats backend on the running servers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=10, help="readings per server and backend")
+
+    def handle(self, *args, rounds, **options):
+        servers = [server for server in Server.objects.all() if server.running]
+        if not servers:
+            self.stderr.write("no running servers to benchmark")
+            return
+
+        backends = [DockerApiBackend(), CgroupBackend(settings.CGROUP_ROOT, settings.PROC_ROOT)]
+        for backend in backends:
+            timings = []
+            for server in servers:
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    try:
+                        backend.read(server.container)
+                    except OSError as e:
+                        self.stderr.write(f"{backend.name}: cannot read {server.name}: {e}")
+                        break
+                    timings.append(time.perf_counter() - started)
+            if not timings:
+                self.stdout.write(f"{backend.name:>8}: not available")
+                continue
+            timings.sort()
+            self.stdout.write(f"{backend.name:>8}: {len(timings)} readings, "
+                              f"mean {statistics.mean(timings) * 1000:.2f} ms, "
+                              f"median {statistics.median(timings) * 1000:.2f} ms, "
+                              f"p95 {timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000:.2f} ms")
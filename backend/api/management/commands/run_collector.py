@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.collector import StatsCollector
+from api.events import container_index
+from api.log_index import log_indexer
+from api.metrics import metrics_history
+from api.shared_state import SharedStateWriter
+
+
+class Command(BaseCommand):
+    help = ("Runs the stats collector and shares its readings and the container index with the web workers "
+            "through SHARED_STATE_PATH, persists the usage history and runs the log indexer")
+
+    def handle(self, *args, **options):
+        if not settings.SHARED_STATE_PATH:
+            raise CommandError("SHARED_STATE_PATH is not set, the web workers run their own collectors")
+
+        container_index.publish()
+        metrics_history.persist = True
+        writer = SharedStateWriter(settings.SHARED_STATE_PATH, settings.SHARED_STATE_SLOTS)
+        collector = StatsCollector(settings.STATS_COLLECTOR_INTERVAL, settings.STATS_COLLECTOR_WORKERS,
+                                   settings.STATS_COLLECTOR_MODE, sink=writer,
+                                   sidecars=settings.STATS_SIDECAR_SERVICES)
+        if settings.LOG_INDEX_ENABLED:
+            log_indexer.start()
+        self.stdout.write(f"collecting stats into {settings.SHARED_STATE_PATH}")
+        try:
+            collector.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,276 @@
+"""
+History of the cpu and memory usage of every server.
+
+Each server keeps one fixed-size ring buffer per resolution (ex.: 1 s for 10 min, 1 min for 24 h, 15 min for 30 d).
+A bucket stores min, sum and max of the samples that fell into it, so reads can return min/avg/max at any step.
+All buffers are preallocated arrays, so the memory used per server is known in advance (`bytes_per_server`).
+Buffers are persisted as one blob per server and resolution in a single transaction every `flush_interval` seconds,
+only by the process that records them (`persist`), which is the `manage.py run_collector` process.
+"""
+
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+# blobs start with a format version, so a changed layout is not misread; all values are fixed-width little endian
+FORMAT = b"RS01"
+HEADER = struct.Struct("<4sii")
+FIELDS = ("cpu_min", "cpu_sum", "cpu_max", "memory_min", "memory_sum", "memory_max")
+
+
+class MetricPoint(NamedTuple):
+    """Aggregated usage of a server in one time bucket.
+
+    Args:
+        timestamp (int): unix timestamp of the start of the bucket
+    """
+
+    timestamp: int
+    cpu_min: float
+    cpu_avg: float
+    cpu_max: float
+    memory_min: float
+    memory_avg: float
+    memory_max: float
+
+
+class RingSeries:
+    """Ring buffer of `slots` buckets that are `step` seconds wide."""
+
+    def __init__(self, step: int, slots: int):
+        self.step = step
+        self.slots = slots
+        self.bucket_ids = array("q", [-1]) * slots
+        self.counts = array("q", [0]) * slots
+        self.values = {field: array("d", [0.0]) * slots for field in FIELDS}
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.bucket_ids, self.counts, *self.values.values()]
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def add(self, timestamp: float, cpu: float, memory: float):
+        bucket_id = int(timestamp) // self.step
+        slot = bucket_id % self.slots
+        values = self.values
+        if self.bucket_ids[slot] != bucket_id:
+            self.bucket_ids[slot] = bucket_id
+            self.counts[slot] = 1
+            values["cpu_min"][slot] = values["cpu_sum"][slot] = values["cpu_max"][slot] = cpu
+            values["memory_min"][slot] = values["memory_sum"][slot] = values["memory_max"][slot] = memory
+            return
+        self.counts[slot] += 1
+        values["cpu_sum"][slot] += cpu
+        values["memory_sum"][slot] += memory
+        values["cpu_min"][slot] = min(values["cpu_min"][slot], cpu)
+        values["cpu_max"][slot] = max(values["cpu_max"][slot], cpu)
+        values["memory_min"][slot] = min(values["memory_min"][slot], memory)
+        values["memory_max"][slot] = max(values["memory_max"][slot], memory)
+
+    def covers(self, start: float, now: float) -> bool:
+        """Checks if the buffer still holds buckets as old as `start`."""
+
+        return int(now) // self.step - int(start) // self.step < self.slots
+
+    def query(self, start: float, end: float, step: int) -> List[MetricPoint]:
+        """Returns the buckets between `start` and `end`, merged into buckets of `step` seconds.
+
+        `step` is rounded up to a multiple of the resolution of this buffer. Empty buckets are skipped.
+        """
+
+        factor = max(1, -(-step // self.step))
+        merged: Dict[int, List[float]] = {}
+        values = self.values
+        last_id = int(end) // self.step
+        for bucket_id in range(max(int(start) // self.step, last_id - self.slots + 1), last_id + 1):
+            slot = bucket_id % self.slots
+            if self.bucket_ids[slot] != bucket_id:
+                continue
+            key = bucket_id // factor
+            count = self.counts[slot]
+            current = merged.get(key)
+            if current is None:
+                merged[key] = [count, values["cpu_min"][slot], values["cpu_sum"][slot], values["cpu_max"][slot],
+                               values["memory_min"][slot], values["memory_sum"][slot], values["memory_max"][slot]]
+                continue
+            current[0] += count
+            current[1] = min(current[1], values["cpu_min"][slot])
+            current[2] += values["cpu_sum"][slot]
+            current[3] = max(current[3], values["cpu_max"][slot])
+            current[4] = min(current[4], values["memory_min"][slot])
+            current[5] += values["memory_sum"][slot]
+            current[6] = max(current[6], values["memory_max"][slot])
+
+        return [MetricPoint(key * factor * self.step, cpu_min, cpu_sum / count, cpu_max,
+                            memory_min, memory_sum / count, memory_max)
+                for key, (count, cpu_min, cpu_sum, cpu_max, memory_min, memory_sum, memory_max)
+                in sorted(merged.items())]
+
+    def dumps(self) -> bytes:
+        arrays = [self.bucket_ids, self.counts, *(self.values[field] for field in FIELDS)]
+        if sys.byteorder != "little":
+            arrays = [array(values.typecode, values) for values in arrays]
+            for values in arrays:
+                values.byteswap()
+        return HEADER.pack(FORMAT, self.step, self.slots) + b"".join(values.tobytes() for values in arrays)
+
+    @classmethod
+    def loads(cls, data: bytes) -> "RingSeries":
+        """Deserializes a buffer written by `dumps`.
+
+        Raises:
+            ValueError: the blob was written in another format or is truncated
+        """
+
+        if len(data) < HEADER.size:
+            raise ValueError("metrics blob is truncated")
+        version, step, slots = HEADER.unpack_from(data)
+        if version != FORMAT:
+            raise ValueError(f"unknown metrics blob format {version!r}")
+        series = cls(step, slots)
+        if len(data) != HEADER.size + series.nbytes:
+            raise ValueError("metrics blob is truncated")
+        offset = HEADER.size
+        for values in [series.bucket_ids, series.counts, *(series.values[field] for field in FIELDS)]:
+            size = slots * values.itemsize
+            values[:] = array(values.typecode, data[offset:offset + size])
+            if sys.byteorder != "little":
+                values.byteswap()
+            offset += size
+        return series
+
+
+class ServerHistory:
+    """The ring buffers of one server, one per resolution."""
+
+    def __init__(self, resolutions: Sequence[Tuple[int, int]]):
+        self.series = [RingSeries(step, slots) for step, slots in resolutions]
+        self.dirty = False
+        # histories of servers sampled by another process are reloaded from the db once they are stale
+        self.recorded = False
+        self.loaded_at = time.monotonic()
+
+    def add(self, timestamp: float, cpu: float, memory: float):
+        for series in self.series:
+            series.add(timestamp, cpu, memory)
+        self.dirty = True
+        self.recorded = True
+
+    def query(self, start: float, end: float, step: int) -> List[MetricPoint]:
+        """Answers from the finest resolution that still covers `start` and is not finer than `step`."""
+
+        now = time.time()
+        candidates = [series for series in self.series if series.covers(start, now)]
+        if not candidates:
+            candidates = [self.series[-1]]
+        fitting = [series for series in candidates if series.step <= step] or candidates[:1]
+        return fitting[-1].query(start, end, step)
+
+
+class MetricsHistory:
+    """Holds the history of all servers and persists it in batches."""
+
+    def __init__(self, resolutions: Sequence[Tuple[int, int]], flush_interval: float,
+                 reload_interval: Optional[float] = None, persist: bool = False):
+        self.resolutions = sorted(resolutions)
+        self.flush_interval = flush_interval
+        # only the single collector process writes the archive, other processes would overwrite its histories
+        self.persist = persist
+        # set in processes that only read histories, which another process records and flushes
+        self.reload_interval = reload_interval
+        self._histories: Dict[str, ServerHistory] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    @property
+    def bytes_per_server(self) -> int:
+        return sum(RingSeries(step, slots).nbytes for step, slots in self.resolutions)
+
+    def record(self, server_id: str, timestamp: float, cpu: float, memory: float):
+        """Adds a sample to the history of a server."""
+
+        history = self._get(server_id)
+        with self._lock:
+            history.add(timestamp, cpu, memory)
+
+    def query(self, server_id: str, start: float, end: float, step: int) -> List[MetricPoint]:
+        """Returns the usage of a server between `start` and `end` in buckets of at least `step` seconds."""
+
+        history = self._get(server_id)
+        with self._lock:
+            return history.query(start, end, step)
+
+    def forget(self, server_id: str):
+        with self._lock:
+            self._histories.pop(server_id, None)
+
+    def flush_if_due(self):
+        """Persists the changed histories if the last flush is `flush_interval` seconds ago."""
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Persists all changed histories in one transaction, unless this process does not `persist` them."""
+
+        from api.models import ServerMetricsArchive, Server
+
+        if not self.persist:
+            return
+        with self._lock:
+            self._last_flush = time.monotonic()
+            dirty = {server_id: [(series.step, series.dumps()) for series in history.series]
+                     for server_id, history in self._histories.items() if history.dirty}
+            for server_id in dirty:
+                self._histories[server_id].dirty = False
+        if not dirty:
+            return
+
+        existing_servers = set(Server.objects.filter(pk__in=dirty).values_list("pk", flat=True))
+        with transaction.atomic():
+            ServerMetricsArchive.objects.filter(server_id__in=existing_servers).delete()
+            ServerMetricsArchive.objects.bulk_create([
+                ServerMetricsArchive(server_id=server_id, step=step, data=data)
+                for server_id, blobs in dirty.items() if server_id in existing_servers
+                for step, data in blobs
+            ])
+
+    def _get(self, server_id: str) -> ServerHistory:
+        history = self._histories.get(server_id)
+        if history is not None and self.reload_interval is not None and not history.recorded \
+                and time.monotonic() - history.loaded_at > self.reload_interval:
+            loaded = self._load(server_id)
+            with self._lock:
+                history = self._histories[server_id] = loaded
+        elif history is None:
+            loaded = self._load(server_id)
+            with self._lock:
+                history = self._histories.setdefault(server_id, loaded)
+        return history
+
+    def _load(self, server_id: str) -> ServerHistory:
+        from api.models import ServerMetricsArchive
+
+        history = ServerHistory(self.resolutions)
+        stored = {archive.step: archive.data
+                  for archive in ServerMetricsArchive.objects.filter(server_id=server_id)}
+        for index, series in enumerate(history.series):
+            data = stored.get(series.step)
+            if data is not None:
+                try:
+                    loaded = RingSeries.loads(bytes(data))
+                except ValueError:  # written in an older format, start over
+                    continue
+                if loaded.slots == series.slots:  # the configured size changed, start over
+                    history.series[index] = loaded
+        return history
+
+
+metrics_history = MetricsHistory(settings.METRICS_RESOLUTIONS, settings.METRICS_FLUSH_INTERVAL,
+                                 settings.METRICS_FLUSH_INTERVAL if settings.SHARED_STATE_PATH else None)
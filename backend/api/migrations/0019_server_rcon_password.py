@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_provisioningjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='rcon_password',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
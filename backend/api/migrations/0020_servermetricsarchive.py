@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_server_rcon_password'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerMetricsArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metrics_archives', to='api.server')),
+            ],
+            options={
+                'unique_together': {('server', 'step')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_servermetricsarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=16)),
+                ('host', models.CharField(max_length=255)),
+                ('port', models.IntegerField()),
+                ('expires_at', models.FloatField()),
+            ],
+            options={
+                'unique_together': {('host', 'port')},
+            },
+        ),
+    ]
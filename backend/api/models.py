@@ -1,18 +1,27 @@
+import logging
 import os
 import secrets
 import subprocess
 import time
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Optional
 
 import django.template
-import docker
 import yaml
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 from docker.errors import NotFound
-from dateutil.parser import isoparse
 
+from api.app_templates import template_registry
+from api.collector import StatsReading
+from api.docker_clients import get_docker_client
+from api.events import container_index
+from api.logs import LogLine, log_store
+from api.rcon import RconError, RconSentError, rcon_pool
+from api.stats_backends import stats_backend
+
+logger = logging.getLogger(__name__)
 
 def create_id() -> str:
     """creates an id to identify a server.
@@ -24,6 +33,26 @@ def create_id() -> str:
     return secrets.token_hex(5)
 
 
+class ServerQuerySet(models.QuerySet):
+    def manageable_by(self, user: User) -> "ServerQuerySet":
+        """Filters the servers down to the ones the given user can manage.
+
+        Staff and superusers can manage every server, other users only the servers they are an allowed user of.
+        The check is done by the database with a single join on the `allowed_users` table.
+
+        Args:
+            user (django.contrib.auth.models.user): The user that should be checked for permission
+        Returns:
+            ServerQuerySet: The servers the user is allowed to manage
+        """
+
+        if user.is_superuser or user.is_staff:
+            return self
+        if not user.is_authenticated:
+            return self.none()
+        return self.filter(allowed_users=user)
+
+
 class Server(models.Model):
     server_id = models.CharField(primary_key=True, default=create_id, editable=False, max_length=16, unique=True)
     description = models.CharField(max_length=200)
@@ -34,10 +63,13 @@ class Server(models.Model):
     port = models.IntegerField(unique=True)
     sftp_port = models.IntegerField(unique=True)
     sftp_password = models.CharField(max_length=64)
+    rcon_password = models.CharField(max_length=64, blank=True)
     max_cpu_usage = models.FloatField()
     max_memory_usage = models.FloatField()
     host = models.CharField(default=settings.SERVER_DEFAULT_HOST, max_length=255)
 
+    objects = ServerQuerySet.as_manager()
+
     docker_client = None
     container = None
     container_available = True
@@ -45,10 +77,11 @@ class Server(models.Model):
     def load_docker_client(self):
         """loads the docker client.
 
-        Loads the docker client instance into the class variable `docker_client` if it is not loaded yet.
+        Loads the shared docker client for the servers `host` into the class variable `docker_client`
+        if it is not loaded yet.
         """
         if not self.docker_client:
-            self.docker_client = docker.from_env()
+            self.docker_client = get_docker_client(self.host)
 
     def load_container(self):
         """loads the container object.
@@ -57,57 +90,125 @@ class Server(models.Model):
         If the container was not found, it sets the class variable `container_available` to `False` and
         `container` to None
         If class variable docker_client is `None`, it loads the docker client using `self.load_docker_client()`
+        The container is taken from the `container_index` if its host is synced, otherwise it is inspected.
+        Containers from the index only carry id, name and state, use `self.container.reload()` for the rest.
         """
 
         if not self.docker_client:
             self.load_docker_client()
         if not self.container:
+            known, state = container_index.lookup(self.host, str(self.name))
+            if known:
+                self.container_available = state is not None
+                self.container = self.docker_client.containers.prepare_model(state.to_attrs()) if state else None
+                return
             try:
                 self.container = self.docker_client.containers.get(str(self.name) + "_main_1")
             except NotFound:
                 self.container_available = False
                 self.container = None
 
+    def forget_container(self):
+        """Forgets the loaded container, so the next `load_container` looks it up again."""
+
+        self.container = None
+        self.container_available = True
+
+    @property
+    def app_path(self) -> str:
+        """The directory holding the docker-compose project of this server."""
+
+        return f"{os.environ['APP_DIR']}/{self.name}"
+
     def create(self, template_config: Dict[str, str]):
         """Creates the Docker containers belonging to this server.
 
         This function should be called after populating a new instance of `Server` with data and saving it.
+        It runs all provisioning steps in order: `render`, `pull`, `up`.
+        See `api.provisioning` for running them in the background.
+        """
+
+        self.render(template_config)
+        self.pull()
+        self.up()
+
+    def render(self, template_config: Dict[str, str]):
+        """Renders the template of this server into its docker-compose file.
+
         It renders the template given with the values given to the `Server` instance.
         Then it creates a directory with the servers `name` and creates
         docker-compose file with the rendered template.
-        In the end it runs `docker-compose up -d` to bring up the project.
+
+        Raises:
+            FileExistsError: the directory of the server already exists
         """
 
-        self.load_docker_client()
-        with open(f"app_templates.v2/{self.template}.yml", "r") as file:
-            template_string = file.read()
-            template = django.template.Template(template_string)
-            context = django.template.Context({
-                "name": self.name,
-                "description": self.description,
-                "port": self.port,
-                "sftp_port": self.sftp_port,
-                "sftp_password": self.sftp_password,
-                "max_cpu_usage": self.max_cpu_usage,
-                "max_memory_usage": self.max_memory_usage,
-                "template_config": template_config,
-                "timezone": os.environ["TIMEZONE"]
-            })
-
-            config = yaml.safe_load(template.render(context))
-            compose_config = yaml.safe_dump(config["compose_config"], sort_keys=False)
-
-            self.command_prefix = config["command_prefix"]
-
-            path = f"{os.environ['APP_DIR']}/{self.name}"
-
-            if os.path.exists(path):
-                raise FileExistsError("path is not empty")
-
-            subprocess.Popen(["mkdir", "-p", path]).wait()
-            with open(f"{os.environ['APP_DIR']}/{self.name}/docker-compose.yml", "w") as compose_file:
-                compose_file.write(compose_config)
-            subprocess.Popen(["docker-compose", "up", "-d"], cwd=path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).wait()
+        template = template_registry.get(self.template).compiled
+        context = django.template.Context({
+            "name": self.name,
+            "description": self.description,
+            "port": self.port,
+            "sftp_port": self.sftp_port,
+            "sftp_password": self.sftp_password,
+            "rcon_password": self.rcon_password,
+            "max_cpu_usage": self.max_cpu_usage,
+            "max_memory_usage": self.max_memory_usage,
+            "template_config": template_config,
+            "timezone": os.environ["TIMEZONE"]
+        })
+
+        config = yaml.safe_load(template.render(context))
+        compose_config = yaml.safe_dump(config["compose_config"], sort_keys=False)
+
+        self.command_prefix = config["command_prefix"]
+
+        path = self.app_path
+
+        if os.path.exists(path):
+            raise FileExistsError("path is not empty")
+
+        os.makedirs(path)
+        with open(f"{path}/docker-compose.yml", "w") as compose_file:
+            compose_file.write(compose_config)
+
+    def pull(self):
+        """Pulls the images of the docker-compose project. This can take minutes for big images."""
+
+        self._compose("pull")
+
+    def up(self):
+        """Runs `docker-compose up -d` to bring up the project."""
+
+        self._compose("up", "-d")
+
+    def _compose(self, *args: str):
+        result = subprocess.run(["docker-compose", *args], cwd=self.app_path, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"docker-compose {' '.join(args)} failed: {result.stderr.decode().strip()}")
+
+    def wait_until_healthy(self, timeout: float, interval: float = 2):
+        """Waits until the main container is running and, if it has a health check, healthy.
+
+        Args:
+            timeout (float): Seconds to wait at most
+            interval (float): Seconds between two checks
+
+        Raises:
+            TimeoutError: the container did not become healthy in time
+        """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            self.forget_container()
+            self.load_container()
+            if self.container_available:
+                health = self.container.attrs["State"].get("Health", {}).get("Status")
+                if self.container.status == "running" and health in (None, "healthy"):
+                    return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"server did not become healthy within {timeout:.0f} seconds")
+            time.sleep(interval)
 
     def power_action(self, action: str):
         """Performs a power action for the server
@@ -148,32 +249,64 @@ class Server(models.Model):
 
     @property
     def stats(self):
-        """Gets the cpu and memory usage of a server using docker api.
+        """Gets the cpu and memory usage of a server from the configured `stats_backend`, see `usage`.
 
         Returns:
-            int: cpu_usage
+            float: cpu_usage
             int: memory_usage
 
         """
 
+        usage = self.usage
+        return usage.cpu_usage, usage.memory_usage
+
+    @property
+    def usage(self) -> StatsReading:
+        """Gets the cpu, memory, network and block io usage of a server using the configured stats backend.
+
+        See `api.stats_backends`, the cgroup backend reports a cpu usage of 0 on its first reading of a container.
+
+        Returns:
+            StatsReading: the usage of the main container, all zero if it is not running
+        """
+
         self.load_container()
 
         if self.running:
-            stats = self.container.stats(stream=False)
-            cpu_delta = stats['cpu_stats']['cpu_usage']['total_usage'] - stats['precpu_stats']['cpu_usage'][
-                'total_usage']
-            system_cpu_delta = stats['cpu_stats']['system_cpu_usage'] - stats['precpu_stats']['system_cpu_usage']
-            cpu_usage = (cpu_delta / system_cpu_delta) * stats['cpu_stats']['online_cpus']
-            memory_usage = stats['memory_stats']['usage']
+            return stats_backend.read(self.container)
+        return StatsReading(0, 0, time.time())
 
-            return cpu_usage, memory_usage
-        return 0, 0
+    def service_usage(self, service: str) -> StatsReading:
+        """Gets the usage of one service of the servers docker-compose project, ex.: "main" or "sftp".
 
-    def get_logs(self, lines: int) -> List[Dict]:
-        """Returns the last log lines as list of strings.
+        Args:
+            service (str): Name of the service in the app template
+
+        Returns:
+            StatsReading: the usage of the services container, all zero if it does not exist or is not running
+        """
+
+        if service == "main":
+            return self.usage
+        self.load_docker_client()
+        try:
+            container = self.docker_client.containers.get(f"{self.name}_{service}_1")
+        except NotFound:
+            return StatsReading(0, 0, time.time())
+        if container.status != "running":
+            return StatsReading(0, 0, time.time())
+        return stats_backend.read(container)
+
+    def get_logs(self, lines: int, after: Optional[str] = None, level: Optional[str] = None) -> List[LogLine]:
+        """Returns the last log lines or the lines following a cursor.
+
+        The lines are served from the servers log buffer, which only fetches new lines from docker
+        and classifies them with the log parser of the template.
 
         Args:
-            lines (int): Number of lines to return
+            lines (int): Maximum number of lines to return
+            after (str): Cursor of a line, only lines after it are returned. See `api.logs.LogBuffer.read`
+            level (str): Only lines of this level or a more severe one are returned. See `api.logs.LOG_LEVELS`
 
         Returns:
             list: List of log lines
@@ -181,21 +314,19 @@ class Server(models.Model):
 
         self.load_container()
         if self.container_available:
-            logs = self.container.logs(tail=lines, timestamps=True).decode().split("\n")
-            logs_formatted = []
-            for line in logs:
-                try:
-                    split = line.split(" ")
-                    timestamp = time.mktime(isoparse(split[0]).timetuple())
-                    logs_formatted.append({"timestamp": timestamp, "content": ' '.join(split[1:]), "source": "log"})
-                except ValueError:
-                    pass
-            return logs_formatted
+            buffer = log_store.get(self.server_id)
+            buffer.refresh(self.container, template_registry.get(self.template).log_parser)
+            return buffer.read(after, lines, level)
         return []
 
     def exec_command(self, command: str) -> Tuple[int, str]:
         """Executes a command on the server
 
+        If the template declares an `rcon` host and port and the server has an rcon password, the command is sent
+        over a pooled RCON connection. `{name}` in the host is replaced by the server name, so `{name}_main_1`
+        reaches the main container if the backend is attached to the server's compose network. Otherwise, or if
+        the command could not be sent over RCON, it is run with `docker exec`.
+
         Args:
             command (str): The command to execute. It will be prefixed with the command_prefix defined by the template
 
@@ -204,10 +335,22 @@ class Server(models.Model):
 
         Raises:
             docker.errors.NotFound: the container for this server could not be found
+            api.rcon.RconSentError: the command was sent over RCON, but the response was lost. It is not run
+                again with `docker exec`, because it may have run already.
         """
 
         self.load_container()
-        print(self.command_prefix)
+        rcon_config = template_registry.get(self.template).config.get("rcon")
+        if rcon_config and rcon_config.get("host") and self.rcon_password and self.container_available:
+            try:
+                host = rcon_config["host"].format(name=self.name)
+                client = rcon_pool.get(self.server_id, host, int(rcon_config["port"]), self.rcon_password)
+                return 0, client.command(command)
+            except RconSentError:
+                raise
+            except RconError as e:
+                logger.warning("rcon failed for %s, falling back to docker exec: %s", self.name, e)
+
         result = self.container.exec_run(str(self.command_prefix) + " " + command)
         return result.exit_code, result.output.decode()
 
@@ -222,12 +365,10 @@ class Server(models.Model):
 
         if user.is_superuser or user.is_staff:
             return True
+        if not user.is_authenticated:
+            return False
 
-        allowed_users = []
-        for u in self.allowed_users.all():
-            allowed_users.append(u)
-
-        return user in allowed_users
+        return self.allowed_users.filter(pk=user.pk).exists()
 
     def __repr__(self):
         """Defines how the class should be printed.
@@ -246,3 +387,94 @@ class Server(models.Model):
         """
 
         return self.description
+
+
+class ProvisioningJob(models.Model):
+    """Tracks the background creation of a server, see `api.provisioning`.
+
+    `phase_timings` maps each started phase to a dict with its `started_at` and `finished_at` unix timestamps.
+    """
+
+    PHASES = ("render", "pull", "up", "healthy")
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    job_id = models.CharField(primary_key=True, default=create_id, editable=False, max_length=16)
+    server = models.ForeignKey(Server, on_delete=models.CASCADE, related_name="provisioning_jobs")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    phase = models.CharField(max_length=16, blank=True)
+    phase_timings = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def start_phase(self, phase: str):
+        """Marks a phase as started and saves the job."""
+
+        self.status = self.STATUS_RUNNING
+        self.phase = phase
+        self.phase_timings[phase] = {"started_at": time.time(), "finished_at": None}
+        self.save(update_fields=["status", "phase", "phase_timings"])
+
+    def finish_phase(self, phase: str):
+        """Marks a phase as finished and saves the job."""
+
+        self.phase_timings[phase]["finished_at"] = time.time()
+        self.save(update_fields=["phase_timings"])
+
+    def finish(self, error: str = ""):
+        """Marks the job as succeeded or, if an error is given, as failed and saves it."""
+
+        self.status = self.STATUS_FAILED if error else self.STATUS_SUCCEEDED
+        self.error = error
+        self.finished_at = timezone.now()
+        self.save(update_fields=["status", "error", "finished_at"])
+
+    def __str__(self):
+        return f"{self.server} ({self.status})"
+
+
+class ServerMetricsArchive(models.Model):
+    """The persisted usage history of a server at one resolution, see `api.metrics`.
+
+    `data` is a `RingSeries` serialized with `RingSeries.dumps`.
+    """
+
+    server = models.ForeignKey(Server, on_delete=models.CASCADE, related_name="metrics_archives")
+    step = models.IntegerField()
+    data = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [("server", "step")]
+
+    def __str__(self):
+        return f"{self.server} ({self.step}s)"
+
+
+class PortReservation(models.Model):
+    """A host port held back for a server that is about to be created, see `api.ports.PortAllocator`.
+
+    A port can only be reserved once per host, so processes that reserve the same port concurrently conflict
+    in the database.
+    """
+
+    token = models.CharField(max_length=16, db_index=True)
+    host = models.CharField(max_length=255)
+    port = models.IntegerField()
+    expires_at = models.FloatField()
+
+    class Meta:
+        unique_together = [("host", "port")]
+
+    def __str__(self):
+        return f"{self.host}:{self.port} ({self.token})"
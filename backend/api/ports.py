@@ -0,0 +1,208 @@
+"""
+Allocation of host ports for servers.
+
+Used ports are collected into a bitmap from three sources: the `port`/`sftp_port` columns of the servers
+on a host, the port map of the running docker containers and the reservations of creates in progress.
+Candidates that look free are confirmed with a cheap local bind test.
+Building the bitmap queries the database and the docker daemon, so every public method builds it once.
+Reservations are stored in the database, so all worker processes see them and a port reserved by two
+processes at once conflicts on insert.
+"""
+
+import secrets
+import socket
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from api.docker_clients import get_docker_client
+
+MIN_PORT = 1000
+MAX_PORT = 60000
+# times a reservation is retried after another process reserved one of its ports first
+RESERVE_ATTEMPTS = 3
+
+
+class Reservation(NamedTuple):
+    """A set of ports held back for a server that is about to be created.
+
+    Args:
+        token (str): Identifies the reservation, pass it back when using the ports
+        ports (list): The reserved ports
+        host (str): The docker host the ports were reserved on
+        expires_at (float): unix timestamp after which the ports are handed out again
+    """
+
+    token: str
+    ports: List[int]
+    host: str
+    expires_at: float
+
+
+class PortInUseError(ValueError):
+    """Raised when a port can not be reserved because it is used."""
+
+    def __init__(self, port: int):
+        super().__init__(f"port {port} is already in use")
+        self.port = port
+
+
+class PortAllocator:
+    """Hands out free host ports and keeps them reserved until the server using them is saved."""
+
+    def __init__(self, min_port: int, max_port: int, reservation_ttl: float):
+        self.min_port = min_port
+        self.max_port = max_port
+        self.reservation_ttl = reservation_ttl
+        self._lock = threading.Lock()
+        self._cursor = min_port
+
+    def is_port_in_use(self, port: int, host: Optional[str] = None, token: Optional[str] = None) -> bool:
+        """Checks if a port is in use.
+
+        Args:
+            port (int): The port to check
+            host (str): The docker host, defaults to `settings.SERVER_DEFAULT_HOST`
+            token (str): Ports of this reservation are not counted as used
+
+        Returns:
+            bool: Whether or not the port is used
+        """
+
+        host = host or settings.SERVER_DEFAULT_HOST
+        with self._lock:
+            used = self._used_ports(host, ignore_token=token)
+        return bool(used[port]) or not self._can_bind(port)
+
+    def allocate(self, count: int, host: Optional[str] = None) -> Reservation:
+        """Finds and reserves `count` free ports.
+
+        Args:
+            count (int): Number of ports to allocate
+            host (str): The docker host, defaults to `settings.SERVER_DEFAULT_HOST`
+
+        Returns:
+            Reservation: the reservation holding the ports
+
+        Raises:
+            ValueError: there are not enough free ports left
+        """
+
+        return self.reserve([], host, allocate=count)
+
+    def reserve(self, ports: Iterable[int], host: Optional[str] = None, token: Optional[str] = None,
+                allocate: int = 0) -> Reservation:
+        """Reserves the given ports and `allocate` free ones, checking all of them against one bitmap.
+
+        Args:
+            ports (list): The ports to reserve
+            host (str): The docker host, defaults to `settings.SERVER_DEFAULT_HOST`
+            token (str): An existing reservation that is replaced by this one. Its ports may be reused.
+            allocate (int): Number of free ports to find and reserve after the given ones
+
+        Returns:
+            Reservation: the new reservation, the given ports followed by the allocated ones
+
+        Raises:
+            PortInUseError: one of the given ports is used
+            ValueError: there are not enough free ports left
+        """
+
+        host = host or settings.SERVER_DEFAULT_HOST
+        requested = list(ports)
+        for attempt in range(RESERVE_ATTEMPTS):
+            with self._lock:
+                used = self._used_ports(host, ignore_token=token)
+                ports = list(requested)
+                for port in ports:
+                    if used[port] or not self._can_bind(port):
+                        raise PortInUseError(port)
+                    used[port] = 1
+                if allocate:
+                    ports += self._find_free_ports(used, allocate)
+            try:
+                return self._add_reservation(ports, host, token)
+            except IntegrityError:  # another process reserved one of the ports since the bitmap was built
+                if attempt == RESERVE_ATTEMPTS - 1:
+                    raise ValueError("ports are being reserved concurrently, try again")
+
+    def release(self, token: Optional[str]):
+        """Releases a reservation. Unknown or expired tokens are ignored."""
+
+        from api.models import PortReservation
+
+        if token:
+            PortReservation.objects.filter(token=token).delete()
+
+    def _find_free_ports(self, used: bytearray, count: int) -> List[int]:
+        """Finds `count` free ports, starting after the last allocated one. Must be called with the lock held."""
+
+        ports = []
+        span = self.max_port - self.min_port + 1
+        for offset in range(span):
+            port = self.min_port + (self._cursor - self.min_port + offset) % span
+            if not used[port] and self._can_bind(port):
+                ports.append(port)
+                if len(ports) == count:
+                    break
+        if len(ports) < count:
+            raise ValueError("not enough free ports left")
+        self._cursor = ports[-1] + 1 if ports[-1] < self.max_port else self.min_port
+        return ports
+
+    def _add_reservation(self, ports: List[int], host: str, replaced: Optional[str]) -> Reservation:
+        """Stores a reservation and drops the one it replaces in one transaction.
+
+        Raises:
+            IntegrityError: one of the ports is reserved already
+        """
+
+        from api.models import PortReservation
+
+        reservation = Reservation(secrets.token_hex(8), ports, host, time.time() + self.reservation_ttl)
+        with transaction.atomic():
+            if replaced:
+                PortReservation.objects.filter(token=replaced).delete()
+            PortReservation.objects.bulk_create([
+                PortReservation(token=reservation.token, host=host, port=port, expires_at=reservation.expires_at)
+                for port in ports
+            ])
+        return reservation
+
+    def _used_ports(self, host: str, ignore_token: Optional[str] = None) -> bytearray:
+        """Builds the bitmap of used ports on a host. Must be called with the lock held."""
+
+        from api.models import PortReservation, Server
+
+        used = bytearray(65536)
+        for port, sftp_port in Server.objects.filter(host=host).values_list("port", "sftp_port"):
+            used[port] = used[sftp_port] = 1
+
+        for container in get_docker_client(host).containers.list(sparse=True):
+            for port in container.attrs.get("Ports") or []:
+                if port.get("PublicPort"):
+                    used[port["PublicPort"]] = 1
+
+        PortReservation.objects.filter(expires_at__lt=time.time()).delete()
+        reserved = PortReservation.objects.filter(host=host).exclude(token=ignore_token)
+        for port in reserved.values_list("port", flat=True):
+            used[port] = 1
+        return used
+
+    @staticmethod
+    def _can_bind(port: int) -> bool:
+        """Checks if a tcp and an udp socket can be bound to the port on this machine."""
+
+        for kind in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+            with socket.socket(socket.AF_INET, kind) as sock:
+                try:
+                    sock.bind(("", port))
+                except OSError:
+                    return False
+        return True
+
+
+port_allocator = PortAllocator(MIN_PORT, MAX_PORT, settings.PORT_RESERVATION_TTL)
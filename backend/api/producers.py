@@ -0,0 +1,113 @@
+"""
+Producers for the graphql subscriptions, see `api.pubsub`.
+
+Each factory returns a blocking `produce(previous_state)` function that is called periodically on a worker thread.
+It returns the new state and the messages to publish, which are only the changes since the previous call.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from api.collector import get_collector
+from api.loaders import load_container_statuses
+from api.logs import newest_cursor
+from api.models import Server
+
+# fields that change on every call and are not worth a push on their own
+VOLATILE_STATE_FIELDS = ("sample_age",)
+
+
+def build_server_state(server_id: str, status: Optional[str]) -> Dict[str, Any]:
+    """Builds the state of a server from its container status and its latest stats reading.
+
+    Args:
+        server_id (str): ID of the server
+        status (str): Status of the servers main container or `None` if it does not exist
+
+    Returns:
+        dict: running, cpu_usage, memory_usage, the io rates, sampled_at and sample_age of the server
+    """
+
+    running = status == "running"
+    reading = get_collector().get(server_id)
+    return {
+        "running": running,
+        "cpu_usage": reading.cpu_usage if running and reading else 0,
+        "memory_usage": reading.memory_usage if running and reading else 0,
+        "network_rx_rate": reading.network_rx_rate if running and reading else 0,
+        "network_tx_rate": reading.network_tx_rate if running and reading else 0,
+        "block_read_rate": reading.block_read_rate if running and reading else 0,
+        "block_write_rate": reading.block_write_rate if running and reading else 0,
+        "sampled_at": reading.sampled_at if reading else None,
+        "sample_age": reading.age if reading else None
+    }
+
+
+def state_changed(previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> bool:
+    """Checks if a server state differs from the previous one, ignoring `VOLATILE_STATE_FIELDS`."""
+
+    if previous is None:
+        return True
+    return any(previous[key] != value for key, value in current.items() if key not in VOLATILE_STATE_FIELDS)
+
+
+def server_state_producer(server: Server):
+    """Publishes the state of one server whenever it changes."""
+
+    def produce(previous: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        status, = load_container_statuses([server])
+        current = build_server_state(server.server_id, status)
+        return current, [current] if state_changed(previous, current) else []
+
+    return produce
+
+
+def all_server_states_producer():
+    """Publishes the states of all servers that changed since the last call.
+
+    The state is a dict of server id to server state, messages are lists of `{"server_id", "state"}` dicts.
+    """
+
+    def produce(previous: Optional[Dict[str, Dict[str, Any]]]):
+        previous = previous or {}
+        try:
+            servers = list(Server.objects.all())
+        finally:
+            close_old_connections()
+        current = {server.server_id: build_server_state(server.server_id, status)
+                   for server, status in zip(servers, load_container_statuses(servers))}
+        changed = [{"server_id": server_id, "state": state} for server_id, state in current.items()
+                   if state_changed(previous.get(server_id), state)]
+        return current, [changed] if changed else []
+
+    return produce
+
+
+def all_server_states_snapshot(states: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Turns the state of `all_server_states_producer` into a message containing every server."""
+
+    return [{"server_id": server_id, "state": state} for server_id, state in states.items()]
+
+
+def server_logs_producer(server: Server):
+    """Publishes the log lines of one server that were written since the last call.
+
+    The state is the cursor of the newest line already published.
+    Lines that existed before the first call are not published, clients get them with the `logs` query.
+    Entries with new repeats are published again with their cursor, clients replace the entry they have.
+    The topic outlives containers, so the container is looked up again on every call.
+    """
+
+    def produce(cursor: Optional[str]):
+        server.forget_container()
+        if cursor is None:
+            lines = server.get_logs(settings.LOG_BUFFER_LINES)
+            return newest_cursor(lines) or "0", []
+        lines = server.get_logs(settings.LOG_BUFFER_LINES, after=cursor)
+        if not lines:
+            return cursor, []
+        return newest_cursor(lines), [lines]
+
+    return produce
@@ -0,0 +1,75 @@
+"""
+Background provisioning of new servers.
+
+Creating a server renders its template, pulls the images and brings up the docker-compose project,
+which can take minutes. The work runs on a bounded pool of worker threads instead of the request thread.
+Progress is stored in `ProvisioningJob` rows, so every worker process can report on it.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from api.models import ProvisioningJob, Server
+
+
+class ProvisioningQueue:
+    """Runs provisioning jobs on a bounded thread pool."""
+
+    def __init__(self, workers: int, health_timeout: float):
+        self.workers = workers
+        self.health_timeout = health_timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, server: Server, template_config: Dict[str, str]) -> ProvisioningJob:
+        """Queues the creation of a saved server.
+
+        Args:
+            server (Server): The server to create the containers for
+            template_config (dict): The template specific options
+
+        Returns:
+            ProvisioningJob: the queued job
+        """
+
+        job = ProvisioningJob.objects.create(server=server)
+        self._get_executor().submit(self.run, job.job_id, template_config)
+        return job
+
+    def run(self, job_id: str, template_config: Dict[str, str]):
+        """Runs all phases of a job. Errors are stored on the job instead of being raised."""
+
+        try:
+            job = ProvisioningJob.objects.select_related("server").get(pk=job_id)
+            server = job.server
+            steps = {
+                "render": lambda: server.render(template_config),
+                "pull": server.pull,
+                "up": server.up,
+                "healthy": lambda: server.wait_until_healthy(self.health_timeout),
+            }
+            try:
+                for phase in ProvisioningJob.PHASES:
+                    job.start_phase(phase)
+                    steps[phase]()
+                    job.finish_phase(phase)
+            except Exception as e:
+                job.finish(error=str(e) or e.__class__.__name__)
+            else:
+                job.finish()
+        finally:
+            close_old_connections()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="provisioning")
+        return self._executor
+
+
+provisioning_queue = ProvisioningQueue(settings.PROVISIONING_WORKERS, settings.PROVISIONING_HEALTH_TIMEOUT)
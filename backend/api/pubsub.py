@@ -0,0 +1,107 @@
+"""
+Fan-out of server updates to graphql subscriptions.
+
+Every topic (ex.: the state of one server) has a single producer, no matter how many clients subscribed to it.
+The producer runs while the topic has subscribers, calls a blocking `produce` function on the `docker_executor`
+every `interval` seconds and hands the messages it returns to all subscribers.
+"""
+
+import logging
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from api.executors import docker_executor
+
+logger = logging.getLogger(__name__)
+
+# produce(previous_state) -> (new_state, messages to publish)
+Produce = Callable[[Any], Tuple[Any, List[Any]]]
+# snapshot(state) -> message that brings a new subscriber up to date
+Snapshot = Callable[[Any], Any]
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Topic:
+    """A single producer and its subscribers."""
+
+    def __init__(self, produce: Produce, interval: float, snapshot: Optional[Snapshot]):
+        self.produce = produce
+        self.interval = interval
+        self.snapshot = snapshot
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.state: Any = None
+        self.task: Optional[asyncio.Task] = None
+
+    def add_subscriber(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if self.snapshot and self.state is not None:
+            queue.put_nowait(self.snapshot(self.state))
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return queue
+
+    def remove_subscriber(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.task:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, message: Any):
+        for queue in self.subscribers:
+            if queue.full():  # a slow client only misses old messages, it never blocks the producer
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                self.state, messages = await docker_executor.run(self.produce, self.state)
+                for message in messages:
+                    self.publish(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # keep serving the subscribers, the next round may succeed
+                logger.warning("subscription producer failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+class Broadcaster:
+    """Keeps one `Topic` per key and starts or stops its producer as subscribers come and go."""
+
+    def __init__(self):
+        self._topics: Dict[Hashable, Topic] = {}
+
+    def subscriber_count(self, key: Hashable) -> int:
+        topic = self._topics.get(key)
+        return len(topic.subscribers) if topic else 0
+
+    async def subscribe(self, key: Hashable, produce: Callable[[], Produce], interval: float,
+                        snapshot: Optional[Snapshot] = None) -> AsyncIterator[Any]:
+        """Subscribes to a topic.
+
+        Args:
+            key (Hashable): Identifies the topic, subscribers of the same key share a producer
+            produce (Callable): Factory for the produce function, only called if the topic has no producer yet
+            interval (float): Seconds between two calls of the produce function
+            snapshot (Callable): Builds the first message for subscribers joining a running topic from its state
+
+        Yields:
+            The messages published on the topic
+        """
+
+        topic = self._topics.get(key)
+        if topic is None:
+            topic = self._topics[key] = Topic(produce(), interval, snapshot)
+        queue = topic.add_subscriber()
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            topic.remove_subscriber(queue)
+            if not topic.subscribers and self._topics.get(key) is topic:
+                del self._topics[key]
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,212 @@
+"""
+Native client for the Source RCON protocol used by Minecraft servers.
+
+Running a command through `docker exec rcon-cli ...` costs an exec create/start/inspect cycle and a new process
+in the container. Instead, the pool keeps one authenticated TCP connection per server open and reuses it.
+
+A command is only retried if it could not be sent. Once it was sent it may have run, so a failure to read the
+response raises `RconSentError` and the command is neither retried nor run another way.
+Every command is followed by an empty response packet, which the server echoes after the last packet of the
+command response, so responses split over several packets are read completely.
+"""
+
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+PACKET_COMMAND = 2
+PACKET_AUTH = 3
+PACKET_RESPONSE = 0
+AUTH_FAILED_ID = -1
+MAX_PACKET_SIZE = 4110
+
+
+class RconError(Exception):
+    """Raised when an RCON connection fails or the server rejects the password."""
+
+
+class RconAuthError(RconError):
+    """Raised when the server rejects the password. Reconnecting does not help."""
+
+
+class RconSentError(RconError):
+    """Raised when a command was sent but its response could not be read. The command may have run."""
+
+
+class RconClient:
+    """A single authenticated RCON connection. Commands are serialized by a lock."""
+
+    def __init__(self, host: str, port: int, password: str, timeout: float, retry_interval: float = 0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._socket: Optional[socket.socket] = None
+        self._request_id = 0
+        self._unreachable_until = 0.0
+        self._lock = threading.Lock()
+
+    def command(self, command: str) -> str:
+        """Runs a command, reconnecting once if a pooled connection broke before the command was sent.
+
+        After a failed connection attempt, commands fail right away for `retry_interval` seconds
+        instead of waiting for the timeout again.
+
+        Args:
+            command (str): The command to run, ex.: "list"
+
+        Returns:
+            str: The response of the server
+
+        Raises:
+            RconSentError: the command was sent, but the response could not be read
+            RconError: the command could not be sent or the server rejected the password
+        """
+
+        with self._lock:
+            if time.monotonic() < self._unreachable_until:
+                raise RconError("rcon was unreachable recently")
+            for attempt in range(2):
+                reused = self._socket is not None and self._is_alive()
+                if not reused:
+                    self._close()
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    request_id, end_id = self._send_command(command)
+                    break
+                except (OSError, RconError) as e:
+                    self._close()
+                    if isinstance(e, RconAuthError):
+                        raise
+                    if not reused or attempt == 1:
+                        self._unreachable_until = time.monotonic() + self.retry_interval
+                        raise RconError(f"rcon command could not be sent: {e}") from e
+            try:
+                return self._read_response(request_id, end_id)
+            except (OSError, RconError) as e:
+                self._close()
+                raise RconSentError(f"rcon command was sent, but its response could not be read: {e}") from e
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._authenticate()
+
+    def _close(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+    def _is_alive(self) -> bool:
+        """Checks if the server did not close the pooled connection in the meantime."""
+
+        try:
+            self._socket.setblocking(False)
+            try:
+                data = self._socket.recv(1, socket.MSG_PEEK)
+            finally:
+                self._socket.settimeout(self.timeout)
+        except BlockingIOError:  # nothing to read, the connection is open
+            return True
+        except OSError:
+            return False
+        return bool(data)
+
+    def _authenticate(self):
+        request_id = self._next_request_id()
+        self._socket.sendall(pack_packet(request_id, PACKET_AUTH, self.password))
+        while True:
+            response_id, response_type, _ = self._read_packet()
+            if response_id == AUTH_FAILED_ID:
+                raise RconAuthError("wrong rcon password")
+            if response_type == PACKET_COMMAND:  # the auth response, may be preceded by an empty response
+                return
+
+    def _send_command(self, command: str) -> Tuple[int, int]:
+        """Sends a command followed by the end marker, returns the ids of both."""
+
+        request_id = self._next_request_id()
+        end_id = self._next_request_id()
+        self._socket.sendall(pack_packet(request_id, PACKET_COMMAND, command)
+                             + pack_packet(end_id, PACKET_RESPONSE, ""))
+        return request_id, end_id
+
+    def _read_response(self, request_id: int, end_id: int) -> str:
+        parts: List[str] = []
+        while True:
+            response_id, response_type, response_body = self._read_packet()
+            if response_id == end_id:
+                return "".join(parts)
+            if response_id == request_id and response_type == PACKET_RESPONSE:
+                parts.append(response_body)
+
+    def _next_request_id(self) -> int:
+        self._request_id = self._request_id % 0x7fffffff + 1
+        return self._request_id
+
+    def _read_packet(self) -> Tuple[int, int, str]:
+        size, = struct.unpack("<i", self._read_exactly(4))
+        if size < 10 or size > MAX_PACKET_SIZE:
+            raise RconError(f"invalid rcon packet size {size}")
+        data = self._read_exactly(size)
+        response_id, response_type = struct.unpack("<ii", data[:8])
+        return response_id, response_type, data[8:-2].decode("utf-8", errors="replace")
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise RconError("rcon connection closed")
+            data += chunk
+        return data
+
+
+def pack_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+class RconPool:
+    """Keeps one `RconClient` per server."""
+
+    def __init__(self, timeout: float, retry_interval: float):
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._clients: Dict[str, RconClient] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_id: str, host: str, port: int, password: str) -> RconClient:
+        """Returns the client of a server, replacing it if its address or password changed."""
+
+        with self._lock:
+            client = self._clients.get(server_id)
+            if client is None or (client.host, client.port, client.password) != (host, port, password):
+                if client is not None:
+                    client.close()
+                client = RconClient(host, port, password, self.timeout, self.retry_interval)
+                self._clients[server_id] = client
+            return client
+
+    def forget(self, server_id: str):
+        """Closes and drops the connection of a server."""
+
+        with self._lock:
+            client = self._clients.pop(server_id, None)
+        if client is not None:
+            client.close()
+
+
+rcon_pool = RconPool(settings.RCON_TIMEOUT, settings.RCON_RETRY_INTERVAL)
@@ -2,55 +2,200 @@ import base64
 import os
 import re
 import secrets
-from api.helpers import is_port_in_use
+import time
+from api.app_templates import template_registry
+from api.loaders import LazyServerState, get_loaders
+from api.log_index import log_indexer
+from api.metrics import metrics_history
+from api.ports import MAX_PORT, MIN_PORT, PortInUseError, port_allocator
+from api.producers import (all_server_states_producer, all_server_states_snapshot, server_logs_producer,
+                           server_state_producer)
+from api.pubsub import broadcaster
 
 import graphene
-import yaml
+from channels.db import database_sync_to_async
+from django.conf import settings
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from graphene_django import DjangoObjectType
 
-from api.models import Server
+from api.models import ProvisioningJob, Server
+from api.provisioning import provisioning_queue
+
+
+class ServiceUsageType(graphene.ObjectType):
+    """Represents the usage of one container of a server, ex.: of the "main" or the "sftp" service
+
+    Rates are in bytes per second since the previous reading.
+    """
+
+    service = graphene.String()
+    running = graphene.Boolean()
+    cpu_usage = graphene.Float()
+    memory_usage = graphene.Float()
+    network_rx_rate = graphene.Float()
+    network_tx_rate = graphene.Float()
+    block_read_rate = graphene.Float()
+    block_write_rate = graphene.Float()
+    sampled_at = graphene.Float()
 
 
 class ServerStateType(graphene.ObjectType):
-    """Represents the State (running, cpu and memory) in graphql"""
+    """Represents the State (running, cpu, memory and io rates) in graphql
+
+    cpu and memory usage and the network and block io rates (bytes per second) of the main container
+    come from the background stats collector. `services` breaks the usage down per container, ex.: main and sftp.
+    `sampled_at` is the unix timestamp of that reading and `sample_age` its age in seconds.
+    Both are `null` if the server was not sampled yet.
+    For `Server.state` each field is only computed when it is selected, see `api.loaders.LazyServerState`.
+    """
 
     running = graphene.Boolean()
     cpu_usage = graphene.Float()
     memory_usage = graphene.Float()
+    network_rx_rate = graphene.Float()
+    network_tx_rate = graphene.Float()
+    block_read_rate = graphene.Float()
+    block_write_rate = graphene.Float()
+    services = graphene.List(ServiceUsageType)
+    sampled_at = graphene.Float()
+    sample_age = graphene.Float()
+
+
+class LogLevel(graphene.Enum):
+    """Severity of a log line, see `api.logs.LOG_LEVELS`"""
+
+    DEBUG = "DEBUG"
+    INFO = "INFO"
+    WARN = "WARN"
+    ERROR = "ERROR"
 
 
 class LogLineType(graphene.ObjectType):
-    """Represents a line in container logs"""
+    """Represents a line in container logs
+
+    `cursor` identifies the line, pass the greatest `cursor` or `last_cursor` as `after` argument of `logs`
+    to get only the lines that changed since.
+    `source` is the event the line is about as declared by the template (ex.: "join") or "log".
+    `level`, `thread`, `logger` and `player` are `null` if the template does not know the format of the line.
+    Repeats of a line are folded into one entry if the template enables it, `repeat_count` counts them,
+    `last_timestamp` and `last_cursor` belong to the newest one. The entry keeps its place and `cursor`,
+    so an entry returned again with a cursor the client has replaces the one it has.
+    """
 
+    cursor = graphene.String()
     timestamp = graphene.Int()
     content = graphene.String()
     source = graphene.String()
+    level = graphene.Field(LogLevel)
+    thread = graphene.String()
+    logger = graphene.String()
+    player = graphene.String()
+    repeat_count = graphene.Int()
+    last_timestamp = graphene.Int()
+    last_cursor = graphene.String()
+
+
+class ServerStateUpdateType(graphene.ObjectType):
+    """Represents a changed state of a server in the allServerStates subscription"""
+
+    server_id = graphene.ID()
+    state = graphene.Field(ServerStateType)
+
+
+class MetricPointType(graphene.ObjectType):
+    """Represents the usage of a server in one bucket of the usage history
+
+    `timestamp` is the unix timestamp of the start of the bucket.
+    """
+
+    timestamp = graphene.Int()
+    cpu_min = graphene.Float()
+    cpu_avg = graphene.Float()
+    cpu_max = graphene.Float()
+    memory_min = graphene.Float()
+    memory_avg = graphene.Float()
+    memory_max = graphene.Float()
+
+
+class PublishedPortType(graphene.ObjectType):
+    """Represents a port of a servers container that is published on its docker host"""
+
+    service = graphene.String()
+    private_port = graphene.Int()
+    public_port = graphene.Int()
+    protocol = graphene.String()
 
 
 class ServerType(DjangoObjectType):
+    """Represents a server in graphql
+
+    `state`, `status` and `published_ports` of all servers in a request come from one container listing per host.
+    `status` is the docker status of the main container (ex.: "running") or `null` if it does not exist.
+    """
+
     state = graphene.Field(ServerStateType)
-    logs = graphene.List(LogLineType)
+    status = graphene.String()
+    published_ports = graphene.List(PublishedPortType)
+    logs = graphene.List(LogLineType, after=graphene.String(), limit=graphene.Int(), level=LogLevel())
+
+    def resolve_allowed_users(self, info):
+        return get_loaders(info).allowed_users.load(self)
+
+    def resolve_state(self, info):
+        return LazyServerState(self, get_loaders(info))
+
+    def resolve_status(self, info):
+        return get_loaders(info).container_status.load(self)
 
-    def resolve_state(self, _info):
-        server = Server.objects.get(pk=self.server_id)
-        cpu_usage, memory_usage = server.stats
-        return {
-            "running": server.running,
-            "cpu_usage": cpu_usage,
-            "memory_usage": memory_usage
-        }
+    def resolve_published_ports(self, info):
+        return get_loaders(info).container_snapshot.load(self).then(
+            lambda snapshot: snapshot.ports if snapshot else [])
 
-    def resolve_logs(self, _info):
-        server = Server.objects.get(pk=self.server_id)
-        return server.get_logs(50)
+    def resolve_logs(self, info, after=None, limit=50, level=None):
+        return get_loaders(info).logs.load((self, after, limit, level))
 
     class Meta:
         model = Server
         fields = ("server_id", "description", "name", "command_prefix", "allowed_users", "port", "sftp_port", "sftp_password", "host")
 
 
+class ProvisioningPhaseType(graphene.ObjectType):
+    """Represents a phase of a provisioning job (render, pull, up or healthy)
+
+    Timestamps are unix timestamps. `duration` is the time the phase took or has been running so far in seconds.
+    """
+
+    name = graphene.String()
+    started_at = graphene.Float()
+    finished_at = graphene.Float()
+    duration = graphene.Float()
+
+
+class ProvisioningJobType(DjangoObjectType):
+    """Represents the background creation of a server in graphql"""
+
+    phases = graphene.List(ProvisioningPhaseType)
+
+    def resolve_phases(self, _info):
+        phases = []
+        for name in ProvisioningJob.PHASES:
+            timing = self.phase_timings.get(name)
+            if timing is None:
+                continue
+            finished_at = timing["finished_at"]
+            duration = (finished_at or time.time()) - timing["started_at"]
+            phases.append({"name": name, "started_at": timing["started_at"], "finished_at": finished_at,
+                           "duration": duration})
+        return phases
+
+    class Meta:
+        model = ProvisioningJob
+        fields = ("job_id", "server", "status", "phase", "error", "created_at", "finished_at")
+
+
 class TemplateOptions(graphene.ObjectType):
     """Represents the template specific options. Ex.: server version, game mode
 
@@ -144,14 +289,18 @@ class TemplateOptionsInput(graphene.InputObjectType):
 class CreateServerMutation(graphene.Mutation):
     """Creates a new server.
 
+    The server is saved right away, its containers are created by a background job.
+    Use the returned job with the `provisioningJob` query to follow the progress.
+
     Args:
         name (str): Technical name of the container. This may only consist of lowercase letters, numbers and underscores
         description (str): Human readable version of the container name.
         template (str): Name of the template to use when creating this server.
         options (list): List of special options for the template. Ex.: Server version
-        port (int): The port on which the game server listens (on host network)
-        sftp_port (int): The port for the SFTP server (on host network)
+        port (int): The port on which the game server listens (on host network). Allocated if not given.
+        sftp_port (int): The port for the SFTP server (on host network). Allocated if not given.
         allowed_users (list): List of user ids allowed to manage the server
+        reservation (str): Token returned by `allocatePorts`. The ports of this reservation may be used.
 
     """
 
@@ -163,30 +312,26 @@ class CreateServerMutation(graphene.Mutation):
         sftp_port = graphene.Int()
         allowed_users = graphene.List(graphene.ID)
         options = graphene.List(TemplateOptionsInput)
+        reservation = graphene.String()
 
     server = graphene.Field(ServerType)
+    job = graphene.Field(ProvisioningJobType)
 
     @classmethod
-    def mutate(cls, _root, _info, name: str, description: str, template: str, port: int, sftp_port: int,
-               allowed_users: list, options: list):
+    def mutate(cls, _root, _info, name: str, description: str, template: str, allowed_users: list, options: list,
+               port: int = None, sftp_port: int = None, reservation: str = None):
         if not isinstance(options, list):
             raise ValueError("options must be a list")
 
-        if port > 60000 or port < 1000:
-            raise ValueError("port number must be between 1000 and 60000")
+        if port is not None and (port > MAX_PORT or port < MIN_PORT):
+            raise ValueError(f"port number must be between {MIN_PORT} and {MAX_PORT}")
 
-        if sftp_port > 60000 or sftp_port < 1000:
-            raise ValueError("port number must be between 1000 and 60000")
+        if sftp_port is not None and (sftp_port > MAX_PORT or sftp_port < MIN_PORT):
+            raise ValueError(f"port number must be between {MIN_PORT} and {MAX_PORT}")
 
         if not re.match("^[a-z0-9_]+$", name):
             raise ValueError("server name may only contain lowercase letters, numbers and underscores")
 
-        if is_port_in_use(port):
-            raise ValueError("server port is already in use")
-
-        if is_port_in_use(sftp_port):
-            raise ValueError("sftp port is already in use")
-
         options_dict = {}
         for option in options:
             options_dict[str(option.key)] = str(option.value)
@@ -195,31 +340,82 @@ class CreateServerMutation(graphene.Mutation):
         for user in allowed_users:
             allowed_users_formatted.append(User.objects.get(pk=user))
 
-        with open(f"app_templates.v2/{template}.yml", 'r') as open_file:
-            parsed = yaml.safe_load(open_file.read())
-            command_prefix = parsed.get("command_prefix")
-
-        server = Server()
-        server.name = name
-        server.description = description
-        server.template = template
-        server.port = port
-        server.sftp_port = sftp_port
-        server.sftp_password = base64.b64encode(secrets.token_hex(6).encode()).decode("utf-8")
-        server.max_memory_usage = 4000
-        server.max_cpu_usage = 2
-        server.command_prefix = command_prefix
-        server.save()
+        command_prefix = template_registry.get(template).command_prefix
+
+        # the ports stay reserved until the server is saved, so concurrent creates can not pick them as well.
+        # Given and missing ports are checked against one bitmap of the used ports.
+        requested = [p for p in (port, sftp_port) if p is not None]
+        try:
+            held = port_allocator.reserve(requested, token=reservation, allocate=2 - len(requested))
+        except PortInUseError as e:
+            raise ValueError(f"{'server' if e.port == port else 'sftp'} port is already in use")
+        try:
+            free_ports = iter(held.ports[len(requested):])
+            port = port if port is not None else next(free_ports)
+            sftp_port = sftp_port if sftp_port is not None else next(free_ports)
+
+            server = Server()
+            server.name = name
+            server.description = description
+            server.template = template
+            server.port = port
+            server.sftp_port = sftp_port
+            server.sftp_password = base64.b64encode(secrets.token_hex(6).encode()).decode("utf-8")
+            server.rcon_password = secrets.token_hex(16)
+            server.max_memory_usage = 4000
+            server.max_cpu_usage = 2
+            server.command_prefix = command_prefix
+            if os.path.exists(server.app_path):
+                raise FileExistsError("path is not empty")
+            try:
+                with transaction.atomic():
+                    server.save()
+            except IntegrityError:  # another create saved the name or one of the ports first
+                if Server.objects.filter(name=name).exists():
+                    raise ValueError("server name is already in use")
+                in_use = Server.objects.filter(Q(port=port) | Q(sftp_port=port)).exists()
+                raise ValueError(f"{'server' if in_use else 'sftp'} port is already in use")
+        finally:
+            port_allocator.release(held.token)
+
         server.allowed_users.set(allowed_users_formatted)
         server.save()
-        server.create(options_dict)
+        job = provisioning_queue.submit(server, options_dict)
+
+        return CreateServerMutation(server=server, job=job)
+
+
+class AllocatePortsMutation(graphene.Mutation):
+    """Reserves free host ports for a server that is about to be created.
+
+    The ports stay reserved for `PORT_RESERVATION_TTL` seconds.
+    Pass the returned reservation token to `createServer` together with the ports to use them.
 
-        return ServerStateMutation(server=server)
+    Args:
+        count (int): Number of ports to allocate, defaults to 2 (game server and SFTP)
+    """
+
+    class Arguments:
+        count = graphene.Int()
+
+    reservation = graphene.String()
+    ports = graphene.List(graphene.Int)
+    expires_at = graphene.Float()
+
+    @classmethod
+    def mutate(cls, _root, _info, count: int = 2):
+        if count < 1 or count > 10:
+            raise ValueError("count must be between 1 and 10")
+
+        reservation = port_allocator.allocate(count)
+        return AllocatePortsMutation(reservation=reservation.token, ports=reservation.ports,
+                                     expires_at=reservation.expires_at)
 
 
 class Mutation(graphene.ObjectType):
     server_state = ServerStateMutation.Field()
     create_server = CreateServerMutation.Field()
+    allocate_ports = AllocatePortsMutation.Field()
     exec_command = ExecCommandMutation.Field()
 
 
@@ -229,15 +425,16 @@ class Query(graphene.ObjectType):
     all_templates = graphene.List(TemplateType)
     template = graphene.Field(TemplateType, template_name=graphene.String())
     all_users = graphene.List(UserType)
+    provisioning_job = graphene.Field(ProvisioningJobType, job_id=graphene.String())
+    server_metrics = graphene.List(MetricPointType, server_id=graphene.String(required=True),
+                                   from_=graphene.Float(name="from"), to=graphene.Float(), step=graphene.Int())
+    search_logs = graphene.List(LogLineType, server_id=graphene.String(required=True),
+                                query=graphene.String(required=True), from_=graphene.Float(name="from"),
+                                to=graphene.Float(), limit=graphene.Int())
 
     def resolve_all_servers(self, info):
         """Returns a list of all servers that the requesting user can see"""
-        user = info.context.user
-        filtered_servers = []
-        for server in Server.objects.all():
-            if server.is_user_allowed_to_manage(user):
-                filtered_servers.append(server)
-        return filtered_servers
+        return Server.objects.manageable_by(info.context.user)
 
     def resolve_server(self, info, server_id):
         """Returns the requested fields of the server selected by `server_id`
@@ -245,46 +442,131 @@ class Query(graphene.ObjectType):
         Returns:
             Server: The server matching the query
         """
-        user = info.context.user
-
-        result: Server = Server.objects.get(pk=server_id)
-        if result.is_user_allowed_to_manage(user):
-            return result
-        else:
+        try:
+            return Server.objects.manageable_by(info.context.user).get(pk=server_id)
+        except Server.DoesNotExist:
             raise Exception("you are not allowed to manage this server")
 
     def resolve_all_templates(self, _info):
         """Returns a list of all available app templates"""
 
-        for file in os.scandir("app_templates.v2"):
-            with open(file.path, 'r') as open_file:
-                parsed = yaml.safe_load(open_file.read())
-                name = file.name[:-4]
-                title = parsed["name"]
-                description = parsed["description"]
-                yield {"name": name, "title": title, "description": description}
+        for template in template_registry.all():
+            yield {"name": template.name, "title": template.title, "description": template.description}
 
     def resolve_template(self, _info, template_name):
         """Returns details for the specified template name"""
 
-        with open(f"app_templates.v2/{template_name}.yml", 'r') as open_file:
-            parsed = yaml.safe_load(open_file.read())
-            name = template_name
-            title = parsed["name"]
-            description = parsed["description"]
-            options = parsed["options"]
-            options = [] if not options else options
-            options_formatted = []
-            for option in options:
-                option_formatted = TemplateOptions()
-                option_formatted.key = option["key"]
-                option_formatted.value = option["value"]
-                option_formatted.description = option["description"]
-                options_formatted.append(option_formatted)
-            return {"name": name, "title": title, "description": description, "options": options_formatted}
+        template = template_registry.get(template_name)
+        options_formatted = []
+        for option in template.options:
+            option_formatted = TemplateOptions()
+            option_formatted.key = option["key"]
+            option_formatted.value = option["value"]
+            option_formatted.description = option["description"]
+            options_formatted.append(option_formatted)
+        return {"name": template.name, "title": template.title, "description": template.description,
+                "options": options_formatted}
 
     def resolve_all_users(self, _info):
         return User.objects.all()
 
+    def resolve_provisioning_job(self, info, job_id):
+        """Returns the progress of a server creation"""
+
+        manageable = Server.objects.manageable_by(info.context.user)
+        try:
+            return ProvisioningJob.objects.get(pk=job_id, server__in=manageable)
+        except ProvisioningJob.DoesNotExist:
+            raise Exception("you are not allowed to manage this server")
+
+    def resolve_server_metrics(self, info, server_id, from_=None, to=None, step=60):
+        """Returns the usage history of a server
+
+        Args:
+            from_ (float): unix timestamp of the first bucket, defaults to one hour ago
+            to (float): unix timestamp of the last bucket, defaults to now
+            step (int): seconds per bucket, rounded up to the closest stored resolution
+        """
+
+        if not Server.objects.manageable_by(info.context.user).filter(pk=server_id).exists():
+            raise Exception("you are not allowed to manage this server")
+        to = to if to is not None else time.time()
+        from_ = from_ if from_ is not None else to - 3600
+        if step < 1 or from_ > to:
+            raise Exception("invalid time range")
+        return metrics_history.query(server_id, from_, to, step)
+
+    def resolve_search_logs(self, info, server_id, query, from_=None, to=None, limit=100):
+        """Returns the log lines of a server containing all words of `query`, newest first
+
+        Args:
+            from_ (float): unix timestamp, only lines written after it are returned
+            to (float): unix timestamp, only lines written before it are returned
+        """
+
+        if not Server.objects.manageable_by(info.context.user).filter(pk=server_id).exists():
+            raise Exception("you are not allowed to manage this server")
+        start_ns = int(from_ * 1_000_000_000) if from_ is not None else 0
+        end_ns = int(to * 1_000_000_000) if to is not None else int(time.time() * 1_000_000_000)
+        return log_indexer.get(server_id).search(query, start_ns, end_ns, min(limit, 1000))
+
+
+def get_context_user(context) -> User:
+    """Returns the user of the graphql context, which is a http request or a websocket scope."""
+
+    if isinstance(context, dict):
+        return context.get("user") or AnonymousUser()
+    return context.user
+
+
+@database_sync_to_async
+def get_manageable_server(user: User, server_id: str) -> Server:
+    """Returns the server if the user can manage it."""
+
+    try:
+        return Server.objects.manageable_by(user).get(pk=server_id)
+    except Server.DoesNotExist:
+        raise Exception("you are not allowed to manage this server")
+
+
+@database_sync_to_async
+def get_manageable_server_ids(user: User) -> set:
+    return set(Server.objects.manageable_by(user).values_list("server_id", flat=True))
+
+
+class Subscription(graphene.ObjectType):
+    """Pushes server updates over websockets.
+
+    Every subscription topic has a single producer that polls docker, no matter how many clients subscribed.
+    Only changes are pushed.
+    """
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+    server_state = graphene.Field(ServerStateType, server_id=graphene.String(required=True))
+    server_logs = graphene.List(LogLineType, server_id=graphene.String(required=True))
+    all_server_states = graphene.List(ServerStateUpdateType)
+
+    async def resolve_server_state(self, info, server_id):
+        server = await get_manageable_server(get_context_user(info.context), server_id)
+        async for state in broadcaster.subscribe(("server_state", server_id), lambda: server_state_producer(server),
+                                                 settings.SUBSCRIPTION_POLL_INTERVAL, snapshot=lambda state: state):
+            yield state
+
+    async def resolve_server_logs(self, info, server_id):
+        server = await get_manageable_server(get_context_user(info.context), server_id)
+        async for lines in broadcaster.subscribe(("server_logs", server_id), lambda: server_logs_producer(server),
+                                                 settings.SUBSCRIPTION_POLL_INTERVAL):
+            yield lines
+
+    async def resolve_all_server_states(self, info):
+        user = get_context_user(info.context)
+        server_ids = await get_manageable_server_ids(user)
+        async for updates in broadcaster.subscribe("all_server_states", all_server_states_producer,
+                                                   settings.SUBSCRIPTION_POLL_INTERVAL,
+                                                   snapshot=all_server_states_snapshot):
+            # servers created after subscribing are picked up with a new subscription
+            updates = [update for update in updates if update["server_id"] in server_ids]
+            if updates:
+                yield updates
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
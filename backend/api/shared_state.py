@@ -0,0 +1,260 @@
+"""
+Stats readings shared between processes through a memory mapped file.
+
+gunicorn runs several worker processes and each one would run its own stats collector. Instead, a single
+collector process (`manage.py run_collector`) writes one fixed-size record per server into the file at
+`SHARED_STATE_PATH`, and every worker maps the file and reads the records without taking a lock.
+
+Each record starts with a sequence number (a seqlock): the writer makes it odd before changing the record and even
+again afterwards. A reader copies the record and retries if the number was odd or changed during the copy.
+
+Workers keep their mapping while the collector restarts, so a file is never truncated or shrunk in place: a restarted
+collector keeps using a file with enough slots and its records, and otherwise replaces it with a new file.
+Readers notice the replaced file by its inode and map the new one.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from api.collector import StatsReading, reading_key
+
+MAGIC = b"CPSTATE2"
+HEADER = struct.Struct("<8sI4x")
+SEQUENCE = struct.Struct("<Q")
+# sequence, reading key (see `api.collector.reading_key`), running, cpu usage, memory usage, sampled at, cpu seconds,
+# restart count, network rx, network tx, block read, block write and the four rates of these counters
+RECORD = struct.Struct("<Q32sB7xddddqdddddddd")
+MAX_READ_ATTEMPTS = 100
+INDEX_REFRESH_INTERVAL = 1.0
+
+
+def record_offset(slot: int) -> int:
+    return HEADER.size + slot * RECORD.size
+
+
+def file_size(slots: int) -> int:
+    return HEADER.size + slots * RECORD.size
+
+
+def read_record_key(mapped: mmap.mmap, slot: int) -> str:
+    """Returns the reading key of a record, empty for a free slot."""
+
+    return RECORD.unpack_from(mapped, record_offset(slot))[1].rstrip(b"\x00").decode(errors="replace")
+
+
+class SharedStateWriter:
+    """Writes the readings of the collector process into the shared file."""
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mmap, self.slots = self._reuse_file(path, slots) or self._create_file(path, slots)
+        # readings of the previous collector stay visible until they are replaced or removed
+        self._slot_by_server: Dict[str, int] = {}
+        for slot in range(self.slots):
+            server_id = read_record_key(self._mmap, slot)
+            if server_id:
+                self._slot_by_server[server_id] = slot
+
+    @staticmethod
+    def _reuse_file(path: str, slots: int) -> Optional[Tuple[mmap.mmap, int]]:
+        """Maps an existing file of the current format with at least `slots` slots, keeping its size."""
+
+        try:
+            with open(path, "r+b") as file:
+                mapped = mmap.mmap(file.fileno(), 0)
+        except (FileNotFoundError, ValueError):  # missing or empty
+            return None
+        magic, existing_slots = HEADER.unpack_from(mapped, 0) if len(mapped) >= HEADER.size else (b"", 0)
+        if magic != MAGIC or existing_slots < slots or len(mapped) < file_size(existing_slots):
+            mapped.close()
+            return None
+        return mapped, existing_slots
+
+    @staticmethod
+    def _create_file(path: str, slots: int) -> Tuple[mmap.mmap, int]:
+        """Creates a new file and moves it over the old one, which readers can keep mapped."""
+
+        size = file_size(slots)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            mapped = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(mapped, 0, MAGIC, slots)
+        os.replace(temporary, path)
+        return mapped, slots
+
+    def write(self, server_id: str, reading: StatsReading):
+        """Stores the reading of a server, taking a free slot for servers without one.
+
+        Args:
+            server_id (str): the reading key, see `api.collector.reading_key`
+            reading (StatsReading): the reading
+
+        Raises:
+            OverflowError: all slots are taken, raise `SHARED_STATE_SLOTS`
+            ValueError: the key does not fit into a record
+        """
+
+        if len(server_id.encode()) > 32:
+            raise ValueError(f"reading key {server_id!r} is longer than 32 bytes")
+
+        with self._lock:
+            slot = self._slot_by_server.get(server_id)
+            if slot is None:
+                used = set(self._slot_by_server.values())
+                slot = next((slot for slot in range(self.slots) if slot not in used), None)
+                if slot is None:
+                    raise OverflowError("no free slot in the shared state file")
+                self._slot_by_server[server_id] = slot
+            self._write_record(slot, server_id.encode(), reading)
+
+    def keys(self) -> List[str]:
+        """Returns the keys of all records, including the ones adopted from the previous collector."""
+
+        with self._lock:
+            return list(self._slot_by_server)
+
+    def remove(self, server_id: str):
+        """Frees the slot of a server."""
+
+        with self._lock:
+            slot = self._slot_by_server.pop(server_id, None)
+            if slot is not None:
+                self._write_record(slot, b"", StatsReading(0, 0, 0))
+
+    def close(self):
+        self._mmap.close()
+
+    def _write_record(self, slot: int, server_id: bytes, reading: StatsReading):
+        offset = record_offset(slot)
+        sequence, = SEQUENCE.unpack_from(self._mmap, offset)
+        SEQUENCE.pack_into(self._mmap, offset, sequence + 1)
+        RECORD.pack_into(self._mmap, offset, sequence + 1, server_id, reading.running, reading.cpu_usage,
+                         reading.memory_usage, reading.sampled_at, reading.cpu_seconds, reading.restart_count,
+                         reading.network_rx_bytes, reading.network_tx_bytes, reading.block_read_bytes,
+                         reading.block_write_bytes, reading.network_rx_rate, reading.network_tx_rate,
+                         reading.block_read_rate, reading.block_write_rate)
+        SEQUENCE.pack_into(self._mmap, offset, sequence + 2)
+
+
+class SharedStateReader:
+    """Reads the readings written by the collector process.
+
+    It stands in for the `StatsCollector` of a worker process, see `api.collector.get_collector`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap: Optional[mmap.mmap] = None
+        self._inode: Optional[int] = None
+        self._slots = 0
+        self._slot_by_server: Dict[str, int] = {}
+        self._index_refreshed_at = 0.0
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self, server_id: str, service: str = "main") -> Optional[StatsReading]:
+        """Returns the latest reading of a server or `None` if the collector did not write one (yet)."""
+
+        server_id = reading_key(server_id, service)
+        mapped = self._open()
+        if mapped is None:
+            return None
+        slot = self._slot_by_server.get(server_id)
+        if slot is not None:
+            record = self._read_record(mapped, slot)
+            if record and record[0] == server_id:
+                return record[1]
+        if time.monotonic() - self._index_refreshed_at < INDEX_REFRESH_INTERVAL:
+            return None
+        self._refresh_index(mapped)
+        slot = self._slot_by_server.get(server_id)
+        record = self._read_record(mapped, slot) if slot is not None else None
+        return record[1] if record and record[0] == server_id else None
+
+    def readings(self) -> Dict[str, StatsReading]:
+        """Returns the readings of all servers."""
+
+        mapped = self._open()
+        if mapped is None:
+            return {}
+        records = (self._read_record(mapped, slot) for slot in range(self._slots))
+        return {server_id: reading for server_id, reading in filter(None, records) if server_id}
+
+    def snapshot(self) -> List[Tuple[Any, Optional[StatsReading]]]:
+        """Returns all servers with their latest readings, like `StatsCollector.snapshot`.
+
+        Unlike the collector, the reader does not know the servers and has to query them.
+        """
+
+        from api.models import Server
+
+        readings = self.readings()
+        return [(server, readings.get(server.server_id)) for server in Server.objects.all()]
+
+    def forget(self, server_id: str):
+        """Does nothing, the collector process drops deleted servers itself."""
+
+    def _open(self) -> Optional[mmap.mmap]:
+        """Returns the mapping of the current file, mapping it again at most every second if it was replaced.
+
+        Mappings of replaced files are left to the garbage collector, other threads may still read them.
+        """
+
+        if time.monotonic() - self._checked_at < INDEX_REFRESH_INTERVAL:
+            return self._mmap
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                with open(self.path, "rb") as file:
+                    inode = os.fstat(file.fileno()).st_ino
+                    if inode == self._inode:
+                        return self._mmap
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):  # the collector did not create the file yet
+                return self._mmap
+            magic, slots = HEADER.unpack_from(mapped, 0) if len(mapped) >= HEADER.size else (b"", 0)
+            if magic != MAGIC or len(mapped) < file_size(slots):
+                mapped.close()
+                return self._mmap
+            self._slots = slots
+            self._slot_by_server = {}
+            self._index_refreshed_at = 0.0
+            self._inode = inode
+            self._mmap = mapped
+        return mapped
+
+    def _refresh_index(self, mapped: mmap.mmap):
+        index = {}
+        for slot in range(self._slots):
+            record = self._read_record(mapped, slot)
+            if record and record[0]:
+                index[record[0]] = slot
+        self._slot_by_server = index
+        self._index_refreshed_at = time.monotonic()
+
+    @staticmethod
+    def _read_record(mapped: mmap.mmap, slot: int) -> Optional[Tuple[str, StatsReading]]:
+        offset = record_offset(slot)
+        if offset + RECORD.size > len(mapped):  # the index belongs to a replaced file
+            return None
+        for _ in range(MAX_READ_ATTEMPTS):
+            sequence_before, = SEQUENCE.unpack_from(mapped, offset)
+            if sequence_before % 2:
+                continue
+            data = mapped[offset:offset + RECORD.size]
+            sequence_after, = SEQUENCE.unpack_from(mapped, offset)
+            if sequence_before != sequence_after:
+                continue
+            _, server_id, running, *values = RECORD.unpack(data)
+            reading = StatsReading(*values[:3], bool(running), *values[3:])
+            return server_id.rstrip(b"\x00").decode(), reading
+        return None
@@ -0,0 +1,212 @@
+"""
+Backends that read the resource usage of a servers main container.
+
+`DockerApiBackend` asks the docker daemon, which samples the container twice and takes about a second per call.
+`CgroupBackend` reads the cgroup v2 files of the container (`cpu.stat`, `memory.current`, `io.stat`) directly,
+which only works if the hosts cgroup hierarchy is mounted at `CGROUP_ROOT`. It computes the cpu usage from the
+difference to its previous reading of the same container, so the first reading of a container reports 0.
+Its network counters come from `/proc/<pid>/net/dev`, so the pids in `cgroup.procs` must be visible at `PROC_ROOT`,
+ex.: by sharing the pid namespace of the host.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from api.collector import StatsReading, parse_container_stats
+
+# directories docker puts container cgroups in, for the systemd and the cgroupfs cgroup driver
+CGROUP_PATHS = ("system.slice/docker-{id}.scope", "docker/{id}")
+
+
+class RestartCounts:
+    """Caches the `RestartCount` of containers, which containers from the `api.events` index do not carry.
+
+    Reading it takes an inspect, so it is read again at most every `max_age` seconds per container.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        # container id -> (restart count, monotonic time it was read)
+        self._counts: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, container) -> int:
+        if "RestartCount" in container.attrs:
+            return container.attrs["RestartCount"]
+
+        with self._lock:
+            cached = self._counts.get(container.id)
+        if cached and time.monotonic() - cached[1] < self.max_age:
+            return cached[0]
+
+        container.reload()
+        count = container.attrs.get("RestartCount", 0)
+        with self._lock:
+            self._counts[container.id] = (count, time.monotonic())
+        return count
+
+    def forget(self, container_id: str):
+        with self._lock:
+            self._counts.pop(container_id, None)
+
+
+class DockerApiBackend:
+    """Reads the usage with the docker stats api."""
+
+    name = "docker"
+
+    def read(self, container) -> StatsReading:
+        stats = container.stats(stream=False)
+        return parse_container_stats(stats, restart_counts.get(container))
+
+
+class CgroupBackend:
+    """Reads the usage from the cgroup v2 files of the container."""
+
+    name = "cgroup"
+
+    def __init__(self, cgroup_root: str, proc_root: str):
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        # container id -> (cpu seconds, monotonic time) of the previous reading
+        self._previous: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def cgroup_path(self, container_id: str) -> Optional[str]:
+        """Returns the cgroup directory of a container or `None` if it is not reachable."""
+
+        for pattern in CGROUP_PATHS:
+            path = os.path.join(self.cgroup_root, pattern.format(id=container_id))
+            if os.path.isfile(os.path.join(path, "cpu.stat")):
+                return path
+        return None
+
+    def read(self, container) -> StatsReading:
+        """Reads the usage of a container.
+
+        Raises:
+            FileNotFoundError: the cgroup or the network counters of the container are not reachable
+        """
+
+        path = self.cgroup_path(container.id)
+        if path is None:
+            raise FileNotFoundError(f"no cgroup found for container {container.id}")
+
+        cpu_seconds = read_key_values(os.path.join(path, "cpu.stat"))["usage_usec"] / 1e6
+        now = time.monotonic()
+        with self._lock:
+            previous = self._previous.get(container.id)
+            self._previous[container.id] = (cpu_seconds, now)
+        cpu_usage = 0.0
+        if previous and now > previous[1]:
+            cpu_usage = max(0.0, cpu_seconds - previous[0]) / (now - previous[1])
+
+        with open(os.path.join(path, "memory.current")) as file:
+            memory_usage = int(file.read())
+        block_read, block_write = read_io_stat(os.path.join(path, "io.stat"))
+        network_rx, network_tx = self._read_network(path)
+
+        return StatsReading(
+            cpu_usage=cpu_usage,
+            memory_usage=memory_usage,
+            sampled_at=time.time(),
+            running=True,
+            cpu_seconds=cpu_seconds,
+            restart_count=restart_counts.get(container),
+            network_rx_bytes=network_rx,
+            network_tx_bytes=network_tx,
+            block_read_bytes=block_read,
+            block_write_bytes=block_write,
+        )
+
+    def forget(self, container_id: str):
+        with self._lock:
+            self._previous.pop(container_id, None)
+
+    def _read_network(self, path: str) -> Tuple[float, float]:
+        """Reads the network counters of the container from `/proc/<pid>/net/dev`.
+
+        Raises:
+            FileNotFoundError: the pid is not visible, ex.: the pid namespace of the host is not shared
+        """
+
+        with open(os.path.join(path, "cgroup.procs")) as file:
+            pid = file.readline().strip()
+        # pids outside of our pid namespace are listed as 0
+        if pid in ("", "0"):
+            raise FileNotFoundError(f"the processes of {path} are not visible")
+        with open(os.path.join(self.proc_root, pid, "net", "dev")) as file:
+            lines = file.readlines()[2:]
+
+        received = sent = 0.0
+        for line in lines:
+            interface, counters = line.split(":", 1)
+            if interface.strip() == "lo":
+                continue
+            fields = counters.split()
+            received += int(fields[0])
+            sent += int(fields[8])
+        return received, sent
+
+
+class AutoBackend:
+    """Uses the cgroup backend for containers whose cgroup is reachable and the docker api for the rest."""
+
+    name = "auto"
+
+    def __init__(self, cgroup: CgroupBackend, docker: DockerApiBackend):
+        self.cgroup = cgroup
+        self.docker = docker
+
+    def read(self, container) -> StatsReading:
+        if self.cgroup.cgroup_path(container.id) is not None:
+            try:
+                return self.cgroup.read(container)
+            # the container stopped while reading, a partial file or network counters that are not visible
+            except (OSError, KeyError, ValueError):
+                pass
+        return self.docker.read(container)
+
+
+def read_key_values(path: str) -> Dict[str, int]:
+    """Reads a flat keyed cgroup file like `cpu.stat`."""
+
+    with open(path) as file:
+        return {key: int(value) for key, value in (line.split() for line in file if line.strip())}
+
+
+def read_io_stat(path: str) -> Tuple[int, int]:
+    """Sums up the bytes read and written over all devices of an `io.stat` file."""
+
+    read_bytes = written_bytes = 0
+    try:
+        with open(path) as file:
+            for line in file:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        read_bytes += int(value)
+                    elif key == "wbytes":
+                        written_bytes += int(value)
+    except FileNotFoundError:  # the io controller is not enabled for the container
+        pass
+    return read_bytes, written_bytes
+
+
+def create_stats_backend(name: str):
+    """Creates the backend configured by `STATS_BACKEND`: "auto", "cgroup" or "docker"."""
+
+    cgroup = CgroupBackend(settings.CGROUP_ROOT, settings.PROC_ROOT)
+    docker = DockerApiBackend()
+    backends = {"auto": AutoBackend(cgroup, docker), "cgroup": cgroup, "docker": docker}
+    if name not in backends:
+        raise ValueError(f"unknown stats backend {name!r}, use one of {', '.join(backends)}")
+    return backends[name]
+
+
+restart_counts = RestartCounts(settings.RESTART_COUNT_MAX_AGE)
+stats_backend = create_stats_backend(settings.STATS_BACKEND)
@@ -0,0 +1,110 @@
+"""
+Long-lived docker stats streams, one per running main container.
+
+`container.stats(stream=False)` makes the daemon sample the container twice, about a second apart, before it
+answers. A stream delivers a sample every second instead, each carrying the previous one in `precpu_stats`,
+so readings are updated as they arrive and reading them at query time costs nothing.
+Streams end when their container stops or `sync` is called without their server.
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Iterable
+
+from api.collector import StatsReading, parse_container_stats
+
+logger = logging.getLogger(__name__)
+
+# a stream of a stopped container keeps sending samples with this read time
+ZERO_TIME_PREFIX = "0001-01-01"
+
+
+class StatsStream:
+    """Reads the stats stream of one container on a daemon thread."""
+
+    def __init__(self, server, on_sample: Callable[[str, StatsReading], None], on_exit: Callable[["StatsStream"], None]):
+        self.server = server
+        self.on_sample = on_sample
+        self.on_exit = on_exit
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"stats-stream-{server.server_id}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Stops the stream when its next sample arrives."""
+
+        self.stop_event.set()
+
+    @property
+    def alive(self) -> bool:
+        return self.thread.is_alive() and not self.stop_event.is_set()
+
+    def _run(self):
+        try:
+            server = self.server
+            server.load_container()
+            if not server.container_available:
+                return
+            # containers from the `api.events` index only carry their state, and a stream only lives as long as
+            # its container runs, so one inspect per stream keeps the restart count exact
+            if "RestartCount" not in server.container.attrs:
+                server.container.reload()
+            restart_count = server.container.attrs.get("RestartCount", 0)
+            for stats in server.container.stats(stream=True, decode=True):
+                if self.stop_event.is_set() or stats.get("read", "").startswith(ZERO_TIME_PREFIX):
+                    break
+                if not stats["precpu_stats"].get("system_cpu_usage"):  # the first sample has nothing to compare to
+                    continue
+                self.on_sample(server.server_id, parse_container_stats(stats, restart_count))
+        except Exception as e:
+            logger.warning("stats stream of %s failed: %s", self.server.name, e)
+        finally:
+            self.on_exit(self)
+
+
+class StatsStreamPool:
+    """Keeps one `StatsStream` per running server."""
+
+    def __init__(self, on_sample: Callable[[str, StatsReading], None]):
+        self.on_sample = on_sample
+        self._streams: Dict[str, StatsStream] = {}
+        self._lock = threading.Lock()
+
+    def sync(self, running_servers: Iterable):
+        """Starts streams for running servers that have none and stops the streams of all other servers.
+
+        Args:
+            running_servers (iterable): The servers whose main container is running
+        """
+
+        running = {server.server_id: server for server in running_servers}
+        with self._lock:
+            for server_id, stream in list(self._streams.items()):
+                if server_id not in running or not stream.alive:
+                    stream.stop()
+                    del self._streams[server_id]
+            started = []
+            for server_id, server in running.items():
+                if server_id not in self._streams:
+                    stream = self._streams[server_id] = StatsStream(server, self.on_sample, self._remove)
+                    started.append(stream)
+        for stream in started:
+            stream.start()
+
+    def streaming(self) -> set:
+        """Returns the ids of the servers that currently have a stream."""
+
+        with self._lock:
+            return {server_id for server_id, stream in self._streams.items() if stream.alive}
+
+    def close(self):
+        """Stops all streams."""
+
+        self.sync([])
+
+    def _remove(self, stream: StatsStream):
+        with self._lock:
+            if self._streams.get(stream.server.server_id) is stream:
+                del self._streams[stream.server.server_id]
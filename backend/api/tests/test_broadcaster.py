@@ -0,0 +1,60 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from api.producers import state_changed
+from api.pubsub import Broadcaster
+
+
+class BroadcasterTestCase(SimpleTestCase):
+    """Contains tests for sharing one producer between subscribers"""
+
+    def test_subscribers_share_one_producer(self):
+        """test if many subscribers of a topic cause only one producer call per round"""
+        calls = []
+
+        def producer():
+            def produce(state):
+                calls.append(state)
+                return (state or 0) + 1, [(state or 0) + 1]
+            return produce
+
+        async def run():
+            broadcaster = Broadcaster()
+            subscriptions = [broadcaster.subscribe("topic", producer, interval=0.01) for _ in range(50)]
+            first_messages = await asyncio.gather(*(subscription.__anext__() for subscription in subscriptions))
+            self.assertEqual(broadcaster.subscriber_count("topic"), 50)
+            for subscription in subscriptions:
+                await subscription.aclose()
+            self.assertEqual(broadcaster.subscriber_count("topic"), 0)
+            return first_messages
+
+        first_messages = asyncio.run(run())
+        self.assertEqual(first_messages, [1] * 50)
+        self.assertEqual(calls[0], None)
+        self.assertLess(len(calls), 5)
+
+    def test_new_subscriber_gets_snapshot(self):
+        """test if a subscriber joining a running topic gets the current state right away"""
+
+        def producer():
+            return lambda state: ("current", ["current"] if state is None else [])
+
+        async def run():
+            broadcaster = Broadcaster()
+            first = broadcaster.subscribe("topic", producer, interval=0.01, snapshot=lambda state: state)
+            self.assertEqual(await first.__anext__(), "current")
+            second = broadcaster.subscribe("topic", producer, interval=0.01, snapshot=lambda state: state)
+            message = await asyncio.wait_for(second.__anext__(), timeout=1)
+            await first.aclose()
+            await second.aclose()
+            return message
+
+        self.assertEqual(asyncio.run(run()), "current")
+
+    def test_state_changed_ignores_sample_age(self):
+        """test if only the age of a reading changing is not treated as a change"""
+        state = {"running": True, "cpu_usage": 0.5, "memory_usage": 10, "sampled_at": 1.0, "sample_age": 1.0}
+        self.assertFalse(state_changed(state, dict(state, sample_age=2.0)))
+        self.assertTrue(state_changed(state, dict(state, running=False)))
+        self.assertTrue(state_changed(None, state))
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.events import ContainerIndex, ContainerState, SharedIndexFile
+from api.models import Server
+
+
+def make_event(action, container_id="c1", project="sample"):
+    return {"Type": "container", "Action": action,
+            "Actor": {"ID": container_id, "Attributes": {"name": f"{project}_main_1",
+                                                         "com.docker.compose.project": project}}}
+
+
+class ContainerIndexTestCase(SimpleTestCase):
+    """Contains tests for the container index fed by docker events"""
+
+    def setUp(self):
+        self.index = ContainerIndex(enabled=False, reconnect_interval=5)
+        client = mock.MagicMock()
+        client.containers.list.return_value = [
+            SimpleNamespace(attrs={"Id": "c1", "Names": ["/sample_main_1"], "State": "running",
+                                   "Status": "Up 3 minutes (healthy)",
+                                   "Labels": {"com.docker.compose.project": "sample"}})
+        ]
+        self.index.resync("node2", client)
+
+    def test_unsynced_host_is_unknown(self):
+        """test if lookups on a host that was never listed fall back to docker"""
+        self.assertEqual(self.index.lookup("node3", "sample"), (False, None))
+
+    def test_resync_reads_listing(self):
+        """test if the listing fills the index with status and health"""
+        self.assertEqual(self.index.lookup("node2", "sample"),
+                         (True, ContainerState("c1", "sample_main_1", "running", "healthy", has_healthcheck=True)))
+        self.assertEqual(self.index.lookup("node2", "missing"), (True, None))
+
+    def test_events_update_status(self):
+        """test if die, oom, start and health events change the indexed state"""
+        self.index.apply_event("node2", make_event("oom"))
+        self.index.apply_event("node2", make_event("die"))
+        _, state = self.index.lookup("node2", "sample")
+        self.assertEqual((state.status, state.oom_killed), ("exited", True))
+
+        self.index.apply_event("node2", make_event("start"))
+        self.index.apply_event("node2", make_event("health_status: unhealthy"))
+        _, state = self.index.lookup("node2", "sample")
+        self.assertEqual((state.status, state.oom_killed, state.health), ("running", False, "unhealthy"))
+
+    def test_started_container_with_healthcheck_is_starting(self):
+        """test if a new container is inspected once on start and reports "starting" until its first check"""
+        inspect = mock.MagicMock(return_value={"Config": {"Healthcheck": {"Test": ["CMD", "mc-health"]}}})
+        self.index.apply_event("node2", make_event("create", container_id="c2"), inspect=inspect)
+        self.index.apply_event("node2", make_event("start", container_id="c2"), inspect=inspect)
+        _, state = self.index.lookup("node2", "sample")
+        self.assertEqual((state.status, state.health), ("running", "starting"))
+
+        self.index.apply_event("node2", make_event("die", container_id="c2"), inspect=inspect)
+        self.index.apply_event("node2", make_event("start", container_id="c2"), inspect=inspect)
+        inspect.assert_called_once_with("c2")
+
+    def test_started_container_without_healthcheck(self):
+        """test if a container without health check has no health after starting"""
+        inspect = mock.MagicMock(return_value={"Config": {}})
+        self.index.apply_event("node2", make_event("start", container_id="c2"), inspect=inspect)
+        _, state = self.index.lookup("node2", "sample")
+        self.assertEqual((state.status, state.health), ("running", None))
+
+    def test_kill_signal_keeps_running(self):
+        """test if a kill event, which may be a non fatal signal, does not mark the container exited"""
+        self.index.apply_event("node2", make_event("kill"))
+        self.assertEqual(self.index.lookup("node2", "sample")[1].status, "running")
+
+    def test_recreated_container_replaces_old_one(self):
+        """test if a new container of the project replaces the destroyed one"""
+        self.index.apply_event("node2", make_event("create", container_id="c2"))
+        self.index.apply_event("node2", make_event("destroy", container_id="c1"))
+        _, state = self.index.lookup("node2", "sample")
+        self.assertEqual((state.id, state.status), ("c2", "created"))
+
+    def test_load_container_uses_index(self):
+        """test if a server on a synced host gets its container without an inspect call"""
+        client = mock.MagicMock()
+        client.containers.prepare_model.side_effect = lambda attrs: SimpleNamespace(attrs=attrs)
+        server = Server(name="sample", host="node2")
+        server.docker_client = client
+
+        with mock.patch("api.models.container_index", self.index):
+            server.load_container()
+
+        client.containers.get.assert_not_called()
+        self.assertTrue(server.container_available)
+        self.assertEqual(server.container.attrs["State"]["Health"]["Status"], "healthy")
+
+
+class SharedContainerIndexTestCase(SimpleTestCase):
+    """Contains tests for the container index shared by the collector process"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "shared-state.containers")
+        self.worker = ContainerIndex(enabled=True, reconnect_interval=5, shared_path=self.path)
+
+    def test_worker_reads_index_of_collector(self):
+        """test if a worker answers lookups from the file without watching docker"""
+        state = ContainerState("c1", "sample_main_1", "running", "healthy", has_healthcheck=True)
+        SharedIndexFile(self.path).write({"node2": {"sample": state}})
+
+        with mock.patch.object(self.worker, "watch") as watch:
+            self.assertEqual(self.worker.lookup("node2", "sample"), (True, state))
+            self.assertEqual(self.worker.lookup("node3", "sample"), (False, None))
+        watch.assert_not_called()
+        self.assertEqual(self.worker._watchers, {})
+
+    def test_missing_or_stale_file_is_unknown(self):
+        """test if workers fall back to docker while the collector does not write the index"""
+        self.assertEqual(self.worker.lookup("node2", "sample"), (False, None))
+
+        SharedIndexFile(self.path).write({"node2": {}})
+        with mock.patch("api.events.time.time", return_value=os.path.getmtime(self.path) + 60):
+            self.assertIsNone(SharedIndexFile(self.path).read().get("node2"))
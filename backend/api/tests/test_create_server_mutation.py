@@ -1,15 +1,24 @@
 import os
 import subprocess
 from typing import List
+from unittest import mock
 
 import docker
 from django.contrib.auth.models import User
 from django.test import TestCase
 from graphene.test import Client
 
+from api.provisioning import provisioning_queue
 from api.schema import schema
 
 
+class InlineExecutor:
+    """Runs provisioning jobs in the calling thread, so tests can check their results right away."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
 class CreateServerMutationTestCase(TestCase):
     """Contains tests for creating servers"""
 
@@ -62,18 +71,19 @@ class CreateServerMutationTestCase(TestCase):
               }
             }
         """
-        client.execute(
-            query,
-            variable_values={
-                "name": name,
-                "description": description,
-                "port": port,
-                "sftpPort": sftp_port,
-                "allowedUsers": allowed_users,
-                "template": template,
-                "options": options
-            }
-        )
+        with mock.patch.object(provisioning_queue, "_get_executor", return_value=InlineExecutor()):
+            client.execute(
+                query,
+                variable_values={
+                    "name": name,
+                    "description": description,
+                    "port": port,
+                    "sftpPort": sftp_port,
+                    "allowedUsers": allowed_users,
+                    "template": template,
+                    "options": options
+                }
+            )
 
     def test_create_correct_mt_server(self):
         """test if normal server creation works"""
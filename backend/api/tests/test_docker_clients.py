@@ -0,0 +1,34 @@
+from django.test import TestCase
+
+from api.docker_clients import DockerClientRegistry
+
+
+class DockerClientRegistryTestCase(TestCase):
+    """Contains tests for the shared docker client registry"""
+
+    def setUp(self) -> None:
+        """creates an empty registry with one configured remote host"""
+        self.registry = DockerClientRegistry({"node2": "tcp://10.0.0.2:2375"}, timeout=5, pool_size=4,
+                                             version="1.41")
+
+    def tearDown(self) -> None:
+        self.registry.close()
+
+    def test_same_client_for_same_host(self):
+        """test if a host gets the same client on every lookup"""
+        client = self.registry.get("node1")
+        self.assertIs(self.registry.get("node1"), client)
+        self.assertEqual(self.registry.stats["hits"], 1)
+        self.assertEqual(self.registry.stats["misses"], 1)
+
+    def test_different_clients_for_different_hosts(self):
+        """test if every host gets its own client"""
+        self.assertIsNot(self.registry.get("node1"), self.registry.get("node2"))
+        self.assertEqual(self.registry.stats["misses"], 2)
+
+    def test_configured_host_url_and_timeout(self):
+        """test if configured hosts connect to their url with the configured timeout"""
+        client = self.registry.get("node2")
+        self.assertEqual(client.api.base_url, "http://10.0.0.2:2375")
+        self.assertEqual(client.api.timeout, 5)
+        self.assertEqual(self.registry.stats["in_flight"], {"node2": 0})
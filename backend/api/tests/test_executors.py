@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase
+
+from api.executors import BlockingExecutor, offload_view
+
+
+class BlockingExecutorTestCase(SimpleTestCase):
+    """Contains tests for running blocking work off the event loop"""
+
+    def test_offloaded_view_does_not_block_the_loop(self):
+        """test if slow sync views run concurrently on the pool while the loop keeps serving other tasks"""
+        executor = BlockingExecutor(workers=4, name="test")
+        threads = set()
+
+        def view(request, server_id):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.2)
+            return HttpResponse(server_id)
+
+        async def run():
+            async_view = offload_view(view, executor)
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                for _ in range(10):
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            started = time.monotonic()
+            responses, _ = await asyncio.gather(
+                asyncio.gather(*(async_view(None, server_id=str(i)) for i in range(4))), tick())
+            return responses, ticks, time.monotonic() - started
+
+        responses, ticks, duration = asyncio.run(run())
+        self.assertEqual([response.content for response in responses], [b"0", b"1", b"2", b"3"])
+        self.assertEqual(ticks, 10)
+        self.assertLess(duration, 0.6)
+        self.assertTrue(all(name.startswith("test") for name in threads))
+
+    def test_bounded(self):
+        """test if no more calls than workers run at the same time"""
+        executor = BlockingExecutor(workers=2, name="test")
+        running, peak = 0, 0
+        lock = threading.Lock()
+
+        def work(_):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+
+        executor.map(work, range(6))
+        self.assertEqual(peak, 2)
@@ -0,0 +1,184 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from graphene.test import Client
+
+from api.collector import StatsCollector, StatsReading
+from api.events import ContainerState
+from api.models import Server
+from api.schema import schema
+
+
+def make_container(project, service, state, ports=()):
+    """Builds a container as returned by a sparse `containers.list`."""
+    return SimpleNamespace(attrs={"Id": f"{project}_{service}", "Names": [f"/{project}_{service}_1"], "State": state,
+                                  "Status": "", "Ports": list(ports),
+                                  "Labels": {"com.docker.compose.project": project,
+                                             "com.docker.compose.service": service}})
+
+
+class LoadersTestCase(TestCase):
+    """Contains tests to check that server fields are loaded in batches"""
+
+    def setUp(self) -> None:
+        """creates a superuser and a few servers"""
+        self.superuser1 = User.objects.create_superuser("superuser1", "superuser1@example.com", "jf8034hj9")
+        self.user1 = User.objects.create_user("user1", "user1@example.com", "5R64o!f84")
+
+        for i in range(5):
+            server = Server(name=f"unit_testing_server{i}", description=f"Unit testing server {i}",
+                            template="minetest", port=39900 + i, sftp_port=39950 + i, max_cpu_usage=400,
+                            max_memory_usage=100000)
+            server.save()
+            server.allowed_users.set([self.user1])
+
+        self.request = RequestFactory().get("/api/graphql")
+        self.request.user = self.superuser1
+
+    def test_allowed_users_loaded_in_one_query(self):
+        """test if the allowed users of all servers are fetched with a single query"""
+        query = """
+query allServers {
+  allServers {
+    serverId
+    allowedUsers {
+      id
+    }
+  }
+}
+        """
+        with self.assertNumQueries(2):
+            response = Client(schema).execute(query, context_value=self.request)
+
+        self.assertEqual(len(response["data"]["allServers"]), 5)
+        for server in response["data"]["allServers"]:
+            self.assertEqual(server["allowedUsers"], [{"id": str(self.user1.id)}])
+
+    def test_container_states_loaded_in_one_docker_call(self):
+        """test if the container states of all servers are fetched with one docker call"""
+        containers = [make_container("unit_testing_server0", "main", "running"),
+                      make_container("unit_testing_server0", "sftp", "running",
+                                     [{"IP": "0.0.0.0", "PrivatePort": 22, "PublicPort": 39950, "Type": "tcp"},
+                                      {"IP": "::", "PrivatePort": 22, "PublicPort": 39950, "Type": "tcp"}]),
+                      make_container("unit_testing_server1", "main", "exited")]
+        client = mock.MagicMock()
+        client.containers.list.return_value = containers
+
+        query = """
+query allServers {
+  allServers {
+    name
+    status
+    state {
+      running
+    }
+    publishedPorts {
+      service
+      publicPort
+    }
+  }
+}
+        """
+        with mock.patch("api.loaders.get_docker_client", return_value=client), \
+                mock.patch("api.loaders.get_collector", return_value=StatsCollector(interval=5, workers=1)):
+            response = Client(schema).execute(query, context_value=self.request)
+
+        client.containers.list.assert_called_once()
+        running = {server["name"]: server["state"]["running"] for server in response["data"]["allServers"]}
+        self.assertTrue(running["unit_testing_server0"])
+        self.assertFalse(running["unit_testing_server1"])
+        self.assertFalse(running["unit_testing_server4"])
+
+        servers = {server["name"]: server for server in response["data"]["allServers"]}
+        self.assertEqual(servers["unit_testing_server1"]["status"], "exited")
+        self.assertIsNone(servers["unit_testing_server4"]["status"])
+        self.assertEqual(servers["unit_testing_server0"]["publishedPorts"], [{"service": "sftp", "publicPort": 39950}])
+
+    def test_running_only_does_not_read_stats(self):
+        """test if selecting only `running` neither reads stats nor inspects containers"""
+        client = mock.MagicMock()
+        client.containers.list.return_value = [make_container("unit_testing_server0", "main", "running")]
+
+        query = """
+query allServers {
+  allServers {
+    name
+    state {
+      running
+    }
+  }
+}
+        """
+        with mock.patch("api.loaders.get_docker_client", return_value=client), \
+                mock.patch("api.loaders.get_collector") as get_collector:
+            response = Client(schema).execute(query, context_value=self.request)
+
+        get_collector.assert_not_called()
+        client.containers.get.assert_not_called()
+        client.containers.list.assert_called_once()
+        running = {server["name"]: server["state"]["running"] for server in response["data"]["allServers"]}
+        self.assertTrue(running["unit_testing_server0"])
+
+    def test_status_served_from_synced_container_index(self):
+        """test if status and running are read from the synced container index without listing containers"""
+        client = mock.MagicMock()
+        states = {"unit_testing_server0": ContainerState("c0", "unit_testing_server0_main_1", "running", None)}
+
+        query = """
+query allServers {
+  allServers {
+    name
+    status
+    state {
+      running
+    }
+  }
+}
+        """
+        with mock.patch("api.loaders.get_docker_client", return_value=client), \
+                mock.patch("api.loaders.container_index.lookup",
+                           side_effect=lambda host, project: (True, states.get(project))):
+            response = Client(schema).execute(query, context_value=self.request)
+
+        client.containers.list.assert_not_called()
+        servers = {server["name"]: server for server in response["data"]["allServers"]}
+        self.assertEqual(servers["unit_testing_server0"]["status"], "running")
+        self.assertTrue(servers["unit_testing_server0"]["state"]["running"])
+        self.assertIsNone(servers["unit_testing_server1"]["status"])
+        self.assertFalse(servers["unit_testing_server1"]["state"]["running"])
+
+    def test_usage_comes_from_collector(self):
+        """test if cpu and memory usage are read from the latest collector reading of running servers"""
+        client = mock.MagicMock()
+        client.containers.list.return_value = [make_container("unit_testing_server0", "main", "running")]
+        collector = StatsCollector(interval=5, workers=1)
+        server_id = Server.objects.get(name="unit_testing_server0").server_id
+        collector._readings[server_id] = StatsReading(0.25, 2048, 0, running=True, network_rx_rate=512)
+        collector._readings[server_id + "/sftp"] = StatsReading(0.01, 64, 0, running=True)
+
+        query = """
+query server($serverId: String) {
+  server(serverId: $serverId) {
+    state {
+      cpuUsage
+      memoryUsage
+      networkRxRate
+      sampledAt
+      services {
+        service
+        memoryUsage
+      }
+    }
+  }
+}
+        """
+        with mock.patch("api.loaders.get_docker_client", return_value=client), \
+                mock.patch("api.loaders.get_collector", return_value=collector):
+            response = Client(schema).execute(query, context_value=self.request, variables={"serverId": server_id})
+
+        self.assertEqual(response["data"]["server"]["state"], {
+            "cpuUsage": 0.25, "memoryUsage": 2048, "networkRxRate": 512, "sampledAt": 0,
+            "services": [{"service": "main", "memoryUsage": 2048}, {"service": "sftp", "memoryUsage": 64}]
+        })
@@ -0,0 +1,181 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from api.app_templates import template_registry
+from api.logs import LogBuffer, LogParser, newest_cursor, parse_docker_timestamp
+
+
+def docker_logs(*lines: str) -> bytes:
+    return ("\n".join(lines) + "\n").encode()
+
+
+class LogBufferTestCase(TestCase):
+    """Contains tests for the incremental log buffer"""
+
+    def setUp(self) -> None:
+        """creates a buffer and a container with three log lines"""
+        self.buffer = LogBuffer(size=100, refresh_interval=0)
+        self.container = mock.MagicMock()
+        self.container.logs.return_value = docker_logs(
+            "2021-09-01T11:30:00.000000001Z [Server thread/INFO]: Starting minecraft server",
+            "2021-09-01T11:30:01.5Z [Server thread/INFO]: Preparing level \"world\"",
+            "2021-09-01T11:30:02.000000000Z [Server thread/INFO]: Done (2.1s)!",
+        )
+
+    def test_parse_docker_timestamp(self):
+        """test if docker timestamps are parsed to nanoseconds"""
+        self.assertEqual(parse_docker_timestamp("1970-01-01T00:00:01.5Z"), 1_500_000_000)
+        self.assertEqual(parse_docker_timestamp("1970-01-01T00:00:00.000000007Z"), 7)
+        self.assertRaises(ValueError, parse_docker_timestamp, "not a timestamp")
+
+    def test_first_refresh_tails(self):
+        """test if the first refresh reads the tail of the logs"""
+        self.buffer.refresh(self.container)
+        self.container.logs.assert_called_once_with(tail=100, timestamps=True)
+
+        lines = self.buffer.read(limit=2)
+        self.assertEqual([line.content for line in lines],
+                         ["[Server thread/INFO]: Preparing level \"world\"", "[Server thread/INFO]: Done (2.1s)!"])
+        self.assertEqual(lines[0].timestamp, 1630495801)
+
+    def test_only_new_lines_after_cursor(self):
+        """test if polling with a cursor only returns lines that were not seen before"""
+        self.buffer.refresh(self.container)
+        cursor = self.buffer.read()[-1].cursor
+
+        self.container.logs.return_value = docker_logs(
+            "2021-09-01T11:30:02.000000000Z [Server thread/INFO]: Done (2.1s)!",
+            "2021-09-01T11:30:03.000000000Z [Server thread/INFO]: Player joined",
+        )
+        self.buffer.refresh(self.container)
+        self.container.logs.assert_called_with(since=1630495802, timestamps=True)
+
+        self.assertEqual([line.content for line in self.buffer.read(after=cursor)],
+                         ["[Server thread/INFO]: Player joined"])
+        self.assertEqual(len(self.buffer.read(limit=100)), 4)
+
+    def test_nothing_new(self):
+        """test if a cursor pointing at the newest line returns nothing"""
+        self.buffer.refresh(self.container)
+        self.assertEqual(self.buffer.read(after=self.buffer.read()[-1].cursor), [])
+
+    def test_invalid_cursor(self):
+        """test if an invalid cursor raises an error"""
+        self.assertRaisesMessage(ValueError, "invalid log cursor", self.buffer.read, "abc")
+
+    def test_level_filter(self):
+        """test if lines are classified by the template parser and filtered by minimum level"""
+        self.container.logs.return_value = docker_logs(
+            "2021-09-01T11:30:00Z [11:30:00 INFO]: Done (2.1s)!",
+            "2021-09-01T11:30:01Z [11:30:01 WARN]: Can't keep up!",
+            "2021-09-01T11:30:02Z [11:30:02 ERROR]: [Essentials] Could not load config",
+            "2021-09-01T11:30:03Z at java.base/java.lang.Thread.run(Thread.java:831)",
+        )
+        self.buffer.refresh(self.container, template_registry.get("mc_spigot").log_parser)
+
+        self.assertEqual([line.level for line in self.buffer.read()], ["INFO", "WARN", "ERROR", None])
+        self.assertEqual([line.content for line in self.buffer.read(level="WARN")],
+                         ["[11:30:01 WARN]: Can't keep up!", "[11:30:02 ERROR]: [Essentials] Could not load config"])
+        self.assertEqual(self.buffer.read(level="ERROR")[0].logger, "Essentials")
+        self.assertEqual(self.buffer.read(after=self.buffer.read()[1].cursor, level="WARN")[0].level, "ERROR")
+
+    def test_collapse_repeats(self):
+        """test if repeats among the latest entries are folded into one entry that keeps its place and cursor"""
+        self.buffer.refresh(self.repeating_container(), self.parser)
+
+        lines = self.buffer.read()
+        self.assertEqual([(line.message, line.repeat_count) for line in lines], [
+            ("Missing texture", 3), ("Saving chunks", 1), ("Done", 1), ("Preparing spawn", 1), ("Missing texture", 1),
+        ])
+        self.assertEqual((lines[0].timestamp, lines[0].last_timestamp), (1630495800, 1630495803))
+        self.assertEqual((lines[0].cursor, lines[0].last_cursor),
+                         (str(1630495800 * 1_000_000_000), str(1630495803 * 1_000_000_000)))
+        self.assertEqual(len(self.buffer.read(after=lines[1].cursor)), 4)
+
+    def test_identical_stack_traces_are_kept(self):
+        """test if a repeated stack trace is kept in full instead of folding its frames into the previous one"""
+        self.buffer.refresh(mock.MagicMock(logs=mock.MagicMock(return_value=docker_logs(
+            "2021-09-01T11:30:00Z [11:30:00 ERROR]: Could not save chunk",
+            "2021-09-01T11:30:00.1Z \tat Chunk.save(Chunk.java:10)",
+            "2021-09-01T11:30:00.2Z \tat World.save(World.java:20)",
+            "2021-09-01T11:30:01Z [11:30:01 ERROR]: Could not save chunk",
+            "2021-09-01T11:30:01.1Z \tat Chunk.save(Chunk.java:10)",
+            "2021-09-01T11:30:01.2Z \tat World.save(World.java:20)",
+        ))), LogParser(r"^\[[0-9:]+ (?P<level>[A-Z]+)\]: (?P<message>.*)$", collapse_window=16))
+
+        self.assertEqual([(line.message, line.repeat_count) for line in self.buffer.read()], [
+            ("Could not save chunk", 1), ("\tat Chunk.save(Chunk.java:10)", 1), ("\tat World.save(World.java:20)", 1),
+            ("Could not save chunk", 1), ("\tat Chunk.save(Chunk.java:10)", 1), ("\tat World.save(World.java:20)", 1),
+        ])
+
+    def test_repeats_after_cursor(self):
+        """test if an entry with new repeats is read again after a cursor, with the cursor the client has"""
+        self.buffer.refresh(self.repeating_container(), self.parser)
+        lines = self.buffer.read()
+        cursor = newest_cursor(lines)
+
+        self.buffer.refresh(mock.MagicMock(logs=mock.MagicMock(return_value=docker_logs(
+            "2021-09-01T11:30:07Z [11:30:07 INFO]: Preparing spawn",
+            "2021-09-01T11:30:08Z [11:30:08 INFO]: Spawn ready",
+        ))), self.parser)
+
+        newer = self.buffer.read(after=cursor)
+        self.assertEqual([(line.cursor, line.message, line.repeat_count) for line in newer], [
+            (lines[3].cursor, "Preparing spawn", 2), (str(1630495808 * 1_000_000_000), "Spawn ready", 1),
+        ])
+        self.assertEqual(newest_cursor(newer), str(1630495808 * 1_000_000_000))
+        self.assertEqual(self.buffer.read(after=newest_cursor(newer)), [])
+
+    def test_limit_after_cursor_skips_nothing(self):
+        """test if a limited read after a cursor returns the lines changed first, so the next read gets the rest"""
+        self.buffer.refresh(self.repeating_container(), self.parser)
+        self.buffer.refresh(mock.MagicMock(logs=mock.MagicMock(return_value=docker_logs(
+            "2021-09-01T11:30:07Z [11:30:07 INFO]: Preparing spawn",
+        ))), self.parser)
+        after = str(1630495803 * 1_000_000_000)
+
+        first = self.buffer.read(after=after, limit=2)
+        self.assertEqual([line.message for line in first], ["Done", "Missing texture"])
+        self.assertEqual([line.message for line in self.buffer.read(after=newest_cursor(first))],
+                         ["Preparing spawn"])
+
+    @property
+    def parser(self):
+        return LogParser(r"^\[[0-9:]+ (?P<level>[A-Z]+)\]: (?P<message>.*)$", collapse_window=2)
+
+    @staticmethod
+    def repeating_container():
+        return mock.MagicMock(logs=mock.MagicMock(return_value=docker_logs(
+            "2021-09-01T11:30:00Z [11:30:00 WARN]: Missing texture",
+            "2021-09-01T11:30:01Z [11:30:01 WARN]: Missing texture",
+            "2021-09-01T11:30:02Z [11:30:02 INFO]: Saving chunks",
+            "2021-09-01T11:30:03Z [11:30:03 WARN]: Missing texture",
+            "2021-09-01T11:30:04Z [11:30:04 INFO]: Done",
+            "2021-09-01T11:30:05Z [11:30:05 INFO]: Preparing spawn",
+            "2021-09-01T11:30:06Z [11:30:06 WARN]: Missing texture",
+        )))
+
+
+class LogParserTestCase(TestCase):
+    """Contains tests for the log formats declared by the app templates"""
+
+    def test_forge(self):
+        """test if level, thread, logger and player events of forge lines are parsed"""
+        parser = template_registry.get("mc_forge").log_parser
+        line = parser.parse("1", 0, "[01Sep2021 11:30:00.000] [Server thread/INFO] "
+                                    "[net.minecraft.server.MinecraftServer/]: Steve joined the game")
+        self.assertEqual((line.level, line.thread, line.logger, line.source, line.player),
+                         ("INFO", "Server thread", "net.minecraft.server.MinecraftServer/", "join", "Steve"))
+
+    def test_minetest(self):
+        """test if minetest levels are mapped to the common ones"""
+        parser = template_registry.get("minetest").log_parser
+        line = parser.parse("1", 0, "2021-09-01 11:30:00: ACTION[Server]: Steve [127.0.0.1] joins game. ")
+        self.assertEqual((line.level, line.source, line.player), ("INFO", "join", "Steve"))
+        self.assertEqual(parser.parse("2", 0, "2021-09-01 11:30:00: WARNING[Main]: Low memory").level, "WARN")
+
+    def test_unknown_format(self):
+        """test if lines that do not match the template are kept as plain log lines"""
+        line = template_registry.get("mc_forge").log_parser.parse("1", 0, "Starting server")
+        self.assertEqual((line.content, line.source, line.level), ("Starting server", "log", None))
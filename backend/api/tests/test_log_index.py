@@ -0,0 +1,177 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.log_index import LogIndexer, ServerLogIndex, iter_log_lines, tokenize
+
+SECOND = 1_000_000_000
+
+
+class ServerLogIndexTestCase(SimpleTestCase):
+    """Contains tests for the on-disk log index"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.index = ServerLogIndex(self.directory, segment_seconds=60)
+        self.index.append([
+            (10 * SECOND, "[Server] Steve joined the game"),
+            (20 * SECOND, "[Server] Alex joined the game"),
+            (70 * SECOND, "java.lang.NullPointerException in tick"),
+            (130 * SECOND, "[Server] Steve left the game"),
+        ])
+
+    def test_tokenize(self):
+        """test if texts are split into lowercase words"""
+        self.assertEqual(tokenize("[Server] Steve joined!"), ["server", "steve", "joined"])
+
+    def test_complete_segments_are_sealed(self):
+        """test if segments that were followed by a newer one get an inverted index"""
+        self.assertEqual(self.index.segments(), [0, 60, 120])
+        self.index.seal_complete(now=150)
+        search = self.index.search("steve", 0, 200 * SECOND, 10)
+        self.assertEqual([line.content for line in search],
+                         ["[Server] Steve left the game", "[Server] Steve joined the game"])
+
+    def test_sealed_segments_are_compressed(self):
+        """test if sealing replaces the plain segment with a compressed one and keeps the newest timestamp"""
+        self.index.seal_complete(now=200)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["0.seg", "120.seg", "60.seg"])
+        self.assertEqual(ServerLogIndex(self.directory, segment_seconds=60).last_ns, 130 * SECOND)
+
+    def test_read_range(self):
+        """test if a time range is read oldest first from sealed blocks and the current segment"""
+        with mock.patch("api.log_index.BLOCK_SIZE", 1):  # every line in its own block
+            self.index.seal_complete(now=150)
+        lines = self.index.read_range(15 * SECOND, 130 * SECOND)
+        self.assertEqual([(line.timestamp, line.content) for line in lines], [
+            (20, "[Server] Alex joined the game"),
+            (70, "java.lang.NullPointerException in tick"),
+            (130, "[Server] Steve left the game"),
+        ])
+        self.assertEqual([line.timestamp for line in self.index.read_range(0, 69 * SECOND)], [10, 20])
+
+    def test_retention(self):
+        """test if sealed segments are deleted by age and by size, but never the current one"""
+        self.index.seal_complete(now=150)
+        self.index.enforce_retention(now=150, max_age=60, max_bytes=float("inf"))
+        self.assertEqual(self.index.segments(), [60, 120])
+        self.index.enforce_retention(now=150, max_age=3600, max_bytes=0)
+        self.assertEqual(self.index.segments(), [120])
+        self.assertEqual(self.index.search("steve", 0, 200 * SECOND, 10)[0].timestamp, 130)
+
+    def test_late_line_of_sealed_segment(self):
+        """test if a line arriving after its segment was sealed is added to it and found by searches"""
+        self.index.seal_complete(now=200)
+        self.index.append([(150 * SECOND, "[Server] Alex left the game")])
+        self.assertTrue(self.index.is_sealed(120) and self.index.has_plain_lines(120))
+        self.assertEqual([line.timestamp for line in self.index.search("left", 0, 200 * SECOND, 10)], [150, 130])
+        self.assertEqual([line.timestamp for line in self.index.read_range(120 * SECOND, 200 * SECOND)], [130, 150])
+
+    def test_late_line_then_next_segment(self):
+        """test if resealing a segment after a late line keeps all of its archived lines"""
+        self.index.append([(130 * SECOND + i, f"archived line {i}") for i in range(1, 100)])
+        self.index.seal_complete(now=200)
+        self.index.append([(150 * SECOND, "late line"), (190 * SECOND, "next segment line")])
+        self.assertTrue(self.index.is_sealed(120))
+        self.assertEqual(len(self.index.search("archived", 0, 200 * SECOND, 1000)), 99)
+        self.assertEqual([line.timestamp for line in self.index.search("line", 0, 200 * SECOND, 1000)][:3],
+                         [190, 150, 130])
+        self.assertEqual(len(list(self.index.read_range(120 * SECOND, 180 * SECOND))), 101)
+
+    def test_seal_merges_with_archive(self):
+        """test if sealing plain lines next to an existing archive merges them instead of replacing it"""
+        self.index.seal_complete(now=200)
+        with open(os.path.join(self.directory, "120.log"), "w") as file:
+            file.write(f"{150 * SECOND}\tSteve joined again\n")
+        self.index.seal(120)
+        self.assertEqual([line.timestamp for line in self.index.search("steve", 0, 200 * SECOND, 10)], [150, 130, 10])
+
+    def test_reseal_under_open_reader(self):
+        """test if a reader keeps reading the sealed file it opened while the segment is sealed again"""
+        self.index.append([(130 * SECOND + i, f"archived line {i}") for i in range(1, 100)])
+        self.index.seal_complete(now=200)
+        with open(os.path.join(self.directory, "120.log"), "w") as file:
+            file.write(f"{150 * SECOND}\tlate line\n")
+        lines = self.index.read_range(120 * SECOND, 180 * SECOND)
+        self.assertEqual(next(lines).timestamp, 130)
+
+        self.index.seal(120)
+        self.assertFalse(self.index.has_plain_lines(120))
+        self.assertEqual(len(list(lines)), 100)
+        self.assertEqual(len(list(self.index.read_range(120 * SECOND, 180 * SECOND))), 101)
+
+    def test_search_requires_all_words(self):
+        """test if only lines containing every word of the query match, case insensitive"""
+        self.assertEqual([line.timestamp for line in self.index.search("JOINED alex", 0, 200 * SECOND, 10)], [20])
+
+    def test_search_time_range_and_limit(self):
+        """test if `from`, `to` and `limit` restrict the results"""
+        self.assertEqual([line.timestamp for line in self.index.search("game", 15 * SECOND, 200 * SECOND, 10)],
+                         [130, 20])
+        self.assertEqual([line.timestamp for line in self.index.search("game", 0, 200 * SECOND, 1)], [130])
+        self.assertEqual(self.index.search("nullpointerexception", 0, 60 * SECOND, 10), [])
+
+    def test_resume_after_restart(self):
+        """test if a new index continues after the newest line on disk and skips lines it already has"""
+        restarted = ServerLogIndex(self.directory, segment_seconds=60)
+        self.assertEqual(restarted.last_ns, 130 * SECOND)
+
+        restarted.append([(130 * SECOND, "[Server] Steve left the game"), (140 * SECOND, "[Server] Steve joined")])
+        self.assertEqual([line.timestamp for line in restarted.search("steve", 0, 200 * SECOND, 10)], [140, 130, 10])
+
+
+class LogIndexerTestCase(SimpleTestCase):
+    """Contains tests for the log ingestion"""
+
+    def test_ingest_fetches_only_new_lines(self):
+        """test if ingestion asks docker for the lines since the newest indexed one"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        indexer = LogIndexer(directory.name, segment_seconds=3600, interval=5)
+        requests = []
+
+        def logs(since, timestamps, stream, follow):
+            requests.append(since)
+            return iter([b"1970-01-01T00:00:05.000000001Z Steve joi", b"ned\n1970-01-01T00:00:06Z Alex joined\n"])
+
+        server = SimpleNamespace(server_id="abcdef", container_available=True, load_container=lambda: None,
+                                 container=SimpleNamespace(logs=logs))
+        indexer.ingest(server)
+        indexer.ingest(server)
+
+        self.assertEqual(requests, [0, 6])
+        self.assertEqual(len(indexer.get("abcdef").search("joined", 0, 10 * SECOND, 10)), 2)
+
+    def test_iter_log_lines(self):
+        """test if streamed chunks are split into lines, including lines split across chunks"""
+        chunks = [b"1970-01-01T00:00:01Z a", b"b\n1970-01-01T00:00:02Z c\nnot a log line\n1970-01-01T00:00:03Z d"]
+        self.assertEqual(list(iter_log_lines(chunks)), [(1 * SECOND, "ab"), (2 * SECOND, "c"), (3 * SECOND, "d")])
+
+    def test_first_backfill_is_bounded_by_retention(self):
+        """test if the first ingestion of a server only asks for the lines within the retention period"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        indexer = LogIndexer(directory.name, segment_seconds=3600, interval=5, retention_seconds=3600)
+        logs = mock.MagicMock(return_value=iter([]))
+        server = SimpleNamespace(server_id="abcdef", container_available=True, load_container=lambda: None,
+                                 container=SimpleNamespace(logs=logs))
+        with mock.patch("api.log_index.time.time", return_value=10_000):
+            indexer.ingest(server)
+        logs.assert_called_once_with(since=6400, timestamps=True, stream=True, follow=False)
+
+    def test_single_writer(self):
+        """test if only one indexer per archive directory ingests"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        first = LogIndexer(directory.name, segment_seconds=3600, interval=5)
+        second = LogIndexer(directory.name, segment_seconds=3600, interval=5)
+        self.assertTrue(first._acquire_writer_lock())
+        self.assertFalse(second._acquire_writer_lock())
+        first._writer_lock.close()
+        self.assertTrue(second._acquire_writer_lock())
+        second._writer_lock.close()
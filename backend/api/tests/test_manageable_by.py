@@ -0,0 +1,47 @@
+from api.models import Server
+from django.contrib.auth.models import AnonymousUser, User
+
+from django.test import TestCase
+
+
+class ManageableByTestCase(TestCase):
+    """Contains tests for the permission scoped server queryset"""
+
+    def setUp(self) -> None:
+        """creates two servers and a few users for testing"""
+        self.user1 = User.objects.create_user("user1", "user1@example.com", "5R64o!f84")
+        self.user2 = User.objects.create_user("user2", "user2@example.com", "bD4hD-54f")
+        self.superuser1 = User.objects.create_superuser("superuser1", "superuser1@example.com", "jf8034hj9")
+        self.staff1 = User.objects.create_user("staff1", "staff1@example.com", "fef3f3f3", is_staff=True)
+
+        self.server1 = Server(name="unit_testing_server1", description="Unit testing server 1", template="minetest",
+                              port=39999, sftp_port=39998, max_cpu_usage=400, max_memory_usage=100000)
+        self.server1.save()
+        self.server1.allowed_users.set([self.user1])
+
+        self.server2 = Server(name="unit_testing_server2", description="Unit testing server 2", template="minetest",
+                              port=39997, sftp_port=39996, max_cpu_usage=400, max_memory_usage=100000)
+        self.server2.save()
+        self.server2.allowed_users.set([self.user1, self.user2])
+
+    def test_superuser_sees_all_servers(self):
+        """test if a superuser can manage every server"""
+        self.assertEqual(Server.objects.manageable_by(self.superuser1).count(), 2)
+
+    def test_staff_sees_all_servers(self):
+        """test if a staff account can manage every server"""
+        self.assertEqual(Server.objects.manageable_by(self.staff1).count(), 2)
+
+    def test_allowed_user_sees_only_own_servers(self):
+        """test if normal users only see the servers they are allowed to manage"""
+        self.assertEqual(set(Server.objects.manageable_by(self.user1)), {self.server1, self.server2})
+        self.assertEqual(set(Server.objects.manageable_by(self.user2)), {self.server2})
+
+    def test_anonymous_user_sees_nothing(self):
+        """test if an anonymous user can not manage any server"""
+        self.assertEqual(Server.objects.manageable_by(AnonymousUser()).count(), 0)
+
+    def test_single_query(self):
+        """test if the permission check is done in one database query"""
+        with self.assertNumQueries(1):
+            list(Server.objects.manageable_by(self.user1))
@@ -0,0 +1,101 @@
+import time
+
+from django.test import SimpleTestCase, TestCase
+
+from api.metrics import MetricsHistory, RingSeries
+from api.models import Server, ServerMetricsArchive
+
+
+class RingSeriesTestCase(SimpleTestCase):
+    """Contains tests for the ring buffers of the usage history"""
+
+    def test_query_aggregates_min_avg_max(self):
+        """test if samples in the same bucket are merged into min, avg and max"""
+        series = RingSeries(step=60, slots=10)
+        series.add(120, 0.2, 100)
+        series.add(130, 0.6, 300)
+
+        point, = series.query(0, 179, 60)
+        self.assertEqual(point.timestamp, 120)
+        self.assertEqual((point.cpu_min, point.cpu_max), (0.2, 0.6))
+        self.assertAlmostEqual(point.cpu_avg, 0.4)
+        self.assertEqual((point.memory_min, point.memory_avg, point.memory_max), (100, 200, 300))
+
+    def test_query_merges_buckets_to_step(self):
+        """test if a larger step merges several buckets into one point"""
+        series = RingSeries(step=1, slots=100)
+        for second in range(20):
+            series.add(second, second, 0)
+
+        points = series.query(0, 19, 10)
+        self.assertEqual([point.timestamp for point in points], [0, 10])
+        self.assertEqual((points[0].cpu_min, points[0].cpu_max, points[0].cpu_avg), (0, 9, 4.5))
+
+    def test_old_buckets_are_overwritten(self):
+        """test if the buffer keeps only the newest `slots` buckets"""
+        series = RingSeries(step=1, slots=5)
+        for second in range(12):
+            series.add(second, second, 0)
+
+        self.assertEqual([point.timestamp for point in series.query(0, 11, 1)], [7, 8, 9, 10, 11])
+
+    def test_dumps_and_loads(self):
+        """test if a serialized buffer loads back with the same contents"""
+        series = RingSeries(step=60, slots=10)
+        series.add(60, 0.5, 1024)
+
+        loaded = RingSeries.loads(series.dumps())
+        self.assertEqual(loaded.query(0, 600, 60), series.query(0, 600, 60))
+
+    def test_blob_has_fixed_width_layout(self):
+        """test if a serialized buffer has the same size on every platform and rejects other formats"""
+        series = RingSeries(step=1, slots=10)
+        data = series.dumps()
+        self.assertEqual(len(data), 12 + 10 * 8 * 8)
+        self.assertRaises(ValueError, RingSeries.loads, b"XXXX" + data[4:])
+
+    def test_memory_is_known_in_advance(self):
+        """test if the size of a buffer does not grow with the number of samples"""
+        series = RingSeries(step=1, slots=10)
+        size = series.nbytes
+        for second in range(100):
+            series.add(second, 0.1, 1)
+        self.assertEqual(series.nbytes, size)
+
+
+class MetricsHistoryTestCase(TestCase):
+    """Contains tests for the usage history store"""
+
+    def setUp(self):
+        self.server = Server(name="unit_testing_server", description="Unit testing server", template="minetest",
+                             port=39999, sftp_port=39998, max_cpu_usage=400, max_memory_usage=100000)
+        self.server.save()
+        self.history = MetricsHistory([(1, 600), (60, 1440)], flush_interval=60, persist=True)
+
+    def test_query_picks_coarse_resolution_for_old_ranges(self):
+        """test if ranges older than the finest buffer are answered from a coarser one"""
+        now = time.time()
+        self.history.record(self.server.server_id, now - 3600, 0.5, 100)
+
+        points = self.history.query(self.server.server_id, now - 7200, now, 1)
+        self.assertEqual(len(points), 1)
+        self.assertEqual(points[0].timestamp, int(now - 3600) // 60 * 60)
+
+    def test_flush_persists_one_row_per_resolution(self):
+        """test if a flush writes one blob per resolution that a new store loads again"""
+        now = time.time()
+        for offset in range(10):
+            self.history.record(self.server.server_id, now - offset, 0.5, 100)
+        self.history.flush()
+        self.assertEqual(ServerMetricsArchive.objects.filter(server=self.server).count(), 2)
+
+        reloaded = MetricsHistory([(1, 600), (60, 1440)], flush_interval=60)
+        self.assertEqual(reloaded.query(self.server.server_id, now - 60, now, 1),
+                         self.history.query(self.server.server_id, now - 60, now, 1))
+
+    def test_only_persisting_process_flushes(self):
+        """test if a history that does not persist never writes the archive"""
+        history = MetricsHistory([(1, 600), (60, 1440)], flush_interval=60)
+        history.record(self.server.server_id, time.time(), 0.5, 100)
+        history.flush()
+        self.assertFalse(ServerMetricsArchive.objects.filter(server=self.server).exists())
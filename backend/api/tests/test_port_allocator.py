@@ -0,0 +1,121 @@
+import socket
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from graphene.test import Client
+
+from api.models import Server
+from api.ports import PortAllocator, PortInUseError, Reservation
+from api.schema import schema
+
+
+class PortAllocatorTestCase(TestCase):
+    """Contains tests for the host port allocator"""
+
+    def setUp(self) -> None:
+        """creates a server using two ports and a docker container publishing a third one"""
+        server = Server(name="unit_testing_server", description="Unit testing server", template="minetest",
+                        port=41000, sftp_port=41001, max_cpu_usage=400, max_memory_usage=100000)
+        server.save()
+
+        container = mock.MagicMock()
+        container.attrs = {"Ports": [{"IP": "0.0.0.0", "PrivatePort": 25565, "PublicPort": 41002, "Type": "tcp"},
+                                     {"PrivatePort": 22, "Type": "tcp"}]}
+        self.client = client = mock.MagicMock()
+        client.containers.list.return_value = [container]
+        patcher = mock.patch("api.ports.get_docker_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.allocator = PortAllocator(41000, 41100, reservation_ttl=60)
+
+    def test_ports_of_servers_are_used(self):
+        """test if ports configured for servers are detected as being used"""
+        self.assertTrue(self.allocator.is_port_in_use(41000))
+        self.assertTrue(self.allocator.is_port_in_use(41001))
+
+    def test_ports_of_containers_are_used(self):
+        """test if ports published by docker containers are detected as being used"""
+        self.assertTrue(self.allocator.is_port_in_use(41002))
+
+    def test_bound_ports_are_used(self):
+        """test if a port that is bound by a host process is detected as being used"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("", 41003))
+            sock.listen()
+            self.assertTrue(self.allocator.is_port_in_use(41003))
+
+    def test_allocate_skips_used_ports(self):
+        """test if allocated ports are free and distinct"""
+        reservation = self.allocator.allocate(2)
+        self.assertEqual(len(set(reservation.ports)), 2)
+        for port in reservation.ports:
+            self.assertNotIn(port, (41000, 41001, 41002))
+
+    def test_reserved_ports_are_not_handed_out_twice(self):
+        """test if concurrent allocations never get the same ports"""
+        first = self.allocator.allocate(2)
+        second = self.allocator.allocate(2)
+        self.assertFalse(set(first.ports) & set(second.ports))
+        self.assertTrue(self.allocator.is_port_in_use(first.ports[0]))
+        self.assertFalse(self.allocator.is_port_in_use(first.ports[0], token=first.token))
+
+    def test_reserve_used_port_fails(self):
+        """test if reserving a port that is used raises an error"""
+        self.assertRaises(PortInUseError, self.allocator.reserve, [41000])
+
+    def test_reserve_and_allocate_with_one_bitmap(self):
+        """test if given and allocated ports are reserved together and docker is only asked once"""
+        reservation = self.allocator.reserve([41010], allocate=1)
+        self.assertEqual(reservation.ports[0], 41010)
+        self.assertNotIn(reservation.ports[1], (41000, 41001, 41002, 41010))
+        self.client.containers.list.assert_called_once()
+
+    def test_reservations_are_shared_between_processes(self):
+        """test if ports reserved by another process are neither allocated nor reserved again"""
+        other_process = PortAllocator(41000, 41100, reservation_ttl=60)
+        reservation = other_process.allocate(2)
+        self.assertTrue(self.allocator.is_port_in_use(reservation.ports[0]))
+        self.assertRaises(PortInUseError, self.allocator.reserve, [reservation.ports[1]])
+        self.assertFalse(set(self.allocator.allocate(2).ports) & set(reservation.ports))
+
+    def test_release_frees_ports(self):
+        """test if released ports can be reserved again"""
+        reservation = self.allocator.allocate(1)
+        self.allocator.release(reservation.token)
+        self.assertFalse(self.allocator.is_port_in_use(reservation.ports[0]))
+
+    def test_allocate_fails_when_range_is_full(self):
+        """test if allocation fails when there are not enough free ports"""
+        allocator = PortAllocator(41000, 41002, reservation_ttl=60)
+        self.assertRaises(ValueError, allocator.allocate, 1)
+
+
+class CreateServerPortCollisionTestCase(TestCase):
+    """Contains tests for creates that collide on a port saved in the meantime"""
+
+    def test_port_saved_concurrently(self):
+        """test if a port that another create saved first is reported as used instead of failing the request"""
+        Server(name="first_server", description="First server", template="minetest", port=41200, sftp_port=41201,
+               max_cpu_usage=400, max_memory_usage=100000).save()
+        user = User.objects.create_user("user1", "user1@example.com", "5R64o!f84")
+        query = """
+mutation createServer($allowedUsers: [ID]!) {
+  createServer(name: "second_server", description: "Second server", template: "minetest", port: 41200,
+               sftpPort: 41202, allowedUsers: $allowedUsers, options: []) {
+    server {
+      serverId
+    }
+  }
+}
+        """
+        # the bitmap was built before the first server was saved
+        reservation = Reservation("token", [41200, 41202], "localhost", 0)
+        with mock.patch("api.schema.port_allocator.reserve", return_value=reservation), \
+                mock.patch("api.schema.provisioning_queue") as provisioning_queue:
+            response = Client(schema).execute(query, variable_values={"allowedUsers": [user.id]})
+
+        self.assertEqual(response["errors"][0]["message"], "server port is already in use")
+        provisioning_queue.submit.assert_not_called()
+        self.assertFalse(Server.objects.filter(name="second_server").exists())
@@ -0,0 +1,35 @@
+from unittest import mock
+
+from django.test import TestCase
+from docker.errors import NotFound
+
+from api.models import Server
+from api.producers import server_logs_producer
+
+
+class ServerLogsProducerTestCase(TestCase):
+    """Contains tests for the producer of the serverLogs subscription"""
+
+    def setUp(self) -> None:
+        """creates a server whose container does not exist yet"""
+        self.server = Server(name="unit_testing_server", description="Unit testing server", template="minetest",
+                             port=39900, sftp_port=39901, max_cpu_usage=400, max_memory_usage=100000)
+        self.server.save()
+        self.server.docker_client = mock.MagicMock()
+        self.server.docker_client.containers.get.side_effect = NotFound("no such container")
+
+    @mock.patch("api.models.container_index.lookup", return_value=(False, None))
+    def test_container_recreated_during_subscription(self, _lookup):
+        """test if the lines of a container created after subscribing are published"""
+        produce = server_logs_producer(self.server)
+        cursor, messages = produce(None)
+        self.assertEqual((cursor, messages), ("0", []))
+
+        container = mock.MagicMock(id="c2")
+        container.logs.return_value = b"2021-09-01T11:30:00Z Starting server\n"
+        self.server.docker_client.containers.get.side_effect = None
+        self.server.docker_client.containers.get.return_value = container
+
+        cursor, messages = produce(cursor)
+        self.assertEqual([line.content for line in messages[0]], ["Starting server"])
+        self.assertEqual(cursor, str(1630495800 * 1_000_000_000))
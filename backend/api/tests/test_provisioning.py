@@ -0,0 +1,79 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from graphene.test import Client
+
+from api.models import ProvisioningJob, Server
+from api.provisioning import ProvisioningQueue
+from api.schema import schema
+
+
+class ProvisioningTestCase(TestCase):
+    """Contains tests for provisioning servers in the background"""
+
+    def setUp(self) -> None:
+        """creates a server with a queued job and mocks the provisioning steps"""
+        self.user1 = User.objects.create_user("user1", "user1@example.com", "5R64o!f84")
+        self.user2 = User.objects.create_user("user2", "user2@example.com", "bD4hD-54f")
+        self.server = Server(name="unit_testing_server", description="Unit testing server", template="minetest",
+                             port=39999, sftp_port=39998, max_cpu_usage=400, max_memory_usage=100000)
+        self.server.save()
+        self.server.allowed_users.set([self.user1])
+        self.job = ProvisioningJob.objects.create(server=self.server)
+        self.queue = ProvisioningQueue(workers=1, health_timeout=1)
+
+        self.steps = {}
+        for step in ("render", "pull", "up", "wait_until_healthy"):
+            patcher = mock.patch.object(Server, step)
+            self.steps[step] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_successful_job(self):
+        """test if all phases run in order and are timed"""
+        self.queue.run(self.job.job_id, {"mc_version": "1.17"})
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ProvisioningJob.STATUS_SUCCEEDED)
+        self.assertEqual(self.job.phase, "healthy")
+        self.assertEqual(list(self.job.phase_timings), list(ProvisioningJob.PHASES))
+        for timing in self.job.phase_timings.values():
+            self.assertGreaterEqual(timing["finished_at"], timing["started_at"])
+        self.steps["render"].assert_called_once_with({"mc_version": "1.17"})
+        self.assertIsNotNone(self.job.finished_at)
+
+    def test_failed_job(self):
+        """test if a failing phase stops the job and stores the error"""
+        self.steps["pull"].side_effect = RuntimeError("docker-compose pull failed: manifest unknown")
+        self.queue.run(self.job.job_id, {})
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ProvisioningJob.STATUS_FAILED)
+        self.assertEqual(self.job.phase, "pull")
+        self.assertEqual(self.job.error, "docker-compose pull failed: manifest unknown")
+        self.steps["up"].assert_not_called()
+
+    def test_query_job_progress(self):
+        """test if allowed users can follow the progress of a job"""
+        self.queue.run(self.job.job_id, {})
+        query = """
+query provisioningJob($jobId: String!) {
+  provisioningJob(jobId: $jobId) {
+    status
+    phases {
+      name
+      duration
+    }
+  }
+}
+        """
+        request = RequestFactory().get("/api/graphql")
+        request.user = self.user1
+        response = Client(schema).execute(query, variable_values={"jobId": self.job.job_id}, context_value=request)
+        self.assertEqual(response["data"]["provisioningJob"]["status"], "SUCCEEDED")
+        self.assertEqual([phase["name"] for phase in response["data"]["provisioningJob"]["phases"]],
+                         list(ProvisioningJob.PHASES))
+
+        request.user = self.user2
+        response = Client(schema).execute(query, variable_values={"jobId": self.job.job_id}, context_value=request)
+        self.assertEqual(response["errors"][0]["message"], "you are not allowed to manage this server")
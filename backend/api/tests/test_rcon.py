@@ -0,0 +1,171 @@
+import socket
+import socketserver
+import struct
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.models import Server
+from api.rcon import RconClient, RconError, RconSentError
+
+PASSWORD = "unittest"
+
+
+def pack(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body.encode() + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+class FakeRconHandler(socketserver.BaseRequestHandler):
+    """Answers like a minecraft server: auth, then echoes every command.
+
+    "long" is answered with several packets, "hang" and "disconnect" are never answered.
+    """
+
+    def handle(self):
+        self.server.connections += 1
+        hung = False
+        while True:
+            header = self.request.recv(4)
+            if not header:
+                return
+            size, = struct.unpack("<i", header)
+            data = b""
+            while len(data) < size:
+                data += self.request.recv(size - len(data))
+            request_id, packet_type = struct.unpack("<ii", data[:8])
+            body = data[8:-2].decode()
+            if packet_type == 3:
+                self.request.sendall(pack(request_id if body == PASSWORD else -1, 2, ""))
+                continue
+            if packet_type == 2:
+                self.server.commands.append(body)
+                hung = hung or body == "hang"
+            if hung:
+                continue
+            if packet_type == 0:  # minecraft answers packets of unknown type in order, clients use it as end marker
+                self.request.sendall(pack(request_id, 0, "Unknown request 0"))
+            elif body == "disconnect":
+                return
+            elif body == "long":
+                self.request.sendall(pack(request_id, 0, "a" * 4096) + pack(request_id, 0, "b" * 10))
+            else:
+                self.request.sendall(pack(request_id, 0, f"ran {body}"))
+
+
+class RconClientTestCase(SimpleTestCase):
+    """Contains tests for the pooled RCON client"""
+
+    def setUp(self) -> None:
+        """starts a fake RCON server on a random port"""
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRconHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.commands = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_commands_share_one_connection(self):
+        """test if several commands are sent over the same authenticated connection"""
+        client = RconClient("127.0.0.1", self.port, PASSWORD, timeout=2)
+        self.assertEqual(client.command("list"), "ran list")
+        self.assertEqual(client.command("say hi"), "ran say hi")
+        self.assertEqual(self.server.connections, 1)
+        client.close()
+
+    def test_reconnect_after_connection_loss(self):
+        """test if the client reconnects when the server closed the connection"""
+        client = RconClient("127.0.0.1", self.port, PASSWORD, timeout=2)
+        client.command("list")
+        self.assertRaises(RconError, client.command, "disconnect")
+        self.assertEqual(client.command("list"), "ran list")
+        client.close()
+
+    def test_response_over_several_packets(self):
+        """test if a response split into several packets is read completely"""
+        client = RconClient("127.0.0.1", self.port, PASSWORD, timeout=2)
+        self.assertEqual(client.command("long"), "a" * 4096 + "b" * 10)
+        self.assertEqual(client.command("list"), "ran list")
+        client.close()
+
+    def test_sent_command_is_not_retried(self):
+        """test if a command whose response was lost is not sent again"""
+        client = RconClient("127.0.0.1", self.port, PASSWORD, timeout=0.5)
+        self.assertRaises(RconSentError, client.command, "hang")
+        self.assertEqual(self.server.commands, ["hang"])
+        client.close()
+
+    def test_unreachable_server_is_skipped(self):
+        """test if commands fail right away for a while after the server could not be reached"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = RconClient("127.0.0.1", port, PASSWORD, timeout=1, retry_interval=60)
+        self.assertRaises(RconError, client.command, "list")
+        with mock.patch("api.rcon.socket.create_connection") as create_connection:
+            self.assertRaisesMessage(RconError, "unreachable", client.command, "list")
+        create_connection.assert_not_called()
+
+    def test_wrong_password(self):
+        """test if a rejected password raises an error"""
+        client = RconClient("127.0.0.1", self.port, "wrong", timeout=2)
+        self.assertRaisesMessage(RconError, "wrong rcon password", client.command, "list")
+
+    def test_unreachable_server(self):
+        """test if an unreachable server raises an error"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = RconClient("127.0.0.1", port, PASSWORD, timeout=1)
+        self.assertRaises(RconError, client.command, "list")
+
+
+class ExecCommandTestCase(SimpleTestCase):
+    """Contains tests for running console commands over RCON"""
+
+    def setUp(self):
+        self.container = mock.MagicMock(id="c1")
+        self.server = Server(name="sample", template="mc_forge", rcon_password="secret")
+        self.server.container = self.container
+        self.server.container_available = True
+        self.server.docker_client = mock.MagicMock()
+        self.client = mock.MagicMock()
+        patcher = mock.patch("api.models.rcon_pool", SimpleNamespace(get=mock.MagicMock(return_value=self.client)))
+        self.rcon_pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.template = SimpleNamespace(config={"rcon": {"host": "{name}_main_1", "port": 25575}})
+        registry = mock.patch("api.models.template_registry", SimpleNamespace(get=lambda name: self.template))
+        registry.start()
+        self.addCleanup(registry.stop)
+
+    def test_lost_response_does_not_fall_back(self):
+        """test if a command that was sent over rcon is not run again with docker exec"""
+        self.client.command.side_effect = RconSentError("timed out")
+        self.assertRaises(RconSentError, self.server.exec_command, "give Steve diamond")
+        self.container.exec_run.assert_not_called()
+
+    def test_unsent_command_falls_back(self):
+        """test if a command that could not be sent over rcon runs with docker exec"""
+        self.client.command.side_effect = RconError("refused")
+        self.container.exec_run.return_value = SimpleNamespace(exit_code=0, output=b"done")
+        self.assertEqual(self.server.exec_command("list"), (0, "done"))
+
+    def test_host_is_formatted_with_server_name(self):
+        """test if rcon connects to the configured host with the server name filled in"""
+        self.client.command.return_value = "ok"
+        self.assertEqual(self.server.exec_command("list"), (0, "ok"))
+        self.assertEqual(self.rcon_pool.get.call_args.args[1:3], ("sample_main_1", 25575))
+        self.container.exec_run.assert_not_called()
+
+    def test_rcon_without_host_uses_docker_exec(self):
+        """test if a template without an rcon host runs commands with docker exec"""
+        self.template.config = {"rcon": {"port": 25575}}
+        self.container.exec_run.return_value = SimpleNamespace(exit_code=0, output=b"done")
+        self.assertEqual(self.server.exec_command("list"), (0, "done"))
+        self.rcon_pool.get.assert_not_called()
@@ -0,0 +1,84 @@
+import gzip
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from api.log_index import LogIndexer
+from api.logs import LogLine
+from api.models import Server
+from api.views import chunk_log_lines, export_log_lines
+
+SECOND = 1_000_000_000
+
+
+class ServerLogsViewTestCase(TestCase):
+    """Contains tests for the streaming log export"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        indexer = LogIndexer(directory.name, segment_seconds=60, interval=5)
+        patcher = mock.patch("api.views.log_indexer", indexer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.server = Server(name="logs_test_server", description="Logs test server", template="minetest",
+                             port=39999, sftp_port=39998, max_cpu_usage=400, max_memory_usage=100000)
+        self.server.save()
+        indexer.get(self.server.server_id).append([
+            (10 * SECOND, "Steve joined the game"),
+            (70 * SECOND, "Alex joined the game"),
+            (130 * SECOND + 5, "Steve left the game"),
+        ])
+        indexer.get(self.server.server_id).seal_complete(now=150)
+        self.url = f"/api/servers/{self.server.server_id}/logs.txt"
+
+        self.user = User.objects.create_user("user1", "user1@example.com", "5R64o!f84")
+        self.client.force_login(self.user)
+
+    def test_forbidden_without_permission(self):
+        """test if users that can not manage the server get no logs"""
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_streams_time_range(self):
+        """test if the lines between `since` and `until` are streamed, oldest first"""
+        self.server.allowed_users.set([self.user])
+        response = self.client.get(self.url, {"since": 60, "until": 200})
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content).decode(),
+                         "1970-01-01T00:01:10.000000000Z Alex joined the game\n"
+                         "1970-01-01T00:02:10.000000005Z Steve left the game\n")
+
+    def test_gzip(self):
+        """test if the logs are compressed for clients that accept gzip"""
+        self.server.allowed_users.set([self.user])
+        response = self.client.get(self.url, {"until": 200}, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)).count(b"\n"), 3)
+
+    def test_invalid_timestamp(self):
+        """test if a malformed timestamp is rejected"""
+        self.server.allowed_users.set([self.user])
+        self.assertEqual(self.client.get(self.url, {"since": "yesterday"}).status_code, 400)
+
+    def test_infinite_timestamp(self):
+        """test if infinite and nan timestamps are rejected instead of failing the request"""
+        self.server.allowed_users.set([self.user])
+        for params in ({"since": "inf"}, {"until": "-inf"}, {"since": "nan"}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_chunk_log_lines(self):
+        """test if lines are joined into chunks of at least the given size"""
+        chunks = list(chunk_log_lines([LogLine(str(i * SECOND), i, "x" * 10, "log") for i in range(5)], 80))
+        self.assertEqual([chunk.count(b"\n") for chunk in chunks], [2, 2, 1])
+
+    def test_large_export_spills_to_disk(self):
+        """test if an export larger than the memory limit is buffered in a temporary file"""
+        lines = [LogLine(str(i * SECOND), i, "x" * 100, "log") for i in range(100)]
+        with mock.patch("api.views.LOG_EXPORT_MEMORY_LIMIT", 1024), mock.patch("api.views.LOG_CHUNK_SIZE", 512):
+            export = export_log_lines(lines, compress=False)
+        self.addCleanup(export.close)
+        self.assertTrue(export._rolled)
+        self.assertEqual(export.read().count(b"\n"), 100)
@@ -0,0 +1,52 @@
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+from prometheus_client import CollectorRegistry, generate_latest
+
+from api.collector import StatsCollector, StatsReading
+from api.exporter import ServerMetricsExporter
+from api.models import Server
+
+
+class ServerMetricsExporterTestCase(SimpleTestCase):
+    """Contains tests for the per-server prometheus metrics"""
+
+    def setUp(self):
+        self.server = Server(server_id="abcdef", name="sample", template="minetest", host="node2",
+                             max_cpu_usage=400, max_memory_usage=512)
+        self.collector = StatsCollector(interval=5, workers=1)
+        self.registry = CollectorRegistry()
+        self.registry.register(ServerMetricsExporter(lambda: self.collector))
+
+    def test_exports_cached_reading(self):
+        """test if the latest reading is exported with the server labels"""
+        self.collector._servers = [self.server]
+        self.collector._readings["abcdef"] = StatsReading(0.5, 1024, time.time(), running=True, cpu_seconds=12.5,
+                                                          network_rx_bytes=300)
+
+        labels = {"server_id": "abcdef", "name": "sample", "template": "minetest", "host": "node2"}
+        self.assertEqual(self.registry.get_sample_value("containerpanel_server_running", labels), 1)
+        self.assertEqual(self.registry.get_sample_value("containerpanel_server_cpu_seconds_total", labels), 12.5)
+        self.assertEqual(self.registry.get_sample_value("containerpanel_server_memory_usage_bytes", labels), 1024)
+        self.assertEqual(self.registry.get_sample_value("containerpanel_server_memory_limit_bytes", labels),
+                         512 * 1024 * 1024)
+        self.assertEqual(self.registry.get_sample_value("containerpanel_server_network_receive_bytes_total",
+                                                        labels), 300)
+
+    def test_stopped_server_has_no_counters(self):
+        """test if the counters of a stopped server are left out instead of dropping to 0"""
+        self.collector._servers = [self.server]
+        self.collector._readings["abcdef"] = StatsReading(0, 0, time.time())
+
+        labels = {"server_id": "abcdef", "name": "sample", "template": "minetest", "host": "node2"}
+        self.assertEqual(self.registry.get_sample_value("containerpanel_server_running", labels), 0)
+        for counter in ("cpu_seconds", "restarts", "network_receive_bytes", "block_write_bytes"):
+            self.assertIsNone(self.registry.get_sample_value(f"containerpanel_server_{counter}_total", labels))
+
+    def test_scrape_does_not_touch_docker(self):
+        """test if a scrape only reads the cache"""
+        self.collector._servers = [self.server]
+        with mock.patch.object(Server, "usage", new_callable=mock.PropertyMock) as usage:
+            generate_latest(self.registry)
+        usage.assert_not_called()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import time
+
+from unittest import mock
+
+from django.test import TestCase
+
+from api.collector import StatsCollector, StatsReading
+from api.shared_state import SharedStateReader, SharedStateWriter
+
+
+class SharedStateTestCase(TestCase):
+    """Contains tests for the readings shared between processes"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "state")
+        self.writer = SharedStateWriter(self.path, slots=4)
+        self.addCleanup(self.writer.close)
+        self.reader = SharedStateReader(self.path)
+
+    def test_missing_file_has_no_readings(self):
+        """test if a reader without a collector process returns no readings"""
+        reader = SharedStateReader(self.path + ".missing")
+        self.assertIsNone(reader.get("abcdef"))
+        self.assertEqual(reader.readings(), {})
+
+    def test_reader_sees_written_reading(self):
+        """test if a reading written by the collector can be read back by a worker"""
+        reading = StatsReading(0.5, 1024, 1600000000.5, running=True, cpu_seconds=3.5, restart_count=2,
+                               network_rx_bytes=10, network_tx_bytes=20, block_read_bytes=30, block_write_bytes=40)
+        self.writer.write("abcdef", reading)
+
+        self.assertEqual(self.reader.get("abcdef"), reading)
+        self.assertEqual(self.reader.readings(), {"abcdef": reading})
+
+    def test_updates_are_visible_to_open_readers(self):
+        """test if a reader that already mapped the file sees later writes and removals"""
+        self.writer.write("abcdef", StatsReading(0.5, 1024, 1))
+        self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.5)
+
+        self.writer.write("abcdef", StatsReading(0.75, 1024, 2))
+        self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.75)
+
+        self.writer.remove("abcdef")
+        self.assertEqual(self.reader.readings(), {})
+
+    def test_slots_are_reused(self):
+        """test if the slot of a removed server is given to the next one"""
+        for server_id in ["a", "b", "c", "d"]:
+            self.writer.write(server_id, StatsReading(0, 0, 0))
+        with self.assertRaises(OverflowError):
+            self.writer.write("e", StatsReading(0, 0, 0))
+
+        self.writer.remove("b")
+        self.writer.write("e", StatsReading(0.25, 0, 0))
+        self.assertEqual(self.reader.get("e").cpu_usage, 0.25)
+
+    def test_collector_writes_to_sink(self):
+        """test if the collector hands its readings to the shared state"""
+        collector = StatsCollector(interval=5, workers=1, sink=self.writer)
+        collector._store("abcdef", StatsReading(0.5, 1024, 1))
+        self.assertEqual(self.reader.get("abcdef").memory_usage, 1024)
+
+    def test_sidecar_readings_are_shared(self):
+        """test if readings of sidecar services are shared under their own key"""
+        self.writer.write("abcdef/sftp", StatsReading(0.5, 64, 1, running=True, network_tx_rate=100))
+        self.assertEqual(self.reader.get("abcdef", "sftp").network_tx_rate, 100)
+        self.assertIsNone(self.reader.get("abcdef"))
+
+    def test_restart_keeps_file_and_readings(self):
+        """test if a restarted collector with fewer slots reuses the file without shrinking it or dropping readings"""
+        self.writer.write("abcdef", StatsReading(0.5, 1024, 1))
+        self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.5)
+        size = os.path.getsize(self.path)
+
+        restarted = SharedStateWriter(self.path, slots=2)
+        self.addCleanup(restarted.close)
+        self.assertEqual((restarted.slots, os.path.getsize(self.path)), (4, size))
+        self.assertEqual(restarted.keys(), ["abcdef"])
+        restarted.write("abcdef", StatsReading(0.75, 1024, 2))
+        self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.75)
+
+    def test_larger_file_replaces_mapped_one(self):
+        """test if a collector needing more slots replaces the file and readers switch to the new one"""
+        self.writer.write("abcdef", StatsReading(0.5, 1024, 1))
+        self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.5)
+
+        restarted = SharedStateWriter(self.path, slots=8)
+        self.addCleanup(restarted.close)
+        restarted.write("abcdef", StatsReading(0.75, 1024, 2))
+        self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.5)  # the old mapping stays readable
+        with mock.patch("api.shared_state.time.monotonic", return_value=time.monotonic() + 2):
+            self.assertEqual(self.reader.get("abcdef").cpu_usage, 0.75)
+
+    def test_collector_removes_readings_of_previous_process(self):
+        """test if readings adopted from a previous collector are removed once their server is gone"""
+        self.writer.write("deleted", StatsReading(0.5, 1024, 1))
+        collector = StatsCollector(interval=5, workers=1, sink=SharedStateWriter(self.path, slots=4))
+        self.addCleanup(collector.sink.close)
+        collector.sample_all()
+        self.assertEqual(self.reader.readings(), {})
@@ -0,0 +1,97 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.collector import StatsReading
+from api.stats_backends import AutoBackend, CgroupBackend, RestartCounts
+
+
+class CgroupBackendTestCase(SimpleTestCase):
+    """Contains tests for reading container usage from cgroup v2 files"""
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.cgroup = os.path.join(self.root.name, "sys", "system.slice", "docker-c1.scope")
+        os.makedirs(self.cgroup)
+        self.write("cpu.stat", "usage_usec 2000000\nuser_usec 1500000\nsystem_usec 500000\n")
+        self.write("memory.current", "4096\n")
+        self.write("io.stat", "8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1 wbytes=2 rios=1 wios=1\n")
+        self.write("cgroup.procs", "42\n")
+        os.makedirs(os.path.join(self.root.name, "proc", "42", "net"))
+        with open(os.path.join(self.root.name, "proc", "42", "net", "dev"), "w") as file:
+            file.write("Inter-|   Receive |  Transmit\n face |bytes packets|bytes packets\n"
+                       "    lo: 999 1 0 0 0 0 0 0 999 1 0 0 0 0 0 0\n"
+                       "  eth0: 300 3 0 0 0 0 0 0 700 7 0 0 0 0 0 0\n")
+        self.backend = CgroupBackend(os.path.join(self.root.name, "sys"), os.path.join(self.root.name, "proc"))
+        self.container = SimpleNamespace(id="c1", attrs={"RestartCount": 2})
+
+    def write(self, name, content):
+        with open(os.path.join(self.cgroup, name), "w") as file:
+            file.write(content)
+
+    def test_reads_counters(self):
+        """test if memory, cpu time, block io and network counters are read"""
+        reading = self.backend.read(self.container)
+        self.assertEqual(reading.memory_usage, 4096)
+        self.assertEqual(reading.cpu_seconds, 2.0)
+        self.assertEqual((reading.block_read_bytes, reading.block_write_bytes), (101, 202))
+        self.assertEqual((reading.network_rx_bytes, reading.network_tx_bytes), (300, 700))
+        self.assertEqual(reading.restart_count, 2)
+
+    def test_cpu_usage_from_delta(self):
+        """test if the cpu usage is the cpu time used between two readings divided by the elapsed time"""
+        with mock.patch("api.stats_backends.time.monotonic", side_effect=[100.0, 102.0]):
+            self.assertEqual(self.backend.read(self.container).cpu_usage, 0)
+            self.write("cpu.stat", "usage_usec 3000000\n")
+            self.assertEqual(self.backend.read(self.container).cpu_usage, 0.5)
+
+    def test_auto_falls_back_to_docker(self):
+        """test if containers without a reachable cgroup are read with the docker api"""
+        docker = mock.MagicMock()
+        docker.read.return_value = StatsReading(0.1, 1, 0)
+        backend = AutoBackend(self.backend, docker)
+
+        backend.read(SimpleNamespace(id="other", attrs={}))
+        docker.read.assert_called_once()
+        backend.read(self.container)
+        docker.read.assert_called_once()
+
+    def test_invisible_network_falls_back_to_docker(self):
+        """test if containers whose network counters are not visible are read with the docker api instead of 0"""
+        self.write("cgroup.procs", "0\n")
+        with self.assertRaises(FileNotFoundError):
+            self.backend.read(self.container)
+
+        docker = mock.MagicMock()
+        docker.read.return_value = StatsReading(0.1, 1, 0)
+        self.assertIs(AutoBackend(self.backend, docker).read(self.container), docker.read.return_value)
+
+
+class RestartCountsTestCase(SimpleTestCase):
+    """Contains tests for caching the restart count of containers"""
+
+    def test_indexed_container_is_inspected_once(self):
+        """test if containers without a restart count are inspected once and then read from the cache"""
+        container = mock.MagicMock(id="c1", attrs={})
+        container.reload.side_effect = lambda: container.attrs.update(RestartCount=3)
+        counts = RestartCounts(60)
+
+        self.assertEqual(counts.get(container), 3)
+        self.assertEqual(counts.get(mock.MagicMock(id="c1", attrs={})), 3)
+        container.reload.assert_called_once()
+
+    def test_cache_expires(self):
+        """test if the restart count is inspected again once it is older than max_age"""
+        container = mock.MagicMock(id="c1", attrs={})
+        container.reload.side_effect = lambda: container.attrs.update(RestartCount=container.reload.call_count)
+        counts = RestartCounts(60)
+
+        with mock.patch("api.stats_backends.time.monotonic", side_effect=[0.0, 30.0, 61.0, 61.0]):
+            self.assertEqual(counts.get(container), 1)
+            container.attrs.clear()
+            self.assertEqual(counts.get(container), 1)
+            self.assertEqual(counts.get(container), 2)
@@ -0,0 +1,94 @@
+import time
+
+from django.test import TestCase
+
+from api.collector import StatsCollector, StatsReading, parse_container_stats, with_rates
+from api.models import Server
+
+
+class FakeStatsServer:
+    """Stands in for a `Server` whose container returns fixed stats."""
+
+    def __init__(self, server_id, cpu_usage, memory_usage):
+        self.server_id = server_id
+        self.name = server_id
+        self.cpu_usage = cpu_usage
+        self.memory_usage = memory_usage
+
+    @property
+    def usage(self):
+        return StatsReading(self.cpu_usage, self.memory_usage, time.time(), running=True)
+
+    def service_usage(self, service):
+        return StatsReading(0.01, 64, time.time(), running=True)
+
+
+class StatsCollectorTestCase(TestCase):
+    """Contains tests for the background stats collector"""
+
+    def test_get_returns_none_before_first_sample(self):
+        """test if an unknown server has no reading"""
+        collector = StatsCollector(interval=5, workers=1)
+        self.assertIsNone(collector.get("abcdef"))
+
+    def test_sample_server_stores_reading(self):
+        """test if a sampled reading can be read back with its timestamp"""
+        collector = StatsCollector(interval=5, workers=1)
+        before = time.time()
+        collector.sample_server(FakeStatsServer("abcdef", 0.5, 1024))
+
+        reading = collector.get("abcdef")
+        self.assertEqual(reading.cpu_usage, 0.5)
+        self.assertEqual(reading.memory_usage, 1024)
+        self.assertGreaterEqual(reading.sampled_at, before)
+        self.assertGreaterEqual(reading.age, 0)
+
+    def test_sample_all_drops_deleted_servers(self):
+        """test if readings of servers that no longer exist are removed"""
+        collector = StatsCollector(interval=5, workers=1)
+        collector.sample_server(FakeStatsServer("deleted", 0.5, 1024))
+        self.assertEqual(Server.objects.count(), 0)
+
+        collector.sample_all()
+        self.assertIsNone(collector.get("deleted"))
+
+    def test_parse_container_stats(self):
+        """test if cpu, memory, network and block io are read from a docker stats response"""
+        stats = {
+            "cpu_stats": {"cpu_usage": {"total_usage": 3_000_000_000}, "system_cpu_usage": 2000, "online_cpus": 2},
+            "precpu_stats": {"cpu_usage": {"total_usage": 2_999_999_500}, "system_cpu_usage": 1000},
+            "memory_stats": {"usage": 4096},
+            "networks": {"eth0": {"rx_bytes": 10, "tx_bytes": 20}, "eth1": {"rx_bytes": 1, "tx_bytes": 2}},
+            "blkio_stats": {"io_service_bytes_recursive": [{"op": "read", "value": 100},
+                                                           {"op": "Write", "value": 200}]}
+        }
+
+        reading = parse_container_stats(stats, restart_count=3)
+        self.assertEqual(reading.cpu_usage, 1.0)
+        self.assertEqual(reading.cpu_seconds, 3.0)
+        self.assertEqual(reading.memory_usage, 4096)
+        self.assertEqual((reading.network_rx_bytes, reading.network_tx_bytes), (11, 22))
+        self.assertEqual((reading.block_read_bytes, reading.block_write_bytes), (100, 200))
+        self.assertEqual(reading.restart_count, 3)
+        self.assertTrue(reading.running)
+
+    def test_rates_from_counter_deltas(self):
+        """test if io rates are the counter differences divided by the time between two readings"""
+        previous = StatsReading(0, 0, 100.0, running=True, network_rx_bytes=1000, block_write_bytes=5000)
+        current = StatsReading(0, 0, 102.0, running=True, network_rx_bytes=3000, block_write_bytes=4000)
+
+        reading = with_rates(previous, current)
+        self.assertEqual(reading.network_rx_rate, 1000)
+        self.assertEqual(reading.block_write_rate, 0)  # the counter was reset by a restart
+        self.assertEqual(with_rates(None, current).network_rx_rate, 0)
+
+    def test_sidecars_are_sampled_separately(self):
+        """test if the sidecar services get their own readings"""
+        collector = StatsCollector(interval=5, workers=1, sidecars=["sftp"])
+        collector.sample_server(FakeStatsServer("abcdef", 0.5, 1024))
+
+        self.assertEqual(collector.get("abcdef").memory_usage, 1024)
+        self.assertEqual(collector.get("abcdef", "sftp").memory_usage, 64)
+
+        collector.forget("abcdef")
+        self.assertIsNone(collector.get("abcdef", "sftp"))
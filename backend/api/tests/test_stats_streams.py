@@ -0,0 +1,82 @@
+import threading
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from api.stats_streams import StatsStreamPool
+
+
+def make_sample(total_usage, system_usage, previous_total, previous_system, read="2021-01-01T00:00:00Z"):
+    return {"read": read,
+            "cpu_stats": {"cpu_usage": {"total_usage": total_usage}, "system_cpu_usage": system_usage,
+                          "online_cpus": 1},
+            "precpu_stats": {"cpu_usage": {"total_usage": previous_total}, "system_cpu_usage": previous_system},
+            "memory_stats": {"usage": 1024}}
+
+
+class FakeStreamingServer:
+    """Stands in for a `Server` whose container streams the given samples and then blocks until released."""
+
+    def __init__(self, server_id, samples):
+        self.server_id = server_id
+        self.name = server_id
+        self.container_available = True
+        self.release = threading.Event()
+        # like a container from the `api.events` index, the restart count is only known after an inspect
+        self.container = SimpleNamespace(attrs={}, stats=lambda stream, decode: self._stream(samples),
+                                         reload=lambda: self.container.attrs.update(RestartCount=2))
+
+    def load_container(self):
+        pass
+
+    def _stream(self, samples):
+        yield from samples
+        self.release.wait(5)
+        yield make_sample(0, 0, 0, 0, read="0001-01-01T00:00:00Z")
+
+
+class StatsStreamPoolTestCase(SimpleTestCase):
+    """Contains tests for the long-lived stats streams"""
+
+    def setUp(self):
+        self.readings = {}
+        self.sampled = threading.Event()
+        self.pool = StatsStreamPool(self.on_sample)
+
+    def on_sample(self, server_id, reading):
+        self.readings[server_id] = reading
+        self.sampled.set()
+
+    def test_samples_update_readings(self):
+        """test if streamed samples become readings, skipping the first sample without a previous one"""
+        server = FakeStreamingServer("abcdef", [make_sample(100, 1000, 0, 0), make_sample(150, 1100, 100, 1000)])
+        self.pool.sync([server])
+
+        self.assertTrue(self.sampled.wait(5))
+        self.assertEqual(self.readings["abcdef"].cpu_usage, 0.5)
+        self.assertEqual(self.readings["abcdef"].restart_count, 2)
+        self.assertEqual(self.pool.streaming(), {"abcdef"})
+        server.release.set()
+
+    def test_stream_ends_when_container_stops(self):
+        """test if a stream closes itself on the samples of a stopped container"""
+        server = FakeStreamingServer("abcdef", [])
+        self.pool.sync([server])
+        stream = self.pool._streams["abcdef"]
+
+        server.release.set()
+        stream.thread.join(5)
+        self.assertFalse(stream.thread.is_alive())
+        self.assertEqual(self.pool.streaming(), set())
+
+    def test_sync_stops_streams_of_stopped_servers(self):
+        """test if servers missing from sync lose their stream"""
+        server = FakeStreamingServer("abcdef", [])
+        self.pool.sync([server])
+        stream = self.pool._streams["abcdef"]
+
+        self.pool.sync([])
+        server.release.set()
+        stream.thread.join(5)
+        self.assertFalse(stream.thread.is_alive())
+        self.assertEqual(self.pool.streaming(), set())
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+from django.template import Context
+from django.test import TestCase
+
+from api.app_templates import TemplateRegistry
+
+TEMPLATE = """version: "2"
+name: "{title}"
+description: "Unit testing template"
+command_prefix: "rcon-cli "
+
+options:
+  - key: mc_version
+    value: "1.17"
+    description: "The Minecraft version to use."
+
+compose_config:
+  services:
+    main:
+      ports:
+        - "{{{{port}}}}:25565"
+"""
+
+
+class TemplateRegistryTestCase(TestCase):
+    """Contains tests for the app template cache"""
+
+    def setUp(self) -> None:
+        """creates a directory with a single template"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "unittest.yml")
+        self.write_template("Unit testing")
+        self.registry = TemplateRegistry(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write_template(self, title: str):
+        with open(self.path, "w") as file:
+            file.write(TEMPLATE.format(title=title))
+
+    def test_template_is_parsed(self):
+        """test if metadata, options and the compiled template are available"""
+        template = self.registry.get("unittest")
+        self.assertEqual(template.title, "Unit testing")
+        self.assertEqual(template.command_prefix, "rcon-cli ")
+        self.assertEqual(template.options[0]["key"], "mc_version")
+        self.assertIn("25565:25565", template.compiled.render(Context({"port": 25565})))
+
+    def test_template_is_cached(self):
+        """test if an unchanged template is not parsed again"""
+        self.assertIs(self.registry.get("unittest"), self.registry.get("unittest"))
+
+    def test_changed_template_is_reloaded(self):
+        """test if a template is parsed again after the file changed"""
+        first = self.registry.get("unittest")
+        self.write_template("Changed title")
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        self.assertEqual(self.registry.get("unittest").title, "Changed title")
+        self.assertIsNot(self.registry.get("unittest"), first)
+
+    def test_all_templates(self):
+        """test if all templates of the directory are listed"""
+        self.assertEqual([template.name for template in self.registry.all()], ["unittest"])
+
+    def test_missing_template(self):
+        """test if unknown or invalid template names raise an error"""
+        self.assertRaises(FileNotFoundError, self.registry.get, "does_not_exist")
+        self.assertRaises(FileNotFoundError, self.registry.get, "../unittest")
@@ -3,11 +3,18 @@ This file maps URL patterns to view functions to handle them.
 Graphql views are not injected here.
 """
 
+from django.conf import settings
 from django.urls import path
 
 from . import views
+from .executors import docker_executor, offload_view
+
+server_logs_view = views.server_logs
+if settings.ASGI_SERVER:  # reading the archive blocks, see api/executors.py
+    server_logs_view = offload_view(server_logs_view, docker_executor)
 
 urlpatterns = [
     path('is_authenticated', views.is_authenticated, name='is_authenticated'),
-    path('username', views.get_username, name='username')
+    path('username', views.get_username, name='username'),
+    path('servers/<str:server_id>/logs.txt', server_logs_view, name='server_logs'),
 ]
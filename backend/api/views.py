@@ -1,6 +1,23 @@
-from django.http import JsonResponse, HttpResponse
+import gzip
+import re
+import tempfile
+import time
+from typing import IO, Iterable, Iterator
+
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, FileResponse
+from django.utils.cache import patch_vary_headers
 from channels.http import AsgiRequest
 
+from api.log_index import log_indexer
+from api.logs import LogLine, format_docker_timestamp
+from api.models import Server
+
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+# lines are written and sent in chunks of about this many bytes
+LOG_CHUNK_SIZE = 64 * 1024
+# exports up to this size are buffered in memory, larger ones in a temporary file
+LOG_EXPORT_MEMORY_LIMIT = 4 * 1024 * 1024
+
 
 def is_authenticated(request: AsgiRequest) -> JsonResponse:
     """Checks if request is authenticated.
@@ -30,3 +47,78 @@ def get_username(request: AsgiRequest) -> HttpResponse:
     """
 
     return HttpResponse(request.user.username)
+
+
+class LogExportResponse(FileResponse):
+    block_size = LOG_CHUNK_SIZE
+
+
+def server_logs(request: AsgiRequest, server_id: str) -> HttpResponse:
+    """Sends the archived logs of a server as plain text, one "<timestamp> <content>" line per log line.
+
+    The lines are read from the log archive and written to a buffer in chunks before the response is sent,
+    so the event loop only sends the finished buffer, see `api.urls`. The buffer spills to a temporary file,
+    so the memory used does not depend on the size of the range. The logs are gzip compressed if the client
+    accepts it.
+
+    Args:
+        request (AsgiRequest): The incoming request, `since` and `until` are optional unix timestamps
+        server_id (str): ID of the server
+
+    Returns:
+        HttpResponse: the logs, 403 if the user can not manage the server or 400 for invalid timestamps
+    """
+
+    if not Server.objects.manageable_by(request.user).filter(pk=server_id).exists():
+        return HttpResponseForbidden("you are not allowed to manage this server")
+    try:
+        start_ns = int(float(request.GET.get("since", 0)) * 1_000_000_000)
+        end_ns = int(float(request.GET.get("until", time.time())) * 1_000_000_000)
+    except (ValueError, OverflowError):  # not a number, nan or inf
+        return HttpResponseBadRequest("since and until have to be unix timestamps")
+
+    compress = bool(ACCEPTS_GZIP.search(request.META.get("HTTP_ACCEPT_ENCODING", "")))
+    export = export_log_lines(log_indexer.get(server_id).read_range(start_ns, end_ns), compress)
+    response = LogExportResponse(export, content_type="text/plain; charset=utf-8", as_attachment=True,
+                                 filename=f"{server_id}-logs.txt")
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def export_log_lines(lines: Iterable[LogLine], compress: bool) -> IO[bytes]:
+    """Writes formatted log lines to a buffer in chunks of `LOG_CHUNK_SIZE` bytes.
+
+    Args:
+        lines (iterable): The lines to write
+        compress (bool): Whether the buffer is gzip compressed
+
+    Returns:
+        file: the buffer, positioned at its start
+    """
+
+    export = tempfile.SpooledTemporaryFile(max_size=LOG_EXPORT_MEMORY_LIMIT)
+    target = gzip.GzipFile(fileobj=export, mode="wb") if compress else export
+    for chunk in chunk_log_lines(lines, LOG_CHUNK_SIZE):
+        target.write(chunk)
+    if compress:
+        target.close()  # writes the gzip trailer, the buffer stays open
+    export.seek(0)
+    return export
+
+
+def chunk_log_lines(lines: Iterable[LogLine], size: int) -> Iterator[bytes]:
+    """Joins formatted log lines into chunks of at least `size` bytes, except for the last one."""
+
+    chunk = []
+    chunk_size = 0
+    for line in lines:
+        encoded = f"{format_docker_timestamp(int(line.cursor))} {line.content}\n".encode()
+        chunk.append(encoded)
+        chunk_size += len(encoded)
+        if chunk_size >= size:
+            yield b"".join(chunk)
+            chunk, chunk_size = [], 0
+    if chunk:
+        yield b"".join(chunk)
@@ -2,6 +2,7 @@
 ASGI config for containerpanel project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Http requests and the graphql subscription websockets are served by the same event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -9,17 +10,23 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from channels.routing import ProtocolTypeRouter, get_default_application, URLRouter
-from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'containerpanel.settings')
+# sets up django, the websocket consumer below needs the installed apps
+http_application = get_asgi_application()
 
-# os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'containerpanel.settings')
-#
-# application = ProtocolTypeRouter({
-#     "http": get_asgi_application(),
-#     "websocket": AuthMiddlewareStack(URLRouter([])),
-#     # Just HTTP for now. (We can add other protocols later.)
-# })
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from django.urls import path  # noqa: E402
+from graphql_ws.django.consumers import GraphQLSubscriptionConsumer  # noqa: E402
+from graphql_ws.django.routing import websocket_urlpatterns  # noqa: E402
 
-#application = get_default_application()
+application = ProtocolTypeRouter({
+    "http": http_application,
+    # the proxy only forwards /api/ to the backend
+    "websocket": AuthMiddlewareStack(URLRouter([
+        path("api/subscriptions", GraphQLSubscriptionConsumer.as_asgi()),
+        *websocket_urlpatterns,
+    ])),
+})
@@ -108,7 +108,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'containerpanel.wsgi.application'
-ASGI_APPLICATION = 'graphql_ws.django.routing.application'
+ASGI_APPLICATION = 'containerpanel.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
@@ -197,3 +197,87 @@ STATIC_ROOT = "./static-dist"
 SESSION_COOKIE_HTTPONLY = False
 
 SERVER_DEFAULT_HOST = os.environ["SERVER_DEFAULT_HOST"]
+
+# Background stats collector, see api/collector.py
+STATS_COLLECTOR_ENABLED = os.environ.get("STATS_COLLECTOR_ENABLED", "True") == "True"
+STATS_COLLECTOR_INTERVAL = float(os.environ.get("STATS_COLLECTOR_INTERVAL", 5))
+STATS_COLLECTOR_WORKERS = int(os.environ.get("STATS_COLLECTOR_WORKERS", 8))
+# "poll" samples every server each interval, "stream" keeps a stats stream per running container open
+STATS_COLLECTOR_MODE = os.environ.get("STATS_COLLECTOR_MODE", "poll")
+# compose services sampled next to "main" to report their usage separately
+STATS_SIDECAR_SERVICES = [service for service in os.environ.get("STATS_SIDECAR_SERVICES", "sftp").split(",") if service]
+
+# Docker clients, see api/docker_clients.py
+# DOCKER_HOSTS maps values of Server.host to docker daemon urls, ex.: "node2=tcp://10.0.0.2:2375,node3=ssh://root@node3"
+# Hosts that are not listed use the local daemon configured by DOCKER_HOST and friends.
+DOCKER_HOSTS = dict(entry.split("=", 1) for entry in os.environ.get("DOCKER_HOSTS", "").split(",") if entry)
+DOCKER_CLIENT_TIMEOUT = int(os.environ.get("DOCKER_CLIENT_TIMEOUT", 30))
+DOCKER_CLIENT_POOL_SIZE = int(os.environ.get("DOCKER_CLIENT_POOL_SIZE", 10))
+DOCKER_API_VERSION = os.environ.get("DOCKER_API_VERSION")  # None means: ask the daemon
+
+# Seconds a port handed out by allocatePorts stays reserved, see api/ports.py
+PORT_RESERVATION_TTL = float(os.environ.get("PORT_RESERVATION_TTL", 300))
+
+# Directory containing the app templates, see api/app_templates.py
+APP_TEMPLATES_DIR = BASE_DIR / "app_templates.v2"
+
+# Log buffers, see api/logs.py
+LOG_BUFFER_LINES = int(os.environ.get("LOG_BUFFER_LINES", 1000))
+LOG_REFRESH_INTERVAL = float(os.environ.get("LOG_REFRESH_INTERVAL", 0.5))
+
+# Seconds between two polls of the subscription producers, see api/pubsub.py
+SUBSCRIPTION_POLL_INTERVAL = float(os.environ.get("SUBSCRIPTION_POLL_INTERVAL", 1))
+
+# Background provisioning of new servers, see api/provisioning.py
+PROVISIONING_WORKERS = int(os.environ.get("PROVISIONING_WORKERS", 2))
+PROVISIONING_HEALTH_TIMEOUT = float(os.environ.get("PROVISIONING_HEALTH_TIMEOUT", 300))
+
+# Seconds to wait for RCON connections and responses, see api/rcon.py
+RCON_TIMEOUT = float(os.environ.get("RCON_TIMEOUT", 5))
+# Seconds commands skip RCON after it could not be reached, they run with docker exec meanwhile
+RCON_RETRY_INTERVAL = float(os.environ.get("RCON_RETRY_INTERVAL", 30))
+
+# Usage history, see api/metrics.py
+# METRICS_RESOLUTIONS lists "seconds per bucket:bucket count", the default keeps 1 s for 10 min, 1 min for 24 h
+# and 15 min for 30 d.
+METRICS_RESOLUTIONS = [tuple(int(part) for part in entry.split(":"))
+                       for entry in os.environ.get("METRICS_RESOLUTIONS", "1:600,60:1440,900:2880").split(",")]
+# The history is only persisted by `manage.py run_collector`, without SHARED_STATE_PATH it is kept in memory.
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 60))
+
+# Export per-server container metrics next to the django_prometheus metrics, see api/exporter.py
+PROMETHEUS_SERVER_METRICS_ENABLED = os.environ.get("PROMETHEUS_SERVER_METRICS_ENABLED", "True") == "True"
+
+# Index of container states fed by the docker events stream, see api/events.py
+DOCKER_EVENTS_ENABLED = os.environ.get("DOCKER_EVENTS_ENABLED", "True") == "True"
+DOCKER_EVENTS_RECONNECT_INTERVAL = float(os.environ.get("DOCKER_EVENTS_RECONNECT_INTERVAL", 5))
+
+# Backend reading the usage of containers: "auto", "cgroup" or "docker", see api/stats_backends.py
+# The cgroup backend needs the cgroup v2 hierarchy (and for network counters /proc) of the docker host.
+STATS_BACKEND = os.environ.get("STATS_BACKEND", "auto")
+CGROUP_ROOT = os.environ.get("CGROUP_ROOT", "/sys/fs/cgroup")
+PROC_ROOT = os.environ.get("PROC_ROOT", "/proc")
+# seconds a restart count read with an inspect is reused
+RESTART_COUNT_MAX_AGE = float(os.environ.get("RESTART_COUNT_MAX_AGE", 60))
+
+# Readings and the container index shared by a single `manage.py run_collector` process with all web workers,
+# see api/shared_state.py and api/events.py. docker-entrypoint.sh starts it, run it next to `runserver` as well.
+# Set SHARED_STATE_PATH to an empty value to run a collector in every worker process instead.
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", str(BASE_DIR / "shared-state"))
+SHARED_STATE_SLOTS = int(os.environ.get("SHARED_STATE_SLOTS", 4096))
+
+# Full-text index of the server logs, see api/log_index.py
+# It is fed by the process running the stats collector, so it needs STATS_COLLECTOR_ENABLED or run_collector.
+LOG_INDEX_ENABLED = os.environ.get("LOG_INDEX_ENABLED", "True") == "True"
+LOG_INDEX_DIR = os.environ.get("LOG_INDEX_DIR", str(BASE_DIR / "log-index"))
+LOG_INDEX_SEGMENT_SECONDS = int(os.environ.get("LOG_INDEX_SEGMENT_SECONDS", 3600))
+LOG_INDEX_INTERVAL = float(os.environ.get("LOG_INDEX_INTERVAL", 5))
+# Sealed log segments are deleted once they are older than this or the archive of a server is larger than this
+LOG_ARCHIVE_RETENTION_DAYS = float(os.environ.get("LOG_ARCHIVE_RETENTION_DAYS", 30))
+LOG_ARCHIVE_MAX_MB = float(os.environ.get("LOG_ARCHIVE_MAX_MB", 1024))
+
+# ASGI deployment, see containerpanel/asgi.py and api/executors.py
+# "uvicorn" or "daphne" serve http and websockets from one event loop, empty serves the wsgi app with gunicorn
+ASGI_SERVER = os.environ.get("ASGI_SERVER", "")
+GRAPHQL_WORKERS = int(os.environ.get("GRAPHQL_WORKERS", 16))
+DOCKER_IO_WORKERS = int(os.environ.get("DOCKER_IO_WORKERS", 32))
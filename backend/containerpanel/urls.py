@@ -13,14 +13,21 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from graphene_django.views import GraphQLView
 
+from api.executors import offload_view
+
+graphql_view = GraphQLView.as_view(graphiql=True)
+if settings.ASGI_SERVER:  # sync views would share a single thread, see api/executors.py
+    graphql_view = offload_view(graphql_view)
+
 urlpatterns = [
     path('api/', include('api.urls')),
     path('api/oidc/', include('allauth.urls')),
     path('admin/', admin.site.urls),
-    path("api/graphql", GraphQLView.as_view(graphiql=True)),
+    path("api/graphql", graphql_view),
     path('', include('django_prometheus.urls')),
 ]
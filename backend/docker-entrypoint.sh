@@ -14,8 +14,30 @@ if [ -n "$DJANGO_SUPERUSER_EMAIL" ] && [ -n "$DJANGO_SUPERUSER_PASSWORD" ] ; the
     python manage.py createsuperuser --no-input
 fi
 
+# Start the stats collector shared by all workers, restarted whenever it exits.
+# It runs unless SHARED_STATE_PATH is set to an empty value, then every worker runs its own collector.
+if [ "${SHARED_STATE_PATH-default}" != "" ] ; then
+    echo "Starting stats collector"
+    (
+        while true ; do
+            python manage.py run_collector
+            echo "Stats collector exited with status $?, restarting in 5 seconds"
+            sleep 5
+        done
+    ) &
+fi
+
 # Start server
 echo "Starting server"
-#uvicorn containerpanel.asgi:application
-gunicorn containerpanel.wsgi --bind 0.0.0.0:8000
+case "$ASGI_SERVER" in
+    uvicorn)
+        uvicorn containerpanel.asgi:application --host 0.0.0.0 --port 8000
+        ;;
+    daphne)
+        daphne --bind 0.0.0.0 --port 8000 containerpanel.asgi:application
+        ;;
+    *)
+        gunicorn containerpanel.wsgi --bind 0.0.0.0:8000
+        ;;
+esac
 